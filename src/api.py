@@ -1,72 +1,139 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory
+from werkzeug.sansio.multipart import MultipartDecoder, Data, Epilogue, Field, File, NeedData
 import os
+import logging
+import uuid
 import threading
 from dotenv import load_dotenv
 
-from .character_manager import CharacterManager
-from .llm_service import LLMService
-from .volcano_engine_service import VolcanoEngineService
-from .audiobook_generator import AudiobookGenerator
+from .job_queue import FINISHED_STATUSES, JobQueue, JobWorkerPool, QueueFullError
+from .services import open_generator
+from .audio_assembler import StreamingAudioAssembler
+from .voice_catalog import get_voice_catalog
+from .metrics import REGISTRY, Gauge
 
 app = Flask(__name__)
 load_dotenv() # Load environment variables
 
-# Global dictionary to store generation status and results
-# In a real-world scenario, this would be a database or a more robust task queue
-GENERATION_STATUS = {}
+UPLOAD_BLOCK_SIZE = 64 * 1024
 
-# Load Volcano Engine voice metadata from JSON file
-VOICE_METADATA_FILE = os.path.join(os.path.dirname(__file__), 'voice_metadata.json')
-with open(VOICE_METADATA_FILE, 'r', encoding='utf-8') as f:
-    VOLCANO_VOICE_METADATA = json.load(f)
+JOBS = Gauge("audiobook_jobs", "API jobs by status.", ("status",))
 
-def generate_audiobook_task(task_id, text_content, project_id):
-    GENERATION_STATUS[task_id] = {"status": "processing", "progress": "Initializing..."}
-    try:
-        # Initialize services (credentials loaded from .env)
-        manager = CharacterManager(base_dir=os.path.join(os.getcwd(), "output_audio"))
-        if not manager.get_voice_id("旁白"):
-            manager.set_voice_id("旁白", "zh_male_jieshuoxiaoming_moon_bigtts")
+# Jobs wait in a persistent queue and are run by a fixed number of workers
+JOB_POOL = None
+JOB_POOL_LOCK = threading.Lock()
+
+def get_job_pool():
+    """Returns the job worker pool, starting it (and resuming interrupted jobs) on first use."""
+    global JOB_POOL
+    with JOB_POOL_LOCK:
+        if JOB_POOL is None:
+            job_queue = JobQueue(os.getenv("JOB_DB_PATH", os.path.join(os.getcwd(), "output_audio", "jobs.db")),
+                                 max_queued=int(os.getenv("JOB_QUEUE_SIZE", "20")))
+            JOB_POOL = JobWorkerPool(job_queue, generate_audiobook_task, workers=int(os.getenv("JOB_WORKERS", "2"))).start()
+        return JOB_POOL
 
+def generate_audiobook_task(job, cancel_event):
+    """Runs one queued job. Returns the result stored with the job, or None if generation failed."""
+    task_id, text_content, project_id = job["id"], job["text"], job["project_id"]
+    # Uploaded books are read straight from the upload file, possibly while it is still being written
+    text_file_path = job.get("source_path")
+    input_complete = (lambda: upload_complete(text_file_path)) if text_file_path else None
+    try:
+        # Credentials are loaded from .env
         llm_endpoint = os.getenv("LLM_ENDPOINT")
         llm_api_key = os.getenv("LLM_API_KEY")
         if not llm_endpoint or not llm_api_key:
             raise ValueError("LLM_ENDPOINT or LLM_API_KEY not set in .env file or environment.")
-        llm_service = LLMService(llm_endpoint, manager)
-
         tts_app_id = os.getenv("TTS_APP_ID")
         tts_access_key = os.getenv("TTS_ACCESS_KEY")
         tts_resource_id = os.getenv("TTS_RESOURCE_ID")
         if not tts_app_id or not tts_access_key or not tts_resource_id:
             raise ValueError("TTS_APP_ID, TTS_ACCESS_KEY, or TTS_RESOURCE_ID not set in .env file or environment.")
-        volcano_service = VolcanoEngineService(tts_app_id, tts_access_key, tts_resource_id)
 
-        generator = AudiobookGenerator(
-            llm_service=llm_service,
-            volcano_service=volcano_service,
-            character_manager=manager,
-            output_base_dir=os.path.join(os.getcwd(), "output_audio")
-        )
+        with open_generator(project_id, llm_endpoint, tts_app_id, tts_access_key, tts_resource_id) as generator:
+            if not text_file_path:
+                # Create a temporary file for the text content
+                text_file_path = os.path.join(os.getcwd(), "temp_input", f"{task_id}.txt")
+                os.makedirs(os.path.dirname(text_file_path), exist_ok=True)
+                with open(text_file_path, "w", encoding="utf-8") as f:
+                    f.write(text_content)
 
-        # Create a temporary file for the text content
-        temp_text_file_path = os.path.join(os.getcwd(), "temp_input", f"{task_id}.txt")
-        os.makedirs(os.path.dirname(temp_text_file_path), exist_ok=True)
-        with open(temp_text_file_path, "w", encoding="utf-8") as f:
-            f.write(text_content)
+            get_job_pool().job_queue.set_progress(task_id, "Generating...")
+            final_audiobook_path = generator.generate_audiobook(text_file_path, project_id, cancel_event=cancel_event, input_complete=input_complete)
 
-        final_audiobook_path = generator.generate_audiobook(temp_text_file_path, project_id)
+            incomplete_paragraphs = generator.incomplete_paragraphs
 
-        os.remove(temp_text_file_path) # Clean up temporary file
-        os.rmdir(os.path.dirname(temp_text_file_path)) # Clean up temporary directory
+        if not final_audiobook_path:
+            return None
+        result = {"file_path": final_audiobook_path, "download_url": f"/download/{os.path.basename(final_audiobook_path)}"}
+        if incomplete_paragraphs:
+            # Text chunks whose annotation or audio failed are missing from the book; running the job again retries them
+            result.update(incomplete=True, incomplete_paragraphs=[i + 1 for i in incomplete_paragraphs])
+        return result
+    finally:
+        # Clean up the temporary or uploaded input
+        if text_file_path:
+            discard_upload(text_file_path)
 
-        if final_audiobook_path:
-            GENERATION_STATUS[task_id] = {"status": "completed", "file_path": final_audiobook_path, "download_url": f"/download/{os.path.basename(final_audiobook_path)}"}
-        else:
-            GENERATION_STATUS[task_id] = {"status": "failed", "message": "Audiobook generation failed."}
+def upload_complete(source_path):
+    """Tells whether the upload into source_path has finished. Raises if it failed."""
+    marker_path = f"{source_path}.done"
+    if not os.path.exists(marker_path):
+        return False
+    with open(marker_path, "r", encoding="utf-8") as f:
+        state = f.read()
+    if state != "ok":
+        raise RuntimeError(f"Upload failed: {state}")
+    return True
 
-    except Exception as e:
-        GENERATION_STATUS[task_id] = {"status": "failed", "message": str(e)}
-    print(f"Task {task_id} finished with status: {GENERATION_STATUS[task_id]['status']}")
+def finish_upload(source_path, state, task_id):
+    """
+    Records that the upload into source_path ended, "ok" or the reason it failed.
+    If the job has already finished (cancelled while queued, or failed before the upload was
+    complete) nothing will read the file any more, so it is removed instead.
+    """
+    with open(f"{source_path}.done", "w", encoding="utf-8") as f:
+        f.write(state)
+    job = get_job_pool().job_queue.get(task_id)
+    if job is None or job["status"] in FINISHED_STATUSES:
+        discard_upload(source_path)
+
+def discard_upload(source_path):
+    """Removes an input file and its upload marker."""
+    for path in (source_path, f"{source_path}.done"):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def multipart_events(stream, boundary):
+    """
+    Parses a multipart/form-data body as it is read and yields ("field", name, value) for form fields,
+    ("file", name, data) for each piece of a file and ("file_end", name, None) when a file is complete.
+    """
+    decoder = MultipartDecoder(boundary.encode("latin-1"), max_form_memory_size=1024 * 1024)
+    part = None
+    field_value = bytearray()
+    while True:
+        block = stream.read(UPLOAD_BLOCK_SIZE)
+        decoder.receive_data(block or None)
+        event = decoder.next_event()
+        while not isinstance(event, (NeedData, Epilogue)):
+            if isinstance(event, (Field, File)):
+                part = event
+                field_value = bytearray()
+            elif isinstance(event, Data) and isinstance(part, File):
+                yield "file", part.name, event.data
+                if not event.more_data:
+                    yield "file_end", part.name, None
+            elif isinstance(event, Data):
+                field_value += event.data
+                if not event.more_data:
+                    yield "field", part.name, field_value.decode("utf-8")
+            event = decoder.next_event()
+        if isinstance(event, Epilogue) or not block:
+            return
 
 @app.route("/generate_audiobook", methods=["POST"])
 def generate_audiobook_api():
@@ -79,22 +146,156 @@ def generate_audiobook_api():
 
     if not text_content:
         return jsonify({"error": "'text' field is required"}), 400
+    try:
+        priority = int(data.get("priority", 0)) # Higher runs first
+    except (TypeError, ValueError):
+        return jsonify({"error": "'priority' must be an integer"}), 400
 
-    task_id = str(uuid.uuid4())
-    GENERATION_STATUS[task_id] = {"status": "queued", "progress": "Waiting to start..."}
+    try:
+        task_id = get_job_pool().submit(text_content, project_id, priority)
+    except QueueFullError:
+        return jsonify({"error": "Too many audiobooks are waiting to be generated, retry later"}), 429, {"Retry-After": "60"}
 
-    # Run the generation in a separate thread
-    thread = threading.Thread(target=generate_audiobook_task, args=(task_id, text_content, project_id))
-    thread.start()
+    return jsonify({"task_id": task_id, "status_url": f"/status/{task_id}", "cancel_url": f"/cancel/{task_id}"}), 202
 
-    return jsonify({"task_id": task_id, "status_url": f"/status/{task_id}"}), 202
+@app.route("/upload_audiobook", methods=["POST"])
+def upload_audiobook_api():
+    # The book is streamed to disk as it arrives and its job is queued as soon as the text starts,
+    # so generation can begin before the upload has finished and the book is never held in memory.
+    # Accepts multipart/form-data (fields before the file) or the raw text as the request body with
+    # project_id and priority in the query string. UTF-8 and GBK/GB18030 are detected.
+    fields = {"project_id": request.args.get("project_id"), "priority": request.args.get("priority", "0")}
+    if request.mimetype == "multipart/form-data":
+        boundary = request.mimetype_params.get("boundary")
+        if not boundary:
+            return jsonify({"error": "Missing multipart boundary"}), 400
+        events = multipart_events(request.stream, boundary)
+    else:
+        events = (("file", None, block) for block in iter(lambda: request.stream.read(UPLOAD_BLOCK_SIZE), b""))
+
+    max_bytes = int(os.getenv("UPLOAD_MAX_MB", "200")) * 1024 * 1024
+    source_path = None
+    task_id = None
+    upload = None
+    received = 0
+    try:
+        for kind, name, data in events:
+            if kind == "field":
+                fields[name] = data
+                continue
+            if upload is None and task_id is not None:
+                continue # Only the first file is read
+            if kind == "file_end":
+                upload.close()
+                upload = None
+                continue
+            if task_id is None:
+                try:
+                    priority = int(fields.get("priority") or 0) # Higher runs first
+                except ValueError:
+                    return jsonify({"error": "'priority' must be an integer"}), 400
+                project_id = fields.get("project_id") or f"api_audiobook_{uuid.uuid4().hex[:8]}"
+                source_path = os.path.join(os.getcwd(), "temp_input", f"upload_{uuid.uuid4().hex}.txt")
+                os.makedirs(os.path.dirname(source_path), exist_ok=True)
+                upload = open(source_path, "wb")
+                try:
+                    task_id = get_job_pool().submit(None, project_id, priority, source_path=source_path)
+                except QueueFullError:
+                    upload.close()
+                    os.remove(source_path)
+                    return jsonify({"error": "Too many audiobooks are waiting to be generated, retry later"}), 429, {"Retry-After": "60"}
+            received += len(data)
+            if received > max_bytes:
+                finish_upload(source_path, f"larger than {max_bytes // (1024 * 1024)} MB", task_id)
+                return jsonify({"error": "Upload exceeds UPLOAD_MAX_MB", "task_id": task_id}), 413
+            if get_job_pool().job_queue.get(task_id)["status"] in FINISHED_STATUSES:
+                # Cancelled, or failed before the upload was complete: stop receiving the book
+                finish_upload(source_path, "job finished before the upload", task_id)
+                return jsonify({"error": "The task ended before the upload was complete", "task_id": task_id}), 409
+            upload.write(data)
+            upload.flush() # Make it visible to the job reading the file
+    except Exception as e:
+        if source_path:
+            finish_upload(source_path, str(e) or type(e).__name__, task_id)
+        return jsonify({"error": f"Upload failed: {e}", "task_id": task_id}), 400
+    finally:
+        if upload is not None:
+            upload.close()
+
+    if task_id is None:
+        return jsonify({"error": "No text was uploaded"}), 400
+    if not received:
+        finish_upload(source_path, "empty upload", task_id)
+        return jsonify({"error": "No text was uploaded", "task_id": task_id}), 400
+    finish_upload(source_path, "ok", task_id)
+    return jsonify({"task_id": task_id, "status_url": f"/status/{task_id}", "cancel_url": f"/cancel/{task_id}", "bytes": received}), 202
+
+def job_status(job):
+    status = {key: job[key] for key in ("status", "project_id", "priority") if job.get(key) is not None}
+    for key in ("progress", "message"):
+        if job.get(key):
+            status[key] = job[key]
+    status.update(job.get("result") or {})
+    streaming = float(os.getenv("STREAM_SEGMENT_SECONDS", "10")) > 0
+    if streaming and job.get("status") in ("processing", "completed"):
+        status["playlist_url"] = f"/stream/{job['id']}/playlist.m3u8"
+    return status
 
 @app.route("/status/<task_id>")
 def get_status(task_id):
-    status = GENERATION_STATUS.get(task_id)
-    if not status:
+    job = get_job_pool().job_queue.get(task_id)
+    if not job:
+        return jsonify({"error": "Task not found"}), 404
+    return jsonify(job_status(job))
+
+@app.route("/cancel/<task_id>", methods=["POST"])
+def cancel_task(task_id):
+    job = get_job_pool().cancel(task_id)
+    if not job:
         return jsonify({"error": "Task not found"}), 404
-    return jsonify(status)
+    # A job cancelled before it started never reads its upload. An upload still in progress
+    # removes the file itself when it finishes; a completed one is removed here.
+    if job["status"] == "cancelled" and job.get("started_at") is None and job.get("source_path") \
+            and os.path.exists(f"{job['source_path']}.done"):
+        discard_upload(job["source_path"])
+    return jsonify(job_status(job))
+
+@app.route("/stream/<task_id>/<filename>")
+def stream_file(task_id, filename):
+    # HLS playlist and audio parts of a task, published while it is still being generated.
+    # Range requests are supported, so players can seek and resume within a part.
+    job = get_job_pool().job_queue.get(task_id)
+    if not job:
+        return jsonify({"error": "Task not found"}), 404
+    stream_dir = os.path.join(os.getcwd(), "output_audio", f"{job['project_id']}_stream")
+    if filename == StreamingAudioAssembler.PLAYLIST_FILENAME:
+        # A queued task has published nothing yet; a playlist found there belongs to an earlier run of the project
+        if job["status"] == "queued" or not os.path.exists(os.path.join(stream_dir, filename)):
+            return jsonify({"error": "No audio has been published yet", "status": job["status"]}), 404, {"Retry-After": "5"}
+        response = send_from_directory(stream_dir, filename, mimetype="application/vnd.apple.mpegurl")
+        response.headers["Cache-Control"] = "no-cache" # The playlist grows while the task runs
+        return response
+    return send_from_directory(stream_dir, filename, mimetype="audio/mpeg")
+
+@app.route("/metrics")
+def metrics():
+    # Prometheus text format: LLM, TTS and pipeline metrics of this process plus the job queue
+    counts = get_job_pool().job_queue.counts()
+    for status in ("queued", "processing", "completed", "failed", "cancelled"):
+        JOBS.labels(status=status).set(counts.get(status, 0))
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/jobs")
+def list_job_counts():
+    return jsonify(get_job_pool().job_queue.counts())
+
+@app.route("/voices")
+def list_voices():
+    # Optional filters: ?gender=female&age=young&tone=...&emotion=...&scenario=...
+    catalog = get_voice_catalog()
+    filters = {field: request.args.get(field) for field in ("gender", "age", "tone", "emotion", "scenario")}
+    voice_ids = catalog.find(**filters)
+    return jsonify({voice_id: catalog.get(voice_id) for voice_id in voice_ids})
 
 @app.route("/download/<filename>")
 def download_file(filename):
@@ -102,6 +303,11 @@ def download_file(filename):
     return send_from_directory(output_dir, filename, as_attachment=True)
 
 if __name__ == "__main__":
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
     # Ensure output_audio directory exists for CharacterManager and AudiobookGenerator
     os.makedirs(os.path.join(os.getcwd(), "output_audio"), exist_ok=True)
+    # Resume interrupted jobs right away. The reloader runs this block in a watcher process too;
+    # only the serving process (WERKZEUG_RUN_MAIN) starts workers.
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        get_job_pool()
     app.run(debug=True, port=5000)
@@ -0,0 +1,364 @@
+import os
+import json
+import math
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pydub import AudioSegment
+
+from .audio_mastering import AudioMastering
+
+
+def encode_pcm_file(pcm_path: str, output_path: str, sample_rate: int, channels: int, bitrate: str, output_format: str = "mp3", metadata: dict = None):
+    """
+    Encodes a raw 16-bit PCM file with ffmpeg.
+    MP3 output is written without a Xing header so that encoded files can be joined byte for byte.
+    """
+    partial_path = f"{output_path}.part"
+    command = [
+        AudioSegment.converter, "-y", "-loglevel", "error",
+        "-f", "s16le", "-ar", str(sample_rate), "-ac", str(channels), "-i", pcm_path
+    ]
+    for key, value in (metadata or {}).items():
+        command += ["-metadata", f"{key}={value}"]
+    if output_format == "mp3":
+        command += ["-write_xing", "0"]
+    command += ["-b:a", bitrate, "-f", output_format, partial_path]
+    subprocess.run(command, check=True)
+    os.replace(partial_path, output_path)
+
+
+def _id3v2_length(header: bytes) -> int:
+    """Returns the length of the ID3v2 tag at the start of an MP3 file, or 0 if there is none."""
+    if len(header) < 10 or header[:3] != b"ID3":
+        return 0
+    size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+    footer = 10 if header[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+class StreamingAudioAssembler:
+    """
+    Assembles synthesized audio chapter by chapter.
+    PCM of the current chapter is appended to a spool file as segments arrive, so memory stays flat
+    and the work grows linearly with the length of the book. When a chapter is complete it is handed
+    to a pool of ffmpeg encoder processes while synthesis of the next chapter continues.
+    On close, the chapter MP3s are joined into the combined book without re-encoding, and an M4B
+    with chapter markers is produced if m4b_path is given.
+    If a mastering stage is given, every segment is trimmed and normalized before it is spooled,
+    and pauses are inserted at speaker changes and paragraph breaks.
+    If stream_dir is given, the audio is also published while it is produced: every stream_segment_ms
+    of audio is encoded to a numbered MP3 part, and playlist.m3u8 (an HLS event playlist) lists the
+    parts finished so far. A part never spans chapters, so the last part of a chapter may be shorter.
+    """
+    PLAYLIST_FILENAME = "playlist.m3u8"
+
+    def __init__(self, output_path: str, chapters_dir: str, m4b_path: str = None, sample_rate: int = 24000, channels: int = 1,
+                 bitrate: str = "160k", m4b_bitrate: str = "64k", max_encoders: int = None, mastering: AudioMastering = None,
+                 stream_dir: str = None, stream_segment_ms: int = 10000):
+        self.output_path = output_path
+        self.chapters_dir = chapters_dir
+        self.m4b_path = m4b_path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_width = 2 # 16-bit signed PCM is fed to the encoder
+        self.bitrate = bitrate
+        self.m4b_bitrate = m4b_bitrate
+        self.mastering = mastering
+        self.chapters = [] # Finished chapters in order: [{"index", "title", "file", "duration_ms", "paragraphs"}]
+        self.segment_count = 0
+        self.frames_written = 0
+        self.current_chapter_key = None # Caller's identifier for the chapter being spooled
+        self._current_chapter = None
+        self._spool = None
+        self._spool_paths = []
+        self._encodes = []
+        self._previous_voice_id = None
+        self._previous_paragraph_index = None
+        self.stream_dir = stream_dir
+        self.stream_segment_ms = stream_segment_ms
+        self._stream_buffer = bytearray() # PCM appended since the last stream part was cut
+        self._stream_parts = [] # [{"file", "duration_ms", "title", "encoded"}] in playback order
+        self._stream_lock = threading.Lock()
+        # The encoders are separate ffmpeg processes, so threads are enough to keep every core busy
+        self._encoder_pool = ThreadPoolExecutor(max_workers=max_encoders or os.cpu_count() or 1, thread_name_prefix="encoder")
+        os.makedirs(self.chapters_dir, exist_ok=True)
+        if self.stream_dir:
+            self._reset_stream_dir()
+
+    @property
+    def duration_ms(self) -> int:
+        """Duration of the audio appended so far, in milliseconds."""
+        return int(self.frames_written * 1000 / self.sample_rate)
+
+    def start_chapter(self, title: str = None, key=None):
+        """Finishes the current chapter, if any, and starts spooling a new one."""
+        self.finish_chapter()
+        self.current_chapter_key = key
+        index = len(self.chapters) + 1
+        spool_path = os.path.join(self.chapters_dir, f"chapter_{index:03d}.pcm")
+        self._current_chapter = {"index": index, "title": title or f"Chapter {index}", "file": f"chapter_{index:03d}.mp3", "frames": 0,
+                                 "paragraphs": []} # [{"index", "start_ms"}] for every paragraph that starts in this chapter
+        self._spool = open(spool_path, "wb")
+        self._spool_paths.append(spool_path)
+        self._previous_voice_id = None
+        self._previous_paragraph_index = None
+
+    def append_file(self, audio_file_path: str, voice_id: str = None, paragraph_index: int = None, paragraph_starts: list = None):
+        """
+        Appends an audio file to the current chapter.
+        Raw .pcm files (16-bit, in the output sample rate and channel layout) are copied without decoding;
+        anything else is decoded with pydub first.
+        paragraph_index identifies the source paragraph the segment starts in; any comparable key works.
+        paragraph_starts lists (paragraph_index, position) for the paragraphs beginning inside a segment
+        that spans several, position being the fraction of the segment where the paragraph starts.
+        """
+        if not audio_file_path.endswith(".pcm"):
+            self.append_segment(AudioSegment.from_file(audio_file_path), voice_id, paragraph_index, paragraph_starts)
+        elif self.mastering is not None:
+            with open(audio_file_path, "rb") as f:
+                self.append_pcm(f.read(), voice_id, paragraph_index, paragraph_starts)
+        else:
+            self._append_pcm_file(audio_file_path, paragraph_index, paragraph_starts)
+
+    def _mark_paragraphs(self, paragraph_index: int, paragraph_starts: list, start_frame: int, frames: int):
+        """Records the start time of paragraphs that begin in a segment placed at start_frame of the chapter."""
+        if paragraph_starts is None:
+            paragraph_starts = [(paragraph_index, 0.0)] if paragraph_index is not None else []
+        marked = self._current_chapter["paragraphs"]
+        for index, position in paragraph_starts:
+            if not marked or index > marked[-1]["index"]:
+                marked.append({"index": index, "start_ms": int((start_frame + position * frames) * 1000 / self.sample_rate)})
+
+    def _append_pcm_file(self, pcm_path: str, paragraph_index: int = None, paragraph_starts: list = None):
+        """Streams a raw PCM file into the spool without loading it into memory."""
+        frame_size = self.sample_width * self.channels
+        frames = os.path.getsize(pcm_path) // frame_size
+        if not frames:
+            return
+        if self._current_chapter is None:
+            self.start_chapter()
+        self._mark_paragraphs(paragraph_index, paragraph_starts, self._current_chapter["frames"], frames)
+        # Copy whole frames only, so a truncated file cannot misalign the rest of the chapter
+        remaining = frames * frame_size
+        with open(pcm_path, "rb") as f:
+            while remaining:
+                block = f.read(min(remaining, 1024 * 1024))
+                if not block:
+                    break
+                self._write_spool(block)
+                remaining -= len(block)
+        self._current_chapter["frames"] += frames
+        self.frames_written += frames
+        self.segment_count += 1
+        self._cut_stream_part()
+
+    def append_segment(self, audio_segment: AudioSegment, voice_id: str = None, paragraph_index: int = None, paragraph_starts: list = None):
+        """Appends a pydub AudioSegment, converting it to the output sample format first."""
+        audio_segment = audio_segment.set_frame_rate(self.sample_rate).set_channels(self.channels).set_sample_width(self.sample_width)
+        self.append_pcm(audio_segment.raw_data, voice_id, paragraph_index, paragraph_starts)
+
+    def append_pcm(self, pcm_data: bytes, voice_id: str = None, paragraph_index: int = None, paragraph_starts: list = None):
+        """
+        Appends one segment of raw 16-bit PCM in the output sample rate and channel layout
+        to the current chapter. voice_id and paragraph_index are used to place pauses when mastering.
+        """
+        if self.mastering is not None:
+            pcm_data = self.mastering.process(pcm_data)
+        if not pcm_data:
+            return
+        if self._current_chapter is None:
+            self.start_chapter()
+        frame_size = self.sample_width * self.channels
+        start_frame = self._current_chapter["frames"]
+        if self.mastering is not None:
+            pause = self.mastering.pause_between(self._previous_voice_id, self._previous_paragraph_index, voice_id, paragraph_index)
+            pcm_data = pause + pcm_data
+            start_frame += len(pause) // frame_size
+            self._previous_voice_id = voice_id
+            # A segment spanning several paragraphs ends in the last of them
+            self._previous_paragraph_index = paragraph_starts[-1][0] if paragraph_starts else paragraph_index
+        frames = len(pcm_data) // frame_size
+        self._mark_paragraphs(paragraph_index, paragraph_starts, start_frame, frames - (start_frame - self._current_chapter["frames"]))
+        self._write_spool(pcm_data)
+        self._current_chapter["frames"] += frames
+        self.frames_written += frames
+        self.segment_count += 1
+        self._cut_stream_part()
+
+    def _write_spool(self, pcm_data: bytes):
+        self._spool.write(pcm_data)
+        if self.stream_dir:
+            self._stream_buffer += pcm_data
+
+    def _reset_stream_dir(self):
+        """Removes the parts of an earlier run and publishes an empty playlist."""
+        os.makedirs(self.stream_dir, exist_ok=True)
+        for filename in os.listdir(self.stream_dir):
+            if filename.startswith("part_") or filename == self.PLAYLIST_FILENAME:
+                os.remove(os.path.join(self.stream_dir, filename))
+        self._write_playlist()
+
+    def _cut_stream_part(self, force: bool = False):
+        """
+        Hands the buffered PCM to the encoders in parts of exactly stream_segment_ms, cutting inside
+        segments if needed, so no part exceeds the playlist's target duration. If forced, the rest
+        of the buffer becomes a shorter final part.
+        """
+        if not self.stream_dir:
+            return
+        frame_size = self.sample_width * self.channels
+        part_size = max(1, int(self.stream_segment_ms * self.sample_rate / 1000)) * frame_size
+        while len(self._stream_buffer) >= part_size or (force and self._stream_buffer):
+            pcm_data = bytes(self._stream_buffer[:part_size])
+            del self._stream_buffer[:part_size]
+            with self._stream_lock:
+                part = {"file": f"part_{len(self._stream_parts) + 1:05d}.mp3",
+                        "duration_ms": len(pcm_data) // frame_size * 1000 / self.sample_rate,
+                        "title": self._current_chapter["title"], "encoded": False}
+                self._stream_parts.append(part)
+            self._encodes.append(self._encoder_pool.submit(self._encode_stream_part, part, pcm_data))
+
+    def _encode_stream_part(self, part: dict, pcm_data: bytes):
+        output_path = os.path.join(self.stream_dir, part["file"])
+        partial_path = f"{output_path}.part"
+        command = [
+            AudioSegment.converter, "-y", "-loglevel", "error",
+            "-f", "s16le", "-ar", str(self.sample_rate), "-ac", str(self.channels), "-i", "pipe:0",
+            "-write_xing", "0", "-b:a", self.bitrate, "-f", "mp3", partial_path
+        ]
+        subprocess.run(command, input=pcm_data, check=True)
+        os.replace(partial_path, output_path)
+        with self._stream_lock:
+            part["encoded"] = True
+            self._write_playlist()
+
+    def _write_playlist(self, ended: bool = False):
+        """
+        Writes the HLS playlist of the stream parts encoded so far, stopping at the first part
+        still being encoded so the listed parts are always contiguous.
+        """
+        ready = []
+        for part in self._stream_parts:
+            if not part["encoded"]:
+                break
+            ready.append(part)
+        # No part is longer than stream_segment_ms, so the target duration never changes while the
+        # playlist is live, as HLS requires
+        target_duration = math.ceil(self.stream_segment_ms / 1000)
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{target_duration}",
+                 "#EXT-X-MEDIA-SEQUENCE:0", "#EXT-X-PLAYLIST-TYPE:EVENT"]
+        for part in ready:
+            lines.append(f"#EXTINF:{part['duration_ms'] / 1000:.3f},{part['title']}")
+            lines.append(part["file"])
+        if ended:
+            lines.append("#EXT-X-ENDLIST")
+        playlist_path = os.path.join(self.stream_dir, self.PLAYLIST_FILENAME)
+        with open(f"{playlist_path}.part", "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(f"{playlist_path}.part", playlist_path)
+
+    def finish_chapter(self):
+        """Closes the current chapter's spool and queues it for encoding."""
+        if self._current_chapter is None:
+            return
+        self._cut_stream_part(force=True) # Stream parts never span chapters
+        self._spool.close()
+        chapter = self._current_chapter
+        chapter["duration_ms"] = int(chapter.pop("frames") * 1000 / self.sample_rate)
+        self._current_chapter = None
+        self._spool = None
+        self.current_chapter_key = None
+        self.chapters.append(chapter)
+        self._encodes.append(self._encoder_pool.submit(self._encode_chapter, chapter, self._spool_paths[-1]))
+
+    def _encode_chapter(self, chapter: dict, spool_path: str):
+        output_path = os.path.join(self.chapters_dir, chapter["file"])
+        encode_pcm_file(spool_path, output_path, self.sample_rate, self.channels, self.bitrate,
+                        metadata={"title": chapter["title"], "track": chapter["index"]})
+        if not self.m4b_path:
+            os.remove(spool_path) # The PCM is only kept around for the M4B export
+        print(f"Encoded chapter {chapter['index']} ({chapter['title']}): {output_path}")
+
+    def _write_combined(self):
+        """Joins the chapter MP3s into the combined book, dropping each file's ID3 tag."""
+        partial_path = f"{self.output_path}.part"
+        with open(partial_path, "wb") as out:
+            for chapter in self.chapters:
+                with open(os.path.join(self.chapters_dir, chapter["file"]), "rb") as f:
+                    f.seek(_id3v2_length(f.read(10)))
+                    shutil.copyfileobj(f, out)
+        os.replace(partial_path, self.output_path)
+
+    def _write_m4b(self):
+        """Encodes the spooled PCM of all chapters into one AAC M4B with chapter markers."""
+        metadata_path = os.path.join(self.chapters_dir, "chapters.ffmeta")
+        with open(metadata_path, "w", encoding="utf-8") as f:
+            f.write(";FFMETADATA1\n")
+            start_ms = 0
+            for chapter in self.chapters:
+                title = chapter["title"]
+                for special in "\\=;#\n":
+                    title = title.replace(special, "\\" + special)
+                f.write(f"[CHAPTER]\nTIMEBASE=1/1000\nSTART={start_ms}\nEND={start_ms + chapter['duration_ms']}\ntitle={title}\n")
+                start_ms += chapter["duration_ms"]
+
+        partial_path = f"{self.m4b_path}.part"
+        command = [
+            AudioSegment.converter, "-y", "-loglevel", "error",
+            "-f", "s16le", "-ar", str(self.sample_rate), "-ac", str(self.channels), "-i", "pipe:0",
+            "-i", metadata_path, "-map", "0:a", "-map_metadata", "1", "-map_chapters", "1",
+            "-c:a", "aac", "-b:a", self.m4b_bitrate, "-f", "mp4", partial_path
+        ]
+        process = subprocess.Popen(command, stdin=subprocess.PIPE)
+        try:
+            for spool_path in self._spool_paths:
+                with open(spool_path, "rb") as f:
+                    shutil.copyfileobj(f, process.stdin)
+        finally:
+            process.stdin.close()
+            return_code = process.wait()
+        if return_code != 0:
+            raise RuntimeError(f"Audio encoder exited with code {return_code} while writing {self.m4b_path}")
+        os.replace(partial_path, self.m4b_path)
+        os.remove(metadata_path)
+
+    def close(self) -> str:
+        """
+        Finishes the last chapter, waits for all encodes and writes the combined outputs.
+        Returns the path to the combined book, or None if nothing was appended.
+        """
+        self.finish_chapter()
+        try:
+            for encode in self._encodes:
+                encode.result()
+        finally:
+            self._encoder_pool.shutdown()
+        if not self.chapters:
+            return None
+        if self.stream_dir:
+            with self._stream_lock:
+                self._write_playlist(ended=True)
+
+        self._write_combined()
+        if self.m4b_path:
+            self._write_m4b()
+            for spool_path in self._spool_paths:
+                os.remove(spool_path)
+        with open(os.path.join(self.chapters_dir, "chapters.json"), "w", encoding="utf-8") as f:
+            json.dump(self.chapters, f, ensure_ascii=False, indent=4)
+        return self.output_path
+
+    def abort(self):
+        """Stops encoding and removes spooled and partially written output."""
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+        self._current_chapter = None
+        for encode in self._encodes:
+            encode.cancel()
+        self._encoder_pool.shutdown(wait=True)
+        for spool_path in self._spool_paths:
+            if os.path.exists(spool_path):
+                os.remove(spool_path)
@@ -0,0 +1,65 @@
+import numpy as np
+
+class AudioMastering:
+    """
+    Optional mastering stage applied to every segment before it is assembled.
+    Works on whole int16 sample arrays with NumPy: trims leading and trailing silence,
+    brings each segment to a common RMS loudness without letting peaks clip, and provides
+    the pauses inserted between speakers and between paragraphs.
+    """
+    def __init__(self, sample_rate: int = 24000, channels: int = 1, target_dbfs: float = -20.0, max_peak_dbfs: float = -1.0,
+                 silence_threshold_dbfs: float = -50.0, frame_ms: int = 10, edge_padding_ms: int = 30,
+                 speaker_pause_ms: int = 250, paragraph_pause_ms: int = 600):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.target_rms = 32768 * 10 ** (target_dbfs / 20)
+        self.max_peak = 32767 * 10 ** (max_peak_dbfs / 20)
+        self.silence_threshold_rms = 32768 * 10 ** (silence_threshold_dbfs / 20)
+        self.frame_length = max(1, sample_rate * frame_ms // 1000)
+        self.edge_padding = sample_rate * edge_padding_ms // 1000
+        self.speaker_pause_ms = speaker_pause_ms
+        self.paragraph_pause_ms = paragraph_pause_ms
+
+    def process(self, pcm_data: bytes) -> bytes:
+        """Trims and normalizes one segment of 16-bit PCM. Returns empty bytes if the segment is silent."""
+        samples = np.frombuffer(pcm_data, dtype=np.int16).reshape(-1, self.channels)
+        samples = self._trim_silence(samples)
+        if not len(samples):
+            return b""
+        return self._normalize(samples).tobytes()
+
+    def _trim_silence(self, samples: np.ndarray) -> np.ndarray:
+        """Cuts leading and trailing frames whose RMS is below the silence threshold, keeping a little padding."""
+        frame_count = len(samples) // self.frame_length
+        if frame_count == 0:
+            return samples
+        frames = samples[:frame_count * self.frame_length].reshape(frame_count, -1).astype(np.float32)
+        frame_rms = np.sqrt(np.mean(frames * frames, axis=1))
+        loud_frames = np.flatnonzero(frame_rms > self.silence_threshold_rms)
+        if not loud_frames.size:
+            return samples[:0]
+        start = max(0, loud_frames[0] * self.frame_length - self.edge_padding)
+        end = min(len(samples), (loud_frames[-1] + 1) * self.frame_length + self.edge_padding)
+        return samples[start:end]
+
+    def _normalize(self, samples: np.ndarray) -> np.ndarray:
+        """Scales the segment to the target RMS, reduced if needed so the peak stays below max_peak."""
+        values = samples.astype(np.float32)
+        rms = float(np.sqrt(np.mean(values * values)))
+        peak = float(np.max(np.abs(values)))
+        if rms == 0 or peak == 0:
+            return samples
+        gain = min(self.target_rms / rms, self.max_peak / peak)
+        return np.clip(np.rint(values * gain), -32768, 32767).astype(np.int16)
+
+    def silence(self, duration_ms: int) -> bytes:
+        """Returns duration_ms of digital silence as 16-bit PCM."""
+        return bytes(self.sample_rate * duration_ms // 1000 * self.channels * 2)
+
+    def pause_between(self, previous_voice_id: str, previous_paragraph_index: int, voice_id: str, paragraph_index: int) -> bytes:
+        """Returns the pause to insert before a segment given the segment before it."""
+        if previous_paragraph_index is not None and paragraph_index is not None and paragraph_index != previous_paragraph_index:
+            return self.silence(self.paragraph_pause_ms)
+        if previous_voice_id is not None and voice_id != previous_voice_id:
+            return self.silence(self.speaker_pause_ms)
+        return b""
@@ -1,22 +1,343 @@
 import os
 import json
-from pydub import AudioSegment
+import time
+import queue
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from .llm_service import LLMService
 from .volcano_engine_service import VolcanoEngineService
 from .character_manager import CharacterManager
+from .audio_assembler import StreamingAudioAssembler
+from .audio_mastering import AudioMastering
+from .project_manifest import ProjectManifest
+from .text_chunker import TextChunker
+from .text_reader import iter_text_lines
+from .metrics import Counter, Gauge, Histogram
+
+SEGMENTS = Counter("audiobook_segments_total", "Segments added to audiobooks (ok) or lost to failed synthesis (failed).", ("outcome",))
+CHECKPOINT_HITS = Counter("audiobook_checkpoint_hits_total", "Paragraph annotations and segments reused from a checkpoint.", ("kind",))
+ANNOTATION_QUEUE_DEPTH = Gauge("audiobook_annotation_queue_depth", "Annotated segments waiting for synthesis.")
+TTS_IN_FLIGHT = Gauge("audiobook_tts_in_flight", "TTS requests submitted and not yet finished.")
+ACTIVE_GENERATIONS = Gauge("audiobook_active_generations", "Audiobooks being generated.")
+GENERATION_SECONDS = Histogram("audiobook_generation_seconds", "Duration of finished audiobook generations.",
+                               buckets=(10, 30, 60, 300, 600, 1800, 3600, 7200, 14400, 28800))
+LAST_SEGMENTS_PER_SECOND = Gauge("audiobook_last_generation_segments_per_second", "Throughput of the last finished audiobook generation.")
+
+DEFAULT_TTS_WORKERS = 4 # TTS requests in flight when the TTS backend has no adaptive limit
+
+class GenerationCancelled(Exception):
+    """Raised inside generate_audiobook when its cancel_event is set."""
 
 class AudiobookGenerator:
-    def __init__(self, llm_service: LLMService, volcano_service: VolcanoEngineService, character_manager: CharacterManager, output_base_dir: str = "output_audio"):
+    def __init__(self, llm_service: LLMService, volcano_service: VolcanoEngineService, character_manager: CharacterManager, output_base_dir: str = "output_audio",
+                 max_tts_workers: int = None, tts_max_retries: int = 2, tts_retry_delay: float = 1.0, annotation_queue_size: int = 64,
+                 text_chunker: TextChunker = None, export_m4b: bool = False,
+                 mastering: AudioMastering = None, llm_batch_size: int = 1, coalesce_segments: bool = True,
+                 stream_segment_seconds: float = 0):
         self.llm_service = llm_service
         self.volcano_service = volcano_service
         self.character_manager = character_manager
         self.output_base_dir = output_base_dir
+        # Upper bound on TTS requests in flight; None follows the TTS host's adaptive limit up to its maximum
+        self.max_tts_workers = max(1, max_tts_workers) if max_tts_workers else None
+        self.tts_max_retries = tts_max_retries
+        self.tts_retry_delay = tts_retry_delay
+        self.annotation_queue_size = max(1, annotation_queue_size) # How far annotation may run ahead of synthesis
+        self.text_chunker = text_chunker or TextChunker() # Splits text into chapters, LLM chunks and TTS-sized segments
+        self.export_m4b = export_m4b # Also produce a single M4B with chapter markers
+        self.mastering = mastering # Optional loudness normalization, silence trimming and pauses
+        self.llm_batch_size = max(1, llm_batch_size) # Number of chunks annotated per LLM request
+        self.coalesce_segments = coalesce_segments # Merge adjacent segments of the same voice into one TTS request
+        self.stream_segment_seconds = stream_segment_seconds # Length of the parts published while generating, 0 to disable
+        self.incomplete_paragraphs = [] # Indexes of the paragraphs of the last run whose annotation or audio failed
         os.makedirs(self.output_base_dir, exist_ok=True)
 
-    def generate_audiobook(self, text_file_path: str, project_id: str = "default_project") -> str:
+    def _synthesize_segment(self, text_to_synthesize: str, speaker_voice_id: str, manifest: ProjectManifest, segment_key: str, parts: list = None) -> str:
+        """
+        Synthesizes a single segment, retrying only this segment on failure.
+        Runs on a TTS worker thread and checkpoints the segment as soon as it succeeds.
+        Returns the path to the audio file, or None if every attempt failed.
+        """
+        for attempt in range(self.tts_max_retries + 1):
+            try:
+                audio_file_path = self.volcano_service.synthesize_speech(
+                    text=text_to_synthesize,
+                    voice_type=speaker_voice_id,
+                    output_dir=manifest.project_output_dir, # Save individual chunks in project-specific dir
+                    output_filename=f"segment_{segment_key}.{self.volcano_service.audio_params['format']}" # Stable name so a resumed run can find it
+                )
+            except Exception as e:
+                print(f"Error synthesizing segment: {e}")
+                audio_file_path = None
+
+            if audio_file_path and os.path.exists(audio_file_path):
+                manifest.record_segment_audio(segment_key, text_to_synthesize, speaker_voice_id, audio_file_path, parts)
+                return audio_file_path
+
+            if attempt < self.tts_max_retries:
+                delay = self.tts_retry_delay * (2 ** attempt)
+                print(f"Retrying segment ({attempt + 1}/{self.tts_max_retries}) in {delay:.1f}s: {text_to_synthesize[:50]}...")
+                time.sleep(delay)
+        return None
+
+    def _split_long_segments(self, annotated_segments: list) -> list:
+        """Splits segments whose text exceeds the TTS request length limit into several segments for the same speaker."""
+        split_segments = []
+        for segment in annotated_segments:
+            for text_part in self.text_chunker.split_for_tts(segment.get("text", "")):
+                split_segments.append(dict(segment, text=text_part))
+        return split_segments
+
+    @staticmethod
+    def _locate_lines(paragraph: str, text: str, cursor: int, previous_end_line: int) -> tuple:
+        """
+        Finds a segment's text in its paragraph, searching from cursor, and returns
+        (start_line, end_line, cursor): the source lines the text starts and ends on and where to
+        search for the next segment. Text the LLM reworded is searched by its first characters;
+        if it is still not found, it is taken to start a new line.
+        """
+        position = paragraph.find(text, cursor)
+        if position < 0:
+            position = paragraph.find(text[:10], cursor)
+            if position < 0:
+                return previous_end_line + 1, previous_end_line + 1, cursor
+        start_line = paragraph.count("\n", 0, position)
+        return start_line, start_line + text.count("\n"), min(len(paragraph), position + len(text))
+
+    def _annotate_paragraphs(self, paragraphs, manifest: ProjectManifest, annotation_queue: queue.Queue, stop_event: threading.Event):
+        """
+        Producer stage of the pipeline: annotates (chapter_index, paragraph) items in order, llm_batch_size
+        paragraphs per LLM request, and puts (paragraph_index, chapter_index, segment_index, segment) on the
+        bounded queue, blocking while it is full, followed by (paragraph_index, chapter_index, None, None) once
+        the paragraph is complete. Each segment records the source lines of the paragraph it starts and ends
+        on as "line" and "end_line". A paragraph annotated on its own is streamed, so its first segments reach
+        synthesis while the LLM is still writing the rest.
+        paragraphs may be a lazy iterator; it is consumed one batch at a time.
+        Ends with a None sentinel, or with the exception that stopped it.
+        """
+        def put(item):
+            # Waits for space, but gives up once the consumer has stopped
+            while not stop_event.is_set():
+                try:
+                    annotation_queue.put(item, timeout=0.5)
+                    ANNOTATION_QUEUE_DEPTH.inc()
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def emit(i, chapter_index, paragraph, annotated_segments, checkpoint):
+            emitted_segments = []
+            cursor, end_line = 0, 0
+            for segment in annotated_segments:
+                for split_segment in self._split_long_segments([segment]):
+                    line, end_line, cursor = self._locate_lines(paragraph, split_segment["text"], cursor, end_line)
+                    split_segment.update(line=line, end_line=end_line)
+                    if not put((i, chapter_index, len(emitted_segments), split_segment)):
+                        return False
+                    emitted_segments.append(split_segment)
+            if not put((i, chapter_index, None, None)):
+                return False
+            # Failed annotations are not checkpointed so that the next run retries them
+            if any(segment.get("llm_error") for segment in emitted_segments):
+                self.incomplete_paragraphs.append(i)
+            elif checkpoint and emitted_segments:
+                manifest.record_annotation(i, paragraph, emitted_segments)
+            return True
+
+        try:
+            paragraphs = iter(paragraphs)
+            batch_start = 0
+            while True:
+                batch = list(enumerate(itertools.islice(paragraphs, self.llm_batch_size), start=batch_start))
+                if not batch:
+                    break
+                batch_start += len(batch)
+                batch_results = {} # paragraph_index -> (annotated_segments, checkpoint)
+                to_annotate = []
+                for i, (chapter_index, paragraph) in batch:
+                    annotated_segments = manifest.get_annotation(i, paragraph)
+                    if annotated_segments is not None:
+                        CHECKPOINT_HITS.labels(kind="annotation").inc()
+                        print(f"\n--- Paragraph {i+1}: using checkpointed annotation ---")
+                        batch_results[i] = (annotated_segments, False)
+                    else:
+                        to_annotate.append((i, paragraph))
+
+                if len(to_annotate) > 1:
+                    print(f"\n--- Annotating paragraphs {', '.join(str(i + 1) for i, _ in to_annotate)} in one request ---")
+                    annotated_batch = self.llm_service.process_text_batch([paragraph for _, paragraph in to_annotate])
+                    for (i, _), annotated_segments in zip(to_annotate, annotated_batch):
+                        batch_results[i] = (annotated_segments, True)
+
+                for i, (chapter_index, paragraph) in batch:
+                    if i in batch_results:
+                        annotated_segments, checkpoint = batch_results[i]
+                    else:
+                        print(f"\n--- Annotating paragraph {i+1} ---")
+                        # LLM processing
+                        # The LLM prompt in llm_service.py already includes context (aliases, voices, metadata)
+                        annotated_segments, checkpoint = self.llm_service.process_text_chunk_stream(paragraph), True
+                    if not emit(i, chapter_index, paragraph, annotated_segments, checkpoint):
+                        return
+            put(None)
+        except Exception as e:
+            put(e)
+
+    @staticmethod
+    def _queued_segments(annotation_queue: queue.Queue, cancel_event: threading.Event = None, on_idle=None):
+        """
+        Yields the (paragraph_index, chapter_index, segment_index, segment) items of the annotation queue until its sentinel.
+        Raises GenerationCancelled if cancel_event is set, also while waiting for the annotator.
+        on_idle is called whenever the queue stays empty for a moment, so finished work can be handled meanwhile.
+        """
+        while True:
+            try:
+                item = annotation_queue.get(timeout=0.5)
+            except queue.Empty:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise GenerationCancelled()
+                if on_idle is not None:
+                    on_idle()
+                continue
+            ANNOTATION_QUEUE_DEPTH.dec()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def _coalesce(self, segments):
+        """
+        Merges adjacent segments of a paragraph that share a voice into runs, as long as the merged
+        text stays within the TTS request length limit. Segments from different source lines are joined
+        with a line break, so the TTS keeps the pause between them.
+        Yields one run at a time: {"chapter_index", "speaker_name", "voice_id", "text", "parts"}, where
+        parts records the split points as [{"paragraph_index", "segment_index", "line", "end_line", "start", "end"}]
+        offsets into text. A run is yielded as soon as the next segment cannot join it or its paragraph
+        ends, so the result is deterministic and a resumed run finds its checkpointed audio, and the
+        last run of a paragraph does not wait for the next paragraph's annotation.
+        """
+        max_chars = self.text_chunker.max_tts_chars if self.coalesce_segments else 0
+        run = None
+        for i, chapter_index, j, segment in segments:
+            if segment is None: # End of the paragraph
+                if run is not None:
+                    yield run
+                    run = None
+                continue
+            speaker_name = segment.get("speaker_name", "旁白")
+            speaker_voice_id = segment.get("speaker_voice_id", "narrator_voice_id")
+            text_to_synthesize = segment.get("text", "")
+
+            if not text_to_synthesize:
+                print(f"Skipping empty text segment for {speaker_name}.")
+                continue
+            if segment.get("llm_error"):
+                print(f"Skipping failed annotation of paragraph {i + 1}: {text_to_synthesize[:50]}...")
+                continue
+
+            line = segment.get("line", 0)
+            end_line = segment.get("end_line", line)
+            if run is not None:
+                separator = "\n" if run["parts"][-1]["end_line"] != line else ""
+                merged_length = len(run["text"]) + len(separator) + len(text_to_synthesize)
+                if run["voice_id"] == speaker_voice_id and merged_length <= max_chars:
+                    start = len(run["text"]) + len(separator)
+                    run["text"] += separator + text_to_synthesize
+                    run["parts"].append({"paragraph_index": i, "segment_index": j, "line": line, "end_line": end_line,
+                                         "start": start, "end": len(run["text"])})
+                    continue
+                yield run
+
+            run = {"chapter_index": chapter_index, "speaker_name": speaker_name, "voice_id": speaker_voice_id, "text": text_to_synthesize,
+                   "parts": [{"paragraph_index": i, "segment_index": j, "line": line, "end_line": end_line,
+                              "start": 0, "end": len(text_to_synthesize)}]}
+        if run is not None:
+            yield run
+
+    @staticmethod
+    def _paragraph_starts(run: dict) -> list:
+        """
+        Returns (paragraph_key, position) for the source paragraphs (lines) a run covers, position being
+        the fraction of the run's text where the paragraph starts. The key of a paragraph is
+        (paragraph_index, line): the LLM chunk and the line within it. The run's first part always
+        counts, even if it continues a line begun in an earlier run.
+        """
+        text = run["text"]
+        starts = []
+        previous_end_line = None
+        for part in run["parts"]:
+            i, line = part["paragraph_index"], part["line"]
+            if previous_end_line is None or line != previous_end_line:
+                starts.append(((i, line), part["start"] / len(text)))
+            # Line breaks inside the segment's own text
+            offset = text.find("\n", part["start"], part["end"])
+            while offset >= 0:
+                line += 1
+                starts.append(((i, line), (offset + 1) / len(text)))
+                offset = text.find("\n", offset + 1, part["end"])
+            previous_end_line = part["end_line"]
+        return starts
+
+    def _collect_finished(self, pending: deque, assembler: StreamingAudioAssembler, chapter_titles: list, wait: bool = False) -> int:
+        """
+        Appends finished synthesis results from the front of `pending` to the assembler,
+        preserving source order and starting a new chapter whenever the chapter index changes.
+        Stops at the first unfinished future unless `wait` is True.
+        Returns the number of audio segments appended.
+        """
+        collected = 0
+        while pending and (wait or pending[0]["future"].done()):
+            entry = pending.popleft()
+            audio_file_path = entry["future"].result()
+            if audio_file_path:
+                try:
+                    if assembler.current_chapter_key != entry["chapter_index"]:
+                        # The previous chapter is complete and goes off to the encoder pool
+                        assembler.start_chapter(chapter_titles[entry["chapter_index"]], key=entry["chapter_index"])
+                    assembler.append_file(audio_file_path, entry["voice_id"], entry["paragraph_index"], entry["paragraph_starts"])
+                    SEGMENTS.labels(outcome="ok").inc()
+                    collected += 1
+                except Exception as e:
+                    SEGMENTS.labels(outcome="failed").inc()
+                    self.incomplete_paragraphs.append(entry["paragraph_index"][0])
+                    print(f"Error loading audio segment {audio_file_path}: {e}")
+            else:
+                SEGMENTS.labels(outcome="failed").inc()
+                self.incomplete_paragraphs.append(entry["paragraph_index"][0])
+                print(f"Failed to synthesize audio for segment: {entry['text'][:50]}...")
+        return collected
+
+    def _read_paragraphs(self, text_file_path: str, chapter_titles: list, encoding: str = None, input_complete=None):
+        """
+        Yields the (chapter_index, chunk) items of a text file lazily, reading it line by line, and
+        appends each chapter's title to chapter_titles when its first chunk is read.
+        """
+        chunk_count = 0
+        lines = iter_text_lines(text_file_path, encoding=encoding, is_complete=input_complete)
+        for chapter_index, title, chunk in self.text_chunker.iter_chunks(lines):
+            if chapter_index == len(chapter_titles):
+                chapter_titles.append(title)
+            chunk_count += 1
+            yield chapter_index, chunk
+        print(f"Read {len(chapter_titles)} chapter(s), {chunk_count} text chunk(s).")
+
+    def generate_audiobook(self, text_file_path: str, project_id: str = "default_project", cancel_event: threading.Event = None,
+                           encoding: str = None, input_complete=None) -> str:
         """
         Generates an audiobook from a text file.
         Returns the path to the final merged audiobook file.
+        The file is read lazily, so memory use does not depend on the size of the book. Its encoding
+        (UTF-8 or GBK/GB18030) is detected unless given. If input_complete is given, the file may still
+        be being written, e.g. by an upload; generation starts on the data already there and reads on
+        until input_complete() returns True.
+        Setting cancel_event stops the run between segments and returns None; finished work stays
+        checkpointed, so a later run resumes from there.
+        If the annotation or audio of some paragraphs failed, the book is still produced without them
+        and their indexes are left in incomplete_paragraphs; they are not checkpointed, so a re-run retries them.
         """
         print(f"\n--- Starting audiobook generation for {text_file_path} (Project ID: {project_id}) ---")
 
@@ -28,72 +349,163 @@ class AudiobookGenerator:
         # Create a directory for this project's audio chunks
         project_output_dir = os.path.join(self.output_base_dir, f"{project_id}_chunks")
         os.makedirs(project_output_dir, exist_ok=True)
+        # Finished annotations and segments are checkpointed here so a re-run resumes where it stopped
+        manifest = ProjectManifest(project_output_dir)
 
-        all_audio_segments = []
+        # Audio is spooled per chapter as segments finish, so the book is never held in memory.
+        # Each chapter is encoded to {project_id}_chapters as soon as it is complete.
+        # With streaming, short parts and an HLS playlist are published to {project_id}_stream as the audio is produced.
+        final_audiobook_path = os.path.join(self.output_base_dir, f"final_audiobook_{project_id}.mp3")
+        assembler = StreamingAudioAssembler(
+            final_audiobook_path,
+            chapters_dir=os.path.join(self.output_base_dir, f"{project_id}_chapters"),
+            m4b_path=os.path.join(self.output_base_dir, f"final_audiobook_{project_id}.m4b") if self.export_m4b else None,
+            sample_rate=self.volcano_service.audio_params["sample_rate"], # PCM from the TTS service is spooled as-is
+            mastering=self.mastering,
+            stream_dir=os.path.join(self.output_base_dir, f"{project_id}_stream") if self.stream_segment_seconds > 0 else None,
+            stream_segment_ms=int(self.stream_segment_seconds * 1000)
+        )
         segment_counter = 0
+        self.incomplete_paragraphs = []
+        start_time = time.perf_counter()
+        ACTIVE_GENERATIONS.inc()
 
         try:
-            with open(text_file_path, 'r', encoding='utf-8') as f:
-                full_text = f.read()
-
-            # Simple paragraph splitting. More sophisticated splitting might be needed for complex texts.
-            paragraphs = [p.strip() for p in full_text.split('\n\n') if p.strip()]
-
-            for i, paragraph in enumerate(paragraphs):
-                print(f"\n--- Processing paragraph {i+1}/{len(paragraphs)} ---")
-                # LLM processing
-                # The LLM prompt in llm_service.py already includes context (aliases, voices, metadata)
-                annotated_segments = self.llm_service.process_text_chunk(paragraph)
-
-                for segment in annotated_segments:
-                    speaker_name = segment.get("speaker_name", "旁白")
-                    speaker_voice_id = segment.get("speaker_voice_id", "narrator_voice_id")
-                    text_to_synthesize = segment.get("text", "")
-
-                    if not text_to_synthesize:
-                        print(f"Skipping empty text segment for {speaker_name}.")
-                        continue
-
-                    print(f"Synthesizing for {speaker_name} (Voice ID: {speaker_voice_id}): {text_to_synthesize[:50]}...")
-                    
-                    # Synthesize speech
-                    audio_file_path = self.volcano_service.synthesize_speech(
-                        text=text_to_synthesize,
-                        voice_type=speaker_voice_id,
-                        output_dir=project_output_dir # Save individual chunks in project-specific dir
-                    )
-
-                    if audio_file_path and os.path.exists(audio_file_path):
-                        try:
-                            audio_segment = AudioSegment.from_file(audio_file_path)
-                            all_audio_segments.append(audio_segment)
-                            segment_counter += 1
-                        except Exception as e:
-                            print(f"Error loading audio segment {audio_file_path}: {e}")
-                    else:
-                        print(f"Failed to synthesize audio for segment: {text_to_synthesize[:50]}...")
+            if not os.path.exists(text_file_path):
+                raise FileNotFoundError(text_file_path)
+
+            # Split into chapters, then pack each chapter's paragraphs into chunks sized to the LLM token budget.
+            # Chunks never cross a chapter boundary. The text is read as the annotator consumes the chunks;
+            # chapter_titles fills up along the way, always before the chapter's first segment is queued.
+            chapter_titles = []
+            stop_event = threading.Event()
 
-            if not all_audio_segments:
+            def input_ready():
+                # Waiting for more input ends as soon as the run stops, so the annotator can be joined
+                if stop_event.is_set():
+                    raise RuntimeError("Generation stopped while waiting for more input")
+                return input_complete()
+
+            paragraphs = self._read_paragraphs(text_file_path, chapter_titles, encoding, input_ready if input_complete else None)
+
+            # Annotation runs ahead of synthesis on its own thread. The bounded queue applies
+            # backpressure so the LLM never gets more than annotation_queue_size segments ahead.
+            annotation_queue = queue.Queue(maxsize=self.annotation_queue_size)
+            annotator = threading.Thread(target=self._annotate_paragraphs, args=(paragraphs, manifest, annotation_queue, stop_event), name="annotator", daemon=True)
+            annotator.start()
+
+            # Segments are synthesized on a worker pool sized to the most requests the TTS host's limiter
+            # may allow. Submission follows the limiter's current limit, so the pool keeps the host saturated
+            # (which is what lets the AIMD limit grow) and backs off when it throttles.
+            # `pending` keeps the futures in source order so the audio is reassembled exactly as it appears in the text.
+            limiter = self.volcano_service.concurrency_limiter()
+            max_workers = self.max_tts_workers or (int(limiter.max_limit) if limiter is not None else DEFAULT_TTS_WORKERS)
+            submitted = threading.Condition()
+            outstanding = 0
+            pending = deque()
+
+            def submission_limit():
+                return min(max_workers, max(1, int(limiter.limit))) if limiter is not None else max_workers
+
+            def finished(_):
+                nonlocal outstanding
+                TTS_IN_FLIGHT.dec()
+                with submitted:
+                    outstanding -= 1
+                    submitted.notify()
+
+            def collect_finished():
+                # Called while waiting for the annotator, so finished audio is not held back by the LLM
+                nonlocal segment_counter
+                segment_counter += self._collect_finished(pending, assembler, chapter_titles)
+
+            try:
+                with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts") as executor:
+                    for run in self._coalesce(self._queued_segments(annotation_queue, cancel_event, on_idle=collect_finished)):
+                        if cancel_event is not None and cancel_event.is_set():
+                            raise GenerationCancelled()
+                        speaker_name = run["speaker_name"]
+                        speaker_voice_id = run["voice_id"]
+                        text_to_synthesize = run["text"]
+                        parts = run["parts"]
+
+                        segment_key = manifest.run_key(parts)
+                        audio_file_path = manifest.get_segment_audio(segment_key, text_to_synthesize, speaker_voice_id)
+                        if audio_file_path:
+                            CHECKPOINT_HITS.labels(kind="segment").inc()
+                            future = Future()
+                            future.set_result(audio_file_path)
+                        else:
+                            merged = f" ({len(parts)} segments merged)" if len(parts) > 1 else ""
+                            print(f"Synthesizing for {speaker_name} (Voice ID: {speaker_voice_id}){merged}: {text_to_synthesize[:50]}...")
+
+                            # Blocks while the limiter's worth of requests is in flight. The limit can also
+                            # change without a request finishing, so it is checked again periodically.
+                            with submitted:
+                                while outstanding >= submission_limit():
+                                    submitted.wait(timeout=0.1)
+                                outstanding += 1
+                            TTS_IN_FLIGHT.inc()
+                            future = executor.submit(self._synthesize_segment, text_to_synthesize, speaker_voice_id, manifest, segment_key, parts)
+                            future.add_done_callback(finished)
+                        # Where each source paragraph begins within the run, so the assembler can place pauses and markers
+                        paragraph_starts = self._paragraph_starts(run)
+                        pending.append({"chapter_index": run["chapter_index"], "paragraph_index": paragraph_starts[0][0],
+                                        "paragraph_starts": paragraph_starts, "voice_id": speaker_voice_id,
+                                        "text": text_to_synthesize, "future": future})
+
+                        collect_finished()
+
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise GenerationCancelled()
+                    segment_counter += self._collect_finished(pending, assembler, chapter_titles, wait=True)
+            finally:
+                stop_event.set()
+                annotator.join()
+                ANNOTATION_QUEUE_DEPTH.dec(annotation_queue.qsize()) # Items left behind by a stopped run
+                self.character_manager.flush() # Save the voices assigned during this run
+
+            if not segment_counter:
                 print("No audio segments were generated. Aborting audiobook creation.")
+                assembler.abort()
                 return None
 
-            # Merge all audio segments
-            print(f"\n--- Merging {segment_counter} audio segments ---")
-            merged_audio = AudioSegment.empty()
-            for audio_seg in all_audio_segments:
-                merged_audio += audio_seg
-
-            final_audiobook_path = os.path.join(self.output_base_dir, f"final_audiobook_{project_id}.mp3")
-            merged_audio.export(final_audiobook_path, format="mp3")
+            print(f"\n--- Finalizing {segment_counter} audio segments ({assembler.duration_ms / 1000:.1f}s) ---")
+            assembler.close()
+            print(f"Encoded {len(assembler.chapters)} chapter(s) to: {assembler.chapters_dir}")
+            if self.export_m4b:
+                print(f"M4B with chapter markers saved to: {assembler.m4b_path}")
+            if self.volcano_service.cache is not None:
+                print(f"TTS cache stats: {self.volcano_service.cache.stats()}")
+            if self.llm_service.annotation_cache is not None:
+                print(f"Annotation cache stats: {self.llm_service.annotation_cache.stats()}")
+            print(f"HTTP concurrency limits: {self.volcano_service.http_client.stats()}")
+            print(f"LLM token usage: {self.llm_service.get_token_usage()}, chunks annotated locally: {self.llm_service.rule_annotated_chunks}")
+            elapsed = time.perf_counter() - start_time
+            GENERATION_SECONDS.observe(elapsed)
+            LAST_SEGMENTS_PER_SECOND.set(segment_counter / elapsed if elapsed else 0)
+            print(f"Generated {segment_counter} segments in {elapsed:.1f}s ({segment_counter / elapsed if elapsed else 0:.2f} segments/s)")
+            if self.incomplete_paragraphs:
+                self.incomplete_paragraphs = sorted(set(self.incomplete_paragraphs))
+                print(f"Warning: the audiobook is incomplete, text of paragraph(s) "
+                      f"{', '.join(str(i + 1) for i in self.incomplete_paragraphs)} is missing. Run again to retry them.")
             print(f"--- Audiobook generation complete! Saved to: {final_audiobook_path} ---")
             return final_audiobook_path
 
+        except GenerationCancelled:
+            print(f"--- Audiobook generation for {project_id} cancelled after {segment_counter} segments ---")
+            assembler.abort()
+            return None
         except FileNotFoundError:
             print(f"Error: Text file not found at {text_file_path}")
+            assembler.abort()
             return None
         except Exception as e:
             print(f"An unexpected error occurred during audiobook generation: {e}")
+            assembler.abort()
             return None
+        finally:
+            ACTIVE_GENERATIONS.dec()
 
 # Example Usage (for testing AudiobookGenerator in isolation)
 if __name__ == "__main__":
@@ -0,0 +1,166 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+
+class TTSCache:
+    """
+    Content-addressed on-disk cache of synthesized audio.
+    Entries are keyed by a hash of the text, speaker and audio parameters, so the same line
+    spoken by the same voice is only ever paid for once. When the cache grows past
+    max_bytes the least recently used entries are evicted.
+    """
+    def __init__(self, cache_dir: str, max_bytes: int = 2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict() # { key: size_in_bytes }, least recently used first
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_index()
+
+    @staticmethod
+    def make_key(text: str, speaker: str, audio_params: dict) -> str:
+        """Returns the content address for a synthesis request."""
+        key_source = json.dumps({"text": text, "speaker": speaker, "audio_params": audio_params}, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _load_index(self):
+        """Rebuilds the LRU order from file modification times, which are refreshed on every hit."""
+        found = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                stat = os.stat(os.path.join(root, name))
+                found.append((stat.st_mtime, name, stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+        self._evict()
+
+    def _evict(self):
+        """Drops least recently used entries until the cache fits its byte budget. Caller holds the lock or is __init__."""
+        while self._entries and self._total_bytes > self.max_bytes:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._entry_path(key))
+            except OSError:
+                pass
+
+    def get(self, key: str, destination_path: str) -> bool:
+        """
+        Copies the cached audio for `key` to destination_path.
+        Returns True on a hit, False on a miss.
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return False
+            self._entries.move_to_end(key)
+        entry_path = self._entry_path(key)
+        try:
+            shutil.copyfile(entry_path, destination_path)
+            os.utime(entry_path)
+        except OSError:
+            # Evicted or removed by another process between the lookup and the copy
+            with self._lock:
+                size = self._entries.pop(key, None)
+                if size is not None:
+                    self._total_bytes -= size
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def put(self, key: str, source_path: str):
+        """Stores a copy of source_path under `key`, evicting old entries if needed."""
+        entry_path = self._entry_path(key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        temp_path = f"{entry_path}.{threading.get_ident()}.tmp"
+        shutil.copyfile(source_path, temp_path)
+        os.replace(temp_path, entry_path)
+        size = os.path.getsize(entry_path)
+        with self._lock:
+            previous_size = self._entries.pop(key, None)
+            if previous_size is not None:
+                self._total_bytes -= previous_size
+            self._entries[key] = size
+            self._total_bytes += size
+            self._evict()
+
+    def stats(self) -> dict:
+        """Returns hit/miss counters and current size of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes
+            }
+
+
+class AnnotationCache:
+    """
+    Persistent cache of LLM annotations.
+    The key covers the paragraph text, the character state sent with the prompt,
+    the model name and the prompt version, so a hit is only returned when the LLM would
+    have been asked exactly the same question.
+    """
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(text: str, character_state: dict, model_name: str, prompt_version: int) -> str:
+        """Returns the cache key for annotating `text` under the given character state and model."""
+        key_source = json.dumps({"text": text, "character_state": character_state, "model": model_name, "prompt_version": prompt_version}, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> list:
+        """Returns the cached annotated segments for `key`, or None on a miss."""
+        try:
+            with open(self._entry_path(key), 'r', encoding='utf-8') as f:
+                segments = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return segments
+
+    def put(self, key: str, segments: list):
+        entry_path = self._entry_path(key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        temp_path = f"{entry_path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(segments, f, ensure_ascii=False)
+        os.replace(temp_path, entry_path)
+
+    def stats(self) -> dict:
+        """Returns hit/miss counters of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
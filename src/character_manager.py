@@ -1,42 +1,142 @@
 import json
 import os
+import atexit
+import threading
+import weakref
+
+# One lock per mapping file, shared by every CharacterManager in the process that uses it
+_PATH_LOCKS = {}
+_PATH_LOCKS_GUARD = threading.Lock()
+# Managers with unsaved changes are flushed when the interpreter exits
+_LIVE_MANAGERS = weakref.WeakSet()
+
+
+def _path_lock(path):
+    """Returns the process-wide lock for a file path."""
+    key = os.path.abspath(path)
+    with _PATH_LOCKS_GUARD:
+        if key not in _PATH_LOCKS:
+            _PATH_LOCKS[key] = threading.RLock()
+        return _PATH_LOCKS[key]
+
+
+def _write_json_atomic(path, data):
+    """Writes JSON to a temporary file and renames it over path, so readers never see a partial file."""
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def _read_json(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+@atexit.register
+def _flush_live_managers():
+    for manager in list(_LIVE_MANAGERS):
+        manager.flush()
+
 
 class CharacterManager:
-    def __init__(self, base_dir="."):
+    """
+    Character aliases and voices, persisted as two JSON files in base_dir.
+    Lookups go through an alias -> canonical name index. Mutations are thread-safe and are
+    written behind: changes are collected and saved together flush_interval seconds after the
+    first one (or on flush()), by merging them into the files' current contents and atomically
+    replacing the files, so several managers sharing output_audio never lose each other's updates.
+    """
+    def __init__(self, base_dir=".", flush_interval=2.0):
         self.aliases_file = os.path.join(base_dir, "character_aliases.json")
         self.voices_file = os.path.join(base_dir, "character_voices.json")
         self.character_aliases = {}  # { "canonical_name": ["alias1", "alias2"] }
         self.character_voices = {}   # { "canonical_name": "voice_id" }
+        self._alias_index = {}       # { "name_or_alias": "canonical_name" }
+        self.flush_interval = flush_interval
+        self._lock = threading.RLock()
+        self._dirty_aliases = set()  # Canonical names whose aliases changed since the last flush
+        self._dirty_voices = set()   # Canonical names whose voice changed since the last flush
+        self._flush_timer = None
         self._load_mappings()
+        _LIVE_MANAGERS.add(self)
 
     def _load_mappings(self):
-        if os.path.exists(self.aliases_file):
-            with open(self.aliases_file, 'r', encoding='utf-8') as f:
-                self.character_aliases = json.load(f)
-        if os.path.exists(self.voices_file):
-            with open(self.voices_file, 'r', encoding='utf-8') as f:
-                self.character_voices = json.load(f)
-
-    def _save_mappings(self):
-        with open(self.aliases_file, 'w', encoding='utf-8') as f:
-            json.dump(self.character_aliases, f, ensure_ascii=False, indent=4)
-        with open(self.voices_file, 'w', encoding='utf-8') as f:
-            json.dump(self.character_voices, f, ensure_ascii=False, indent=4)
+        with _path_lock(self.aliases_file), _path_lock(self.voices_file):
+            self.character_aliases = _read_json(self.aliases_file)
+            self.character_voices = _read_json(self.voices_file)
+        self._rebuild_index()
+
+    def _rebuild_index(self):
+        self._alias_index = {}
+        for canonical, aliases in self.character_aliases.items():
+            self._index_name(canonical, canonical)
+            for alias in aliases:
+                self._index_name(alias, canonical)
+
+    def _index_name(self, name, canonical):
+        # A name that already belongs to a character keeps pointing to it, as with the original linear search
+        if self._alias_index.get(name) is None or name == canonical:
+            self._alias_index[name] = canonical
+
+    def _schedule_flush(self):
+        """Starts the write-behind timer unless one is already pending."""
+        if self.flush_interval is None or self.flush_interval <= 0:
+            self.flush()
+        elif self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.flush_interval, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def flush(self):
+        """Saves pending changes now."""
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if not self._dirty_aliases and not self._dirty_voices:
+                return
+            dirty_aliases, self._dirty_aliases = self._dirty_aliases, set()
+            dirty_voices, self._dirty_voices = self._dirty_voices, set()
+            aliases = {name: list(self.character_aliases[name]) for name in dirty_aliases}
+            voices = {name: self.character_voices[name] for name in dirty_voices}
+
+        # Merge into what is on disk now, in case another manager saved in the meantime
+        with _path_lock(self.aliases_file), _path_lock(self.voices_file):
+            if aliases:
+                stored_aliases = _read_json(self.aliases_file)
+                for canonical, alias_list in aliases.items():
+                    merged = stored_aliases.setdefault(canonical, [])
+                    merged.extend(alias for alias in alias_list if alias not in merged)
+                _write_json_atomic(self.aliases_file, stored_aliases)
+            if voices:
+                stored_voices = _read_json(self.voices_file)
+                stored_voices.update(voices)
+                _write_json_atomic(self.voices_file, stored_voices)
+
+    def close(self):
+        """Saves pending changes and stops the write-behind timer."""
+        self.flush()
+        _LIVE_MANAGERS.discard(self)
 
     def get_canonical_name(self, name):
         """Given a name (could be alias), return its canonical name."""
-        for canonical, aliases in self.character_aliases.items():
-            if name == canonical or name in aliases:
-                return canonical
-        return None
+        return self._alias_index.get(name)
 
     def add_alias(self, canonical_name, alias):
         """Add an alias to a canonical character name."""
-        if canonical_name not in self.character_aliases:
-            self.character_aliases[canonical_name] = []
-        if alias not in self.character_aliases[canonical_name]:
-            self.character_aliases[canonical_name].append(alias)
-        self._save_mappings()
+        with self._lock:
+            alias_list = self.character_aliases.setdefault(canonical_name, [])
+            self._index_name(canonical_name, canonical_name)
+            if alias not in alias_list:
+                alias_list.append(alias)
+                self._index_name(alias, canonical_name)
+            self._dirty_aliases.add(canonical_name)
+            self._schedule_flush()
 
     def get_voice_id(self, canonical_name):
         """Get the voice ID for a canonical character name."""
@@ -44,20 +144,27 @@ class CharacterManager:
 
     def set_voice_id(self, canonical_name, voice_id):
         """Set the voice ID for a canonical character name."""
-        self.character_voices[canonical_name] = voice_id
-        self._save_mappings()
+        with self._lock:
+            if self.character_voices.get(canonical_name) == voice_id:
+                return
+            self.character_voices[canonical_name] = voice_id
+            self._dirty_voices.add(canonical_name)
+            self._schedule_flush()
 
     def get_all_characters(self):
         """Get a list of all canonical character names."""
-        return list(self.character_aliases.keys())
+        with self._lock:
+            return list(self.character_aliases.keys())
 
     def get_all_voice_mappings(self):
         """Get the full character-to-voice mapping."""
-        return self.character_voices.copy()
+        with self._lock:
+            return self.character_voices.copy()
 
     def get_all_alias_mappings(self):
         """Get the full character-to-alias mapping."""
-        return self.character_aliases.copy()
+        with self._lock:
+            return {canonical: list(aliases) for canonical, aliases in self.character_aliases.items()}
 
 if __name__ == "__main__":
     # Example Usage:
@@ -81,6 +188,7 @@ if __name__ == "__main__":
     print("Getting voice ID for '哈利波特':", manager.get_voice_id("哈利波特"))
 
     # Simulate loading in another session
+    manager.flush()
     print("\nSimulating new session load:")
     new_manager = CharacterManager()
     print("New session aliases:", new_manager.get_all_alias_mappings())
@@ -0,0 +1,115 @@
+import os
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS character_aliases (
+    project TEXT NOT NULL,
+    canonical TEXT NOT NULL,
+    alias TEXT NOT NULL,
+    UNIQUE (project, canonical, alias)
+);
+CREATE INDEX IF NOT EXISTS character_aliases_by_alias ON character_aliases (project, alias);
+CREATE TABLE IF NOT EXISTS character_voices (
+    project TEXT NOT NULL,
+    name TEXT NOT NULL,
+    voice_id TEXT NOT NULL,
+    PRIMARY KEY (project, name)
+);
+"""
+
+
+class SQLiteCharacterStore:
+    """
+    Character aliases and voices in a SQLite database, with the same interface as CharacterManager.
+    Every row belongs to a project, so books do not share (or slow down) each other's lookups.
+    The database runs in WAL mode: any number of threads and processes can read while one writes,
+    and every mutation is its own short transaction, visible to the others as soon as it commits.
+    Each thread uses its own connection; close() closes those of all threads.
+    """
+    def __init__(self, db_path, project_id="default_project", busy_timeout_ms=10000):
+        self.db_path = db_path
+        self.project_id = project_id
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Autocommit: each statement commits on its own, so writers hold the lock only briefly.
+            # Only this thread uses the connection; check_same_thread is off so close() can close it from any thread.
+            connection = sqlite3.connect(self.db_path, timeout=self.busy_timeout_ms / 1000, isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def flush(self):
+        """Every change is committed immediately; kept for interface compatibility with CharacterManager."""
+
+    def close(self):
+        """Closes the connections of all threads."""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
+
+    def get_canonical_name(self, name):
+        """Given a name (could be alias), return its canonical name."""
+        connection = self._connection()
+        row = connection.execute(
+            "SELECT canonical FROM character_aliases WHERE project = ? AND canonical = ? LIMIT 1",
+            (self.project_id, name)).fetchone()
+        if row is None:
+            row = connection.execute(
+                "SELECT canonical FROM character_aliases WHERE project = ? AND alias = ? ORDER BY rowid LIMIT 1",
+                (self.project_id, name)).fetchone()
+        return row[0] if row else None
+
+    def add_alias(self, canonical_name, alias):
+        """Add an alias to a canonical character name."""
+        self._connection().execute(
+            "INSERT OR IGNORE INTO character_aliases (project, canonical, alias) VALUES (?, ?, ?)",
+            (self.project_id, canonical_name, alias))
+
+    def get_voice_id(self, canonical_name):
+        """Get the voice ID for a canonical character name."""
+        row = self._connection().execute(
+            "SELECT voice_id FROM character_voices WHERE project = ? AND name = ?",
+            (self.project_id, canonical_name)).fetchone()
+        return row[0] if row else None
+
+    def set_voice_id(self, canonical_name, voice_id):
+        """Set the voice ID for a canonical character name."""
+        self._connection().execute(
+            "INSERT INTO character_voices (project, name, voice_id) VALUES (?, ?, ?) "
+            "ON CONFLICT (project, name) DO UPDATE SET voice_id = excluded.voice_id",
+            (self.project_id, canonical_name, voice_id))
+
+    def get_all_characters(self):
+        """Get a list of all canonical character names."""
+        return list(self.get_all_alias_mappings().keys())
+
+    def get_all_voice_mappings(self):
+        """Get the full character-to-voice mapping."""
+        return dict(self._connection().execute(
+            "SELECT name, voice_id FROM character_voices WHERE project = ? ORDER BY rowid", (self.project_id,)))
+
+    def get_all_alias_mappings(self):
+        """Get the full character-to-alias mapping."""
+        mappings = {}
+        for canonical, alias in self._connection().execute(
+                "SELECT canonical, alias FROM character_aliases WHERE project = ? ORDER BY rowid", (self.project_id,)):
+            mappings.setdefault(canonical, []).append(alias)
+        return mappings
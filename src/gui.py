@@ -3,10 +3,6 @@ from tkinter import filedialog, messagebox
 import os
 from dotenv import load_dotenv
 
-from .character_manager import CharacterManager
-from .llm_service import LLMService
-from .volcano_engine_service import VolcanoEngineService
-from .audiobook_generator import AudiobookGenerator
 
 class AudiobookApp:
     def __init__(self, master):
@@ -103,26 +99,20 @@ class AudiobookApp:
         self.master.update_idletasks()
 
         try:
-            # Initialize services
-            character_manager = CharacterManager(base_dir=os.path.join(os.getcwd(), "output_audio"))
-            
-            # Set a default voice for narrator if not already set
-            if not character_manager.get_voice_id("旁白"):
-                character_manager.set_voice_id("旁白", "zh_male_jieshuoxiaoming_moon_bigtts")
-
-            llm_service = LLMService(llm_endpoint, character_manager)
-            volcano_service = VolcanoEngineService(tts_app_id, tts_access_key, tts_resource_id)
-
-            generator = AudiobookGenerator(
-                llm_service=llm_service,
-                volcano_service=volcano_service,
-                character_manager=character_manager,
-                output_base_dir=os.path.join(os.getcwd(), "output_audio")
-            )
-
-            final_audiobook_path = generator.generate_audiobook(input_file, project_id)
-
-            if final_audiobook_path:
+            # The services (and pydub, NumPy, requests) are only imported once generation starts,
+            # so the window appears without waiting for them
+            from .services import open_generator
+
+            with open_generator(project_id, llm_endpoint, tts_app_id, tts_access_key, tts_resource_id) as generator:
+                final_audiobook_path = generator.generate_audiobook(input_file, project_id)
+                incomplete_paragraphs = generator.incomplete_paragraphs
+
+            if final_audiobook_path and incomplete_paragraphs:
+                self.status_label.config(text=f"Audiobook generated, but {len(incomplete_paragraphs)} text chunk(s) failed and are missing. "
+                                              "Generate again to retry them.", fg="orange")
+                self.output_link_label.config(text=f"Open Output Folder: {os.path.dirname(final_audiobook_path)}")
+                self.generated_folder = os.path.dirname(final_audiobook_path)
+            elif final_audiobook_path:
                 self.status_label.config(text="Audiobook generated successfully!", fg="green")
                 self.output_link_label.config(text=f"Open Output Folder: {os.path.dirname(final_audiobook_path)}")
                 self.generated_folder = os.path.dirname(final_audiobook_path)
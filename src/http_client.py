@@ -0,0 +1,203 @@
+import os
+import time
+import logging
+import random
+import threading
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Limits the number of requests in flight to one host with AIMD (additive increase,
+    multiplicative decrease): a successful request sent while every slot was taken raises the
+    limit by 1/limit, i.e. by about one per round of requests, and a throttled request halves it.
+    The limit only grows while the host is saturated, so it stays close to the concurrency in use.
+    Decreases are applied at most once per cooldown, so one burst of 429s does not collapse the limit.
+    """
+    def __init__(self, initial_limit: float = 4, min_limit: float = 1, max_limit: float = 64,
+                 decrease_factor: float = 0.5, cooldown: float = 1.0):
+        self.limit = float(initial_limit)
+        self.min_limit = float(min_limit)
+        self.max_limit = float(max_limit)
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Blocks until another request may be sent."""
+        with self._condition:
+            while self.in_flight >= max(1, int(self.limit)):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled: bool = False, failed: bool = False):
+        """
+        Frees a slot and adjusts the limit: down if the provider throttled the request, up if it
+        succeeded. A request that failed for another reason leaves the limit unchanged.
+        """
+        with self._condition:
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    self._last_decrease = now
+            elif saturated and not failed:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class HttpClient:
+    """
+    HTTP client shared by the LLM and TTS services.
+    Keeps pooled keep-alive connections in one requests.Session, applies a timeout to every
+    request, retries connection errors, timeouts, truncated bodies and 429/5xx responses with
+    jittered exponential backoff (honoring Retry-After), and limits concurrency per host with
+    an AIMD limiter.
+    With retry_read_timeouts disabled, a request whose response does not arrive within the read timeout
+    is not sent again, since the server may still be working on (and billing for) it.
+    """
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    THROTTLE_STATUSES = (429, 503)
+    RETRY_EXCEPTIONS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                        requests.exceptions.ChunkedEncodingError)
+
+    def __init__(self, timeout=(10, 120), max_retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 30.0,
+                 pool_maxsize: int = 64, initial_concurrency: int = 4, max_concurrency: int = 64, retry_read_timeouts: bool = True):
+        self.timeout = timeout # (connect, read) in seconds
+        self.max_retries = max_retries
+        self.retry_read_timeouts = retry_read_timeouts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.initial_concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._limiters = {}
+        self._limiters_lock = threading.Lock()
+
+    def limiter(self, url: str) -> AdaptiveConcurrencyLimiter:
+        """Returns the concurrency limiter of the URL's host."""
+        host = urlsplit(url).netloc
+        with self._limiters_lock:
+            if host not in self._limiters:
+                self._limiters[host] = AdaptiveConcurrencyLimiter(self.initial_concurrency, max_limit=self.max_concurrency)
+            return self._limiters[host]
+
+    def _backoff_delay(self, attempt: int, response: requests.Response = None) -> float:
+        """Delay before the next attempt: the server's Retry-After if given, otherwise full-jitter exponential backoff."""
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return min(self.backoff_max, max(0.0, float(retry_after)))
+            except ValueError:
+                try:
+                    return min(self.backoff_max, max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time()))
+                except (TypeError, ValueError):
+                    pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _send(self, method: str, url: str, **kwargs) -> tuple:
+        """
+        Sends a request with retries. Returns (response, limiter) with the limiter slot still held,
+        so that streamed responses keep their slot until the body has been read.
+        The last response is returned even if it has an error status; callers use raise_for_status().
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        limiter = self.limiter(url)
+        for attempt in range(self.max_retries + 1):
+            limiter.acquire()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except self.RETRY_EXCEPTIONS as e:
+                if isinstance(e, requests.exceptions.ReadTimeout) and not self.retry_read_timeouts:
+                    limiter.release(failed=True) # A slow answer is not a sign of throttling here
+                    raise
+                # A timeout usually means the provider is overloaded
+                timed_out = isinstance(e, requests.exceptions.Timeout)
+                limiter.release(throttled=timed_out, failed=not timed_out)
+                if attempt == self.max_retries:
+                    raise
+                delay = self._backoff_delay(attempt)
+                logger.warning("HTTP request to %s failed (%s); retrying in %.1fs (%d/%d)", url, e, delay, attempt + 1, self.max_retries)
+                time.sleep(delay)
+                continue
+            except BaseException:
+                limiter.release(failed=True) # Never keep the slot, or every later request to the host would wait forever
+                raise
+
+            if response.status_code not in self.RETRY_STATUSES or attempt == self.max_retries:
+                return response, limiter
+            limiter.release(throttled=response.status_code in self.THROTTLE_STATUSES)
+            delay = self._backoff_delay(attempt, response)
+            response.close()
+            logger.warning("HTTP %d from %s; retrying in %.1fs (%d/%d)", response.status_code, url, delay, attempt + 1, self.max_retries)
+            time.sleep(delay)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Sends a request with retries and returns the response with its body read."""
+        response, limiter = self._send(method, url, **kwargs)
+        limiter.release(throttled=response.status_code in self.THROTTLE_STATUSES)
+        return response
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    @contextmanager
+    def stream(self, method: str, url: str, **kwargs):
+        """
+        Context manager for a streamed response. The host's concurrency slot is held until
+        the block exits, and the connection is returned to the pool afterwards.
+        """
+        response, limiter = self._send(method, url, stream=True, **kwargs)
+        try:
+            yield response
+        finally:
+            response.close()
+            limiter.release(throttled=response.status_code in self.THROTTLE_STATUSES)
+
+    def stats(self) -> dict:
+        """Returns the current concurrency limit and requests in flight per host."""
+        with self._limiters_lock:
+            return {host: {"limit": round(limiter.limit, 2), "in_flight": limiter.in_flight} for host, limiter in self._limiters.items()}
+
+
+_DEFAULT_CLIENT = None
+_DEFAULT_CLIENT_LOCK = threading.Lock()
+
+
+def get_default_client() -> HttpClient:
+    """Returns the process-wide client, so all services share one connection pool and one limiter per host."""
+    global _DEFAULT_CLIENT
+    with _DEFAULT_CLIENT_LOCK:
+        if _DEFAULT_CLIENT is None:
+            _DEFAULT_CLIENT = HttpClient()
+        return _DEFAULT_CLIENT
+
+
+_LLM_CLIENT = None
+
+
+def get_llm_client() -> HttpClient:
+    """
+    Returns the process-wide client for LLM requests. A completion, especially of a batch of chunks,
+    can take minutes, so it has a longer read timeout (LLM_READ_TIMEOUT seconds, default 600), and a
+    request that timed out while the LLM was generating is not sent again.
+    """
+    global _LLM_CLIENT
+    with _DEFAULT_CLIENT_LOCK:
+        if _LLM_CLIENT is None:
+            _LLM_CLIENT = HttpClient(timeout=(10, float(os.getenv("LLM_READ_TIMEOUT", "600"))), retry_read_timeouts=False)
+        return _LLM_CLIENT
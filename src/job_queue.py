@@ -0,0 +1,248 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    project_id TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    progress TEXT,
+    message TEXT,
+    result TEXT,
+    text TEXT,
+    source_path TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, priority DESC, seq);
+"""
+
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+
+class QueueFullError(Exception):
+    """The job queue already holds max_queued jobs waiting to run."""
+
+
+class JobQueue:
+    """
+    Persistent priority queue of audiobook jobs in a SQLite database.
+    A job moves from queued to processing to completed, failed or cancelled. Higher priority
+    jobs are claimed first, jobs of equal priority in submission order. At most max_queued jobs
+    may wait; only the newest history_size finished jobs are kept. The input text is dropped
+    once a job has finished.
+    Meant to be served by one process: recover() puts the jobs that were processing when that
+    process stopped back in the queue.
+    """
+    def __init__(self, db_path: str, max_queued: int = 20, history_size: int = 1000):
+        self.db_path = db_path
+        self.max_queued = max_queued
+        self.history_size = history_size
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+        columns = {row[1] for row in self._connection.execute("PRAGMA table_info(jobs)")}
+        if "source_path" not in columns: # Databases created before uploads were supported
+            self._connection.execute("ALTER TABLE jobs ADD COLUMN source_path TEXT")
+
+    @staticmethod
+    def _to_dict(cursor, row):
+        job = {column[0]: value for column, value in zip(cursor.description, row)}
+        job.pop("seq", None)
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        if job.get("result"):
+            job["result"] = json.loads(job["result"])
+        return job
+
+    def _fetch_job(self, job_id: str, with_text: bool = False):
+        columns = "*" if with_text else "id, project_id, priority, status, progress, message, result, source_path, cancel_requested, created_at, started_at, finished_at, seq"
+        cursor = self._connection.execute(f"SELECT {columns} FROM jobs WHERE id = ?", (job_id,))
+        row = cursor.fetchone()
+        return self._to_dict(cursor, row) if row else None
+
+    def submit(self, text: str, project_id: str, priority: int = 0, source_path: str = None) -> str:
+        """
+        Adds a job and returns its id. Raises QueueFullError if max_queued jobs are already waiting.
+        The input is either text or, for large books, the path of a file holding it (source_path).
+        """
+        job_id = str(uuid.uuid4())
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                (queued,) = self._connection.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()
+                if queued >= self.max_queued:
+                    raise QueueFullError(f"{queued} jobs are already waiting")
+                self._connection.execute(
+                    "INSERT INTO jobs (id, project_id, priority, status, progress, text, source_path, created_at) VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)",
+                    (job_id, project_id, priority, "Waiting to start...", text, source_path, time.time()))
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+        return job_id
+
+    def claim(self):
+        """Marks the next queued job as processing and returns it with its text, or None if the queue is empty."""
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._connection.execute(
+                    "SELECT id FROM jobs WHERE status = 'queued' ORDER BY priority DESC, seq LIMIT 1").fetchone()
+                if row:
+                    self._connection.execute(
+                        "UPDATE jobs SET status = 'processing', progress = 'Initializing...', started_at = ? WHERE id = ?",
+                        (time.time(), row[0]))
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            return self._fetch_job(row[0], with_text=True) if row else None
+
+    def get(self, job_id: str):
+        """Returns a job without its text (but with its source_path), or None."""
+        with self._lock:
+            return self._fetch_job(job_id)
+
+    def set_progress(self, job_id: str, progress: str):
+        with self._lock:
+            self._connection.execute("UPDATE jobs SET progress = ? WHERE id = ? AND status = 'processing'", (progress, job_id))
+
+    def finish(self, job_id: str, status: str, message: str = None, result: dict = None):
+        """Records the outcome of a processing job and prunes old history."""
+        with self._lock:
+            self._connection.execute(
+                "UPDATE jobs SET status = ?, progress = NULL, message = ?, result = ?, text = NULL, finished_at = ? WHERE id = ?",
+                (status, message, json.dumps(result, ensure_ascii=False) if result is not None else None, time.time(), job_id))
+            self._connection.execute(
+                f"DELETE FROM jobs WHERE status IN {FINISHED_STATUSES} AND seq NOT IN "
+                f"(SELECT seq FROM jobs WHERE status IN {FINISHED_STATUSES} ORDER BY finished_at DESC LIMIT ?)",
+                (self.history_size,))
+
+    def cancel(self, job_id: str):
+        """
+        Cancels a job. A queued job is cancelled at once; a processing job is flagged and stops
+        at its next cancellation check. Returns the updated job, or None if it does not exist.
+        """
+        with self._lock:
+            self._connection.execute(
+                "UPDATE jobs SET status = 'cancelled', progress = NULL, text = NULL, finished_at = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), job_id))
+            self._connection.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'processing'", (job_id,))
+            return self._fetch_job(job_id)
+
+    def recover(self) -> int:
+        """
+        Requeues the jobs left processing by a previous run, or cancels them if that was requested.
+        Returns the number of requeued jobs.
+        """
+        with self._lock:
+            self._connection.execute(
+                "UPDATE jobs SET status = 'cancelled', progress = NULL, text = NULL, finished_at = ? WHERE status = 'processing' AND cancel_requested = 1",
+                (time.time(),))
+            cursor = self._connection.execute(
+                "UPDATE jobs SET status = 'queued', progress = 'Resuming after restart...', started_at = NULL WHERE status = 'processing'")
+            return cursor.rowcount
+
+    def counts(self) -> dict:
+        """Number of jobs per status."""
+        with self._lock:
+            return dict(self._connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"))
+
+
+class JobWorkerPool:
+    """
+    Fixed number of worker threads running jobs from a JobQueue.
+    handler(job, cancel_event) runs one job and returns a result dict, or None if it failed;
+    it should stop early once cancel_event is set.
+    """
+    def __init__(self, job_queue: JobQueue, handler, workers: int = 2, poll_interval: float = 1.0):
+        self.job_queue = job_queue
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Condition()
+        self._stopping = False
+        self._threads = []
+        self._running = {} # job_id -> cancel_event of the jobs processing in this pool
+
+    def start(self):
+        """Requeues interrupted jobs and starts the workers."""
+        recovered = self.job_queue.recover()
+        if recovered:
+            print(f"Resuming {recovered} job(s) interrupted by the last shutdown.")
+        for n in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{n}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        """Stops the workers once their current jobs are done."""
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, text: str, project_id: str, priority: int = 0, source_path: str = None) -> str:
+        """Queues a job and wakes an idle worker. Raises QueueFullError when the queue is full."""
+        job_id = self.job_queue.submit(text, project_id, priority, source_path)
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def cancel(self, job_id: str):
+        """Cancels a job; a job running in this pool is signalled right away. Returns the job or None."""
+        job = self.job_queue.cancel(job_id)
+        with self._wakeup:
+            cancel_event = self._running.get(job_id)
+        if cancel_event is not None:
+            cancel_event.set()
+        return job
+
+    def _work(self):
+        while True:
+            with self._wakeup:
+                if self._stopping:
+                    return
+            job = self.job_queue.claim()
+            if job is None:
+                with self._wakeup:
+                    if not self._stopping:
+                        self._wakeup.wait(self.poll_interval)
+                continue
+
+            cancel_event = threading.Event()
+            with self._wakeup:
+                self._running[job["id"]] = cancel_event
+            # A cancel that arrived between claim() and the line above was only recorded in the database
+            if self.job_queue.get(job["id"])["cancel_requested"]:
+                cancel_event.set()
+            print(f"Job {job['id']} started (project {job['project_id']}, priority {job['priority']}).")
+            try:
+                result = self.handler(job, cancel_event)
+                if cancel_event.is_set():
+                    self.job_queue.finish(job["id"], "cancelled", message="Cancelled by request.")
+                elif result is None:
+                    self.job_queue.finish(job["id"], "failed", message="Audiobook generation failed.")
+                else:
+                    self.job_queue.finish(job["id"], "completed", result=result)
+            except Exception as e:
+                self.job_queue.finish(job["id"], "failed", message=str(e))
+            finally:
+                with self._wakeup:
+                    self._running.pop(job["id"], None)
+            print(f"Job {job['id']} finished with status: {self.job_queue.get(job['id'])['status']}")
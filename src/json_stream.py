@@ -0,0 +1,128 @@
+import re
+import json
+
+
+class IncrementalJSONArrayParser:
+    """
+    Extracts the objects of a top-level JSON array from text that arrives in pieces,
+    such as a streamed LLM completion. feed() returns every object whose closing brace
+    arrived with the new text, so each one can be used before the array is complete.
+    Anything before the opening '[' (e.g. a ```json fence) is ignored.
+    """
+    def __init__(self):
+        self.started = False # The opening '[' has been seen
+        self.finished = False # The closing ']' has been seen
+        self.errors = 0 # Objects that were delimited but were not valid JSON
+        self._buffer = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, text: str) -> list:
+        """Consumes the next piece of text and returns the objects it completed."""
+        objects = []
+        for ch in text:
+            if self.finished:
+                break
+            if not self.started:
+                self.started = ch == "["
+                continue
+            if self._depth == 0:
+                # Between elements: only the start of the next object or the end of the array matters
+                if ch == "{":
+                    self._depth = 1
+                    self._buffer = [ch]
+                elif ch == "]":
+                    self.finished = True
+                continue
+
+            self._buffer.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        objects.append(json.loads("".join(self._buffer)))
+                    except json.JSONDecodeError:
+                        self.errors += 1
+                    self._buffer = []
+        return objects
+
+
+class JSONObjectStreamDecoder:
+    """
+    Splits a byte stream of concatenated or newline-delimited JSON objects, such as the
+    unidirectional TTS response, into objects regardless of where the network chunks end.
+    Only the bytes of the object in progress are buffered, and the scan jumps straight to the
+    next brace, quote or backslash, so long base64 payloads are passed over quickly.
+    """
+    _SPECIAL = re.compile(rb'[{}"\\]')
+
+    def __init__(self):
+        self.errors = 0 # Objects that were delimited but were not valid JSON
+        self._buffer = bytearray()
+        self._scan_position = 0
+        self._start = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, data: bytes) -> list:
+        """Consumes the next chunk of bytes and returns the objects it completed."""
+        buffer = self._buffer
+        buffer += data
+        objects = []
+        position = self._scan_position
+        if self._escape and position < len(buffer):
+            position += 1 # The escaped character arrived with this chunk
+            self._escape = False
+        while True:
+            match = self._SPECIAL.search(buffer, position)
+            if match is None:
+                position = len(buffer)
+                break
+            ch = match.group()
+            position = match.end()
+            if self._in_string:
+                if ch == b"\\":
+                    if position >= len(buffer):
+                        self._escape = True
+                        break
+                    position += 1
+                elif ch == b'"':
+                    self._in_string = False
+            elif ch == b'"':
+                self._in_string = self._depth > 0
+            elif ch == b"{":
+                if self._depth == 0:
+                    self._start = match.start()
+                self._depth += 1
+            elif ch == b"}" and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        objects.append(json.loads(bytes(buffer[self._start:position])))
+                    except (json.JSONDecodeError, UnicodeDecodeError):
+                        self.errors += 1
+
+        # Drop everything before the object in progress
+        consumed = self._start if self._depth > 0 else position
+        del buffer[:consumed]
+        self._start = 0
+        self._scan_position = position - consumed
+        return objects
+
+    @property
+    def pending(self) -> int:
+        """Number of buffered bytes that do not form a complete object yet."""
+        return len(self._buffer)
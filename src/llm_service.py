@@ -1,28 +1,118 @@
 import os
+import re
 import json
+import time
+import logging
+import threading
 import requests
 from dotenv import load_dotenv
 
 from .character_manager import CharacterManager
+from .cache import AnnotationCache
+from .rule_annotator import RuleBasedAnnotator
+from .http_client import HttpClient, get_llm_client
+from .json_stream import IncrementalJSONArrayParser
+from .voice_catalog import get_voice_catalog
+from .metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+LLM_REQUEST_SECONDS = Histogram("audiobook_llm_request_seconds", "Duration of LLM API requests.", ("mode",))
+LLM_FIRST_TOKEN_SECONDS = Histogram("audiobook_llm_first_token_seconds", "Time until the first text of a streamed LLM answer arrives.")
+LLM_REQUESTS = Counter("audiobook_llm_requests_total", "LLM API requests by outcome.", ("mode", "outcome"))
+LLM_TOKENS = Counter("audiobook_llm_tokens_total", "Tokens reported by the LLM API.", ("kind",))
+ANNOTATIONS = Counter("audiobook_annotations_total", "Text chunks annotated, by where the annotation came from.", ("source",))
 
 # Load environment variables
 load_dotenv()
 
-# Load Volcano Engine voice metadata from JSON file
-VOICE_METADATA_FILE = os.path.join(os.path.dirname(__file__), 'voice_metadata.json')
-with open(VOICE_METADATA_FILE, 'r', encoding='utf-8') as f:
-    VOLCANO_VOICE_METADATA = json.load(f)
+# Bump whenever the prompt changes so cached annotations from the old prompt are not reused
+PROMPT_VERSION = 3
+
+SYSTEM_PROMPT_TEMPLATE = """你是一个专业的有声书制作助手。你的任务是分析小说文本，识别说话者，并为他们分配合适的音色。
+请严格按照以下步骤和输出格式进行：
+1. 分析文本：仔细阅读用户给出的文本块。
+2. 识别角色和别名：识别文本中出现的所有角色及其别名。如果发现新的别名，请将其关联到已知的规范角色名。
+3. 音色分配：
+   * 对于已知的角色（在“当前角色音色映射”中），请严格使用其已分配的音色ID。
+   * 对于新识别的角色，请根据角色在文本中的描述（例如，性别、年龄、性格），从“可用音色”中严格选择一个存在的音色ID。确保音色选择与角色特征匹配。
+   * 旁白请使用已分配的旁白音色。
+4. 输出格式：严格以 JSON 数组的形式输出，每个元素是一个字典，包含 'speaker_name', 'speaker_voice_id', 'text'。
+   * 'speaker_name' 必须是规范的角色名（如果存在别名，请转换为规范名）。
+   * 'speaker_voice_id' 必须是分配给该角色的音色ID，且必须是“可用音色”中存在的有效ID。
+   * 'text' 是对应的文本内容。
+请直接输出 JSON 数组，不要包含任何其他文字或解释。
+
+可用音色（每行一个，字段以 | 分隔）：
+{voice_catalog}"""
+
+_SYSTEM_PROMPT = None
 
 
+def build_system_prompt() -> str:
+    """Returns the stable system prompt, built once per process."""
+    global _SYSTEM_PROMPT
+    if _SYSTEM_PROMPT is None:
+        _SYSTEM_PROMPT = SYSTEM_PROMPT_TEMPLATE.format(voice_catalog=get_voice_catalog().table())
+    return _SYSTEM_PROMPT
+
 class LLMService:
-    def __init__(self, llm_api_endpoint: str, character_manager: CharacterManager):
+    def __init__(self, llm_api_endpoint: str, character_manager: CharacterManager, annotation_cache: AnnotationCache = None, use_rule_annotator: bool = True,
+                 http_client: HttpClient = None, stream_responses: bool = False):
         self.llm_api_endpoint = llm_api_endpoint
+        self.http_client = http_client or get_llm_client() # Pooled connections, retries and adaptive concurrency, long read timeout
         self.character_manager = character_manager
+        self.model_name = os.getenv("LLM_MODEL_NAME", "doubao-seed-1-6-250615") # Default to original if not set
+        self.annotation_cache = annotation_cache # Optional persistent cache of previous annotations
+        # Narration-only and clearly attributed dialogue are annotated locally instead of by the LLM
+        self.rule_annotator = RuleBasedAnnotator(character_manager) if use_rule_annotator else None
+        self.rule_annotated_chunks = 0
+        self.stream_responses = stream_responses # Read LLM answers in SSE mode so segments can be used as they arrive
+        self.token_usage = {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+        self._usage_lock = threading.Lock()
 
-    def _call_llm(self, prompt: str) -> str:
+    @staticmethod
+    def _fallback_response(message: str) -> str:
         """
-        Calls the Volcano LLM API with the given prompt and returns the raw JSON string response.
+        Builds the narrator-only JSON response used when the LLM call fails.
+        Segments are flagged with 'llm_error' so callers know not to keep the result.
         """
+        return json.dumps([{"speaker_name": "旁白", "speaker_voice_id": "zh_male_jieshuoxiaoming_moon_bigtts", "text": message, "llm_error": True}], ensure_ascii=False)
+
+    def _record_token_usage(self, usage: dict):
+        """Adds the token counts reported for one call to the running totals and prints them."""
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+        cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+        with self._usage_lock:
+            self.token_usage["calls"] += 1
+            self.token_usage["prompt_tokens"] += prompt_tokens
+            self.token_usage["cached_tokens"] += cached_tokens
+            self.token_usage["completion_tokens"] += completion_tokens
+        LLM_TOKENS.labels(kind="prompt").inc(prompt_tokens)
+        LLM_TOKENS.labels(kind="cached").inc(cached_tokens)
+        LLM_TOKENS.labels(kind="completion").inc(completion_tokens)
+        print(f"LLM tokens: prompt={prompt_tokens} (cached={cached_tokens}), completion={completion_tokens}")
+
+    def _register_speakers(self, annotated_segments: list):
+        """
+        Records the voice the LLM chose for each newly seen speaker, so later chunks,
+        the rule-based annotator and the prompt all reuse it. A voice that replaced an invalid
+        suggestion is not recorded, so the speaker gets a real voice from a later chunk.
+        """
+        for segment in annotated_segments:
+            speaker_name = segment.get('speaker_name')
+            if (speaker_name and not segment.get('llm_error') and not segment.get('voice_substituted')
+                    and not self.character_manager.get_voice_id(speaker_name)):
+                self.character_manager.set_voice_id(speaker_name, segment['speaker_voice_id'])
+
+    def get_token_usage(self) -> dict:
+        """Returns the token totals of all LLM calls made by this service."""
+        with self._usage_lock:
+            return dict(self.token_usage)
+
+    def _build_request(self, prompt: str, system_prompt: str = None) -> tuple:
+        """Returns the (headers, payload) of a chat completion request."""
         LLM_API_KEY = os.getenv("LLM_API_KEY")
         if not LLM_API_KEY:
             raise ValueError("LLM_API_KEY environment variable not set.")
@@ -31,28 +121,42 @@ class LLMService:
             "Content-Type": "application/json",
             "Authorization": f"Bearer {LLM_API_KEY}"
         }
-        LLM_MODEL_NAME = os.getenv("LLM_MODEL_NAME", "doubao-seed-1-6-250615") # Default to original if not set
-        payload = {
-            "model": LLM_MODEL_NAME, # Now configurable
-            "messages": [
+        messages = []
+        if system_prompt:
+            messages.append({"content": system_prompt, "role": "system"})
+        messages.append({
+            "content": [
                 {
-                    "content": [
-                        {
-                            "text": prompt,
-                            "type": "text"
-                        }
-                    ],
-                    "role": "user"
+                    "text": prompt,
+                    "type": "text"
                 }
-            ]
+            ],
+            "role": "user"
+        })
+        payload = {
+            "model": self.model_name, # Now configurable
+            "messages": messages
         }
+        return headers, payload
+
+    def _call_llm(self, prompt: str, system_prompt: str = None) -> str:
+        """
+        Calls the Volcano LLM API with the given prompt and returns the raw JSON string response.
+        The optional system prompt is sent first so that it forms a cacheable prefix.
+        """
+        headers, payload = self._build_request(prompt, system_prompt)
 
+        outcome = "error"
+        start = time.perf_counter()
         try:
-            response = requests.post(self.llm_api_endpoint, headers=headers, json=payload)
+            response = self.http_client.post(self.llm_api_endpoint, headers=headers, json=payload)
             response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx) 
             
             llm_response = response.json()
-            print(f"Raw LLM response: {json.dumps(llm_response, indent=2, ensure_ascii=False)}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Raw LLM response: %s", json.dumps(llm_response, indent=2, ensure_ascii=False))
+            if llm_response and llm_response.get("usage"):
+                self._record_token_usage(llm_response["usage"])
 
             extracted_text = ""
             if llm_response and llm_response.get("choices") and llm_response["choices"][0].get("message"):
@@ -65,107 +169,324 @@ class LLMService:
             if not extracted_text:
                 print("LLM response content is empty or malformed.")
                 # Return a default JSON structure if LLM response is empty/malformed
-                return json.dumps([{"speaker_name": "旁白", "speaker_voice_id": "zh_male_jieshuoxiaoming_moon_bigtts", "text": "LLM返回内容为空或格式不正确。"}], ensure_ascii=False)
+                return self._fallback_response("LLM返回内容为空或格式不正确。")
 
+            outcome = "ok"
             return extracted_text # Return the extracted JSON string
 
         except requests.exceptions.RequestException as e:
             print(f"Error calling LLM API: {e}")
-            return json.dumps([{"speaker_name": "旁白", "speaker_voice_id": "zh_male_jieshuoxiaoming_moon_bigtts", "text": f"LLM API调用失败: {e}"}], ensure_ascii=False)
+            return self._fallback_response(f"LLM API调用失败: {e}")
         except json.JSONDecodeError as e:
             print(f"Error decoding LLM API response JSON: {e}")
             raw_response_content = response.text if 'response' in locals() else "(No raw response available)"
             print(f"Raw LLM response: {raw_response_content[:500]}...")
-            return json.dumps([{"speaker_name": "旁白", "speaker_voice_id": "zh_male_jieshuoxiaoming_moon_bigtts", "text": f"LLM返回JSON解析失败: {e}"}], ensure_ascii=False)
+            return self._fallback_response(f"LLM返回JSON解析失败: {e}")
         except Exception as e:
             print(f"An unexpected error occurred during LLM API call: {e}")
-            return json.dumps([{"speaker_name": "旁白", "speaker_voice_id": "zh_male_jieshuoxiaoming_moon_bigtts", "text": f"LLM处理异常: {e}"}], ensure_ascii=False)
+            return self._fallback_response(f"LLM处理异常: {e}")
+        finally:
+            LLM_REQUEST_SECONDS.labels(mode="request").observe(time.perf_counter() - start)
+            LLM_REQUESTS.labels(mode="request", outcome=outcome).inc()
 
-    def process_text_chunk(self, text_chunk: str) -> list:
+    def _stream_llm(self, prompt: str, system_prompt: str = None):
         """
-        Processes a text chunk using the LLM to identify characters, assign voices,
-        and annotate the text.
-        Returns a list of dictionaries: [{'speaker_name': '...', 'speaker_voice_id': '...', 'text': '...'}]
+        Calls the LLM API in streaming (SSE) mode and yields the text of the completion as it arrives.
+        Raises on network or HTTP errors; the caller decides how to recover.
         """
-        # Ensure narrator voice is set up initially
+        headers, payload = self._build_request(prompt, system_prompt)
+        payload["stream"] = True
+        payload["stream_options"] = {"include_usage": True} # The last event carries the token counts
+
+        outcome = "error"
+        start = time.perf_counter()
+        first_token = True
+        try:
+            with self.http_client.stream("POST", self.llm_api_endpoint, headers=headers, json=payload) as response:
+                response.raise_for_status()
+                for line in response.iter_lines(): # SSE is always UTF-8, whatever the Content-Type says
+                    line = line.decode("utf-8")
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    event = json.loads(data)
+                    if event.get("usage"):
+                        self._record_token_usage(event["usage"])
+                    for choice in event.get("choices") or []:
+                        content = (choice.get("delta") or {}).get("content")
+                        if content:
+                            if first_token:
+                                LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - start)
+                                first_token = False
+                            yield content
+            outcome = "ok"
+        finally:
+            LLM_REQUEST_SECONDS.labels(mode="stream").observe(time.perf_counter() - start)
+            LLM_REQUESTS.labels(mode="stream", outcome=outcome).inc()
+
+    def _ensure_narrator_voice(self):
         if not self.character_manager.get_voice_id("旁白"):
             self.character_manager.set_voice_id("旁白", "zh_male_jieshuoxiaoming_moon_bigtts")
             print("Initialized '旁白' voice to 'zh_male_jieshuoxiaoming_moon_bigtts'")
 
-        # Step 1: Construct the prompt for the LLM
-        # This prompt needs to be carefully designed to guide the LLM.
-        # It should include:
-        # - The text chunk to process.
-        # - The current global character-alias mapping (for context).
-        # - The current global character-voice mapping (for consistency).
-        # - The available voice metadata (for new voice assignments).
-        # - Clear instructions on the desired output format (JSON).
+    def _annotate_locally(self, text_chunk: str) -> tuple:
+        """
+        Tries the rule-based annotator and the annotation cache.
+        Returns (segments, character_state, cache_key); segments is None if the chunk needs the LLM.
+        """
+        if self.rule_annotator is not None:
+            rule_segments = self.rule_annotator.annotate(text_chunk)
+            if rule_segments is not None:
+                with self._usage_lock:
+                    self.rule_annotated_chunks += 1
+                ANNOTATIONS.labels(source="rules").inc()
+                print("Annotated locally by rules, skipping LLM call.")
+                return rule_segments, None, None
 
-        current_aliases = self.character_manager.get_all_alias_mappings()
-        current_voices = self.character_manager.get_all_voice_mappings()
-        available_voices_meta = VOLCANO_VOICE_METADATA
+        # The prompt would carry this state, so it is part of the cache key
+        character_state = self._character_state()
 
-        prompt = f"""
-        你是一个专业的有声书制作助手。你的任务是分析小说文本，识别说话者，并为他们分配合适的音色。
-        请严格按照以下步骤和输出格式进行：
+        # Skip the LLM entirely if this text was already annotated under the same character state and model
+        cache_key = self._cache_key(text_chunk, character_state)
+        if cache_key is not None:
+            cached_segments = self.annotation_cache.get(cache_key)
+            if cached_segments is not None:
+                ANNOTATIONS.labels(source="cache").inc()
+                print("Annotation cache hit, skipping LLM call.")
+                self._register_speakers(cached_segments)
+                return cached_segments, character_state, cache_key
+        return None, character_state, cache_key
 
-        1.  **分析文本：** 仔细阅读以下文本块。
-        2.  **识别角色和别名：** 识别文本中出现的所有角色及其别名。如果发现新的别名，请将其关联到已知的规范角色名。
-        3.  **音色分配：**
-            *   对于已知的角色（在“当前角色音色映射”中），请严格使用其已分配的音色ID。
-            *   对于新识别的角色（不在“当前角色音色映射”中），请根据角色在文本中的描述（例如，性别、年龄、性格），从“可用音色元数据”中**严格选择一个存在的音色ID**。确保音色选择与角色特征匹配。
-            *   旁白请使用已分配的旁白音色。
-        4.  **输出格式：** 严格以 JSON 数组的形式输出，每个元素是一个字典，包含 'speaker_name', 'speaker_voice_id', 'text'。
-            *   'speaker_name' 必须是规范的角色名（如果存在别名，请转换为规范名）。
-            *   'speaker_voice_id' 必须是分配给该角色的音色ID，**且必须是“可用音色元数据”中存在的有效ID**。
-            *   'text' 是对应的文本内容。
+    def _character_state(self) -> dict:
+        """
+        The alias and voice mappings sent with a prompt. All of them are sent: a character may appear under
+        an alias not yet recorded, and the LLM can only link it to its canonical name if that name is listed.
+        """
+        # Sorted, so the prompt and the cache key do not depend on the order aliases were stored in
+        aliases = {canonical: sorted(names) for canonical, names in self.character_manager.get_all_alias_mappings().items()}
+        return {"aliases": aliases, "voices": self.character_manager.get_all_voice_mappings()}
 
-        --- 文本块 ---
-        {text_chunk}
+    def _cache_key(self, text_chunk: str, character_state: dict) -> str:
+        """Annotation cache key of a chunk sent with the given character state, or None without a cache."""
+        if self.annotation_cache is None:
+            return None
+        return self.annotation_cache.make_key(text_chunk, character_state, self.model_name, PROMPT_VERSION)
 
-        --- 当前角色别名映射 ---
-        {json.dumps(current_aliases, ensure_ascii=False, indent=2)}
+    @staticmethod
+    def _format_character_state(character_state: dict) -> str:
+        # The system prompt (instructions + voice catalog) is identical for every call, so the provider can
+        # cache it as a prefix. The character state follows it.
+        return (
+            f"当前角色别名映射：{json.dumps(character_state['aliases'], ensure_ascii=False, separators=(',', ':'))}\n"
+            f"当前角色音色映射：{json.dumps(character_state['voices'], ensure_ascii=False, separators=(',', ':'))}\n"
+        )
 
-        --- 当前角色音色映射 ---
-        {json.dumps(current_voices, ensure_ascii=False, indent=2)}
+    @staticmethod
+    def _validate_segments(annotated_text_data) -> list:
+        """
+        Checks that the LLM output is a list of segment dicts and replaces unknown voice IDs with the narrator voice.
+        Returns the segments, or None if the format is invalid.
+        """
+        if not isinstance(annotated_text_data, list) or not all(isinstance(item, dict) and
+                                                                'speaker_name' in item and
+                                                                'speaker_voice_id' in item and
+                                                                'text' in item
+                                                                for item in annotated_text_data):
+            return None
+        for segment in annotated_text_data:
+            suggested_voice_id = segment.get('speaker_voice_id')
+            if suggested_voice_id not in get_voice_catalog():
+                print(f"Warning: LLM suggested invalid voice ID '{suggested_voice_id}'. Falling back to narrator voice.")
+                segment['speaker_voice_id'] = 'zh_male_jieshuoxiaoming_moon_bigtts' # Fallback to a known good narrator voice
+                segment['voice_substituted'] = True
+        return annotated_text_data
 
-        --- 可用音色元数据 ---
-        {json.dumps(available_voices_meta, ensure_ascii=False, indent=2)}
+    @staticmethod
+    def _covers_text(text_chunk: str, annotated_segments: list) -> bool:
+        """Rough check that the segments contain about as much text as the chunk, to catch truncated or misplaced results."""
+        expected = len(re.sub(r'\W', '', text_chunk))
+        actual = len(re.sub(r'\W', '', "".join(segment.get('text', '') for segment in annotated_segments)))
+        return expected == 0 or 0.6 <= actual / expected <= 1.6
 
-        请直接输出 JSON 数组，不要包含任何其他文字或解释。
-        """
+    def _accept_segments(self, text_chunk: str, annotated_segments: list, character_state: dict, cache_key: str):
+        ANNOTATIONS.labels(source="llm").inc()
+        self._register_speakers(annotated_segments)
+        if cache_key is None or any(item.get('llm_error') for item in annotated_segments):
+            return
+        self.annotation_cache.put(cache_key, annotated_segments)
+        # Registering this chunk's new speakers changes the character state, so a run that starts from the
+        # registered state looks the chunk up under a different key; store the result under that key too
+        registered_state = self._character_state()
+        if registered_state != character_state:
+            self.annotation_cache.put(self._cache_key(text_chunk, registered_state), annotated_segments)
 
+    def _annotate_with_llm(self, text_chunk: str, character_state: dict, cache_key: str) -> list:
+        """Annotates a single chunk with one LLM request."""
+        prompt = self._format_character_state(character_state) + f"文本块：\n{text_chunk}"
         try:
-            llm_json_str = self._call_llm(prompt) # _call_llm now returns the JSON string
-            
+            llm_json_str = self._call_llm(prompt, system_prompt=build_system_prompt()) # _call_llm now returns the JSON string
+
             # Parse the LLM's JSON response
             try:
                 annotated_text_data = json.loads(llm_json_str)
             except json.JSONDecodeError:
                 print("Warning: LLM response is not valid JSON. Attempting to parse as single segment.")
-                annotated_text_data = [{'speaker_name': '旁白', 'speaker_voice_id': 'zh_male_jieshuoxiaoming_moon_bigtts', 'text': llm_json_str}]
-
-            # Validate and sanitize speaker_voice_id
-            for segment in annotated_text_data:
-                suggested_voice_id = segment.get('speaker_voice_id')
-                if suggested_voice_id not in VOLCANO_VOICE_METADATA:
-                    print(f"Warning: LLM suggested invalid voice ID '{suggested_voice_id}'. Falling back to narrator voice.")
-                    segment['speaker_voice_id'] = 'zh_male_jieshuoxiaoming_moon_bigtts' # Fallback to a known good narrator voice
-
-            # Update character manager based on LLM's implicit decisions (if any, for new characters)
-            # In a real implementation, the LLM would explicitly tell us about new aliases/voice assignments.
-            # For this placeholder, we rely on the _call_llm dummy logic.
-            
-            # Validate and return
-            if isinstance(annotated_text_data, list) and all(isinstance(item, dict) and 
-                                                            'speaker_name' in item and 
-                                                            'speaker_voice_id' in item and 
-                                                            'text' in item 
-                                                            for item in annotated_text_data):
-                return annotated_text_data
-            else:
+                annotated_text_data = [{'speaker_name': '旁白', 'speaker_voice_id': 'zh_male_jieshuoxiaoming_moon_bigtts', 'text': llm_json_str, 'llm_error': True}]
+
+            # Validate, sanitize speaker_voice_id and return
+            annotated_segments = self._validate_segments(annotated_text_data)
+            if annotated_segments is None:
                 print("Warning: LLM response format invalid after validation.")
                 return []
+            self._accept_segments(text_chunk, annotated_segments, character_state, cache_key)
+            return annotated_segments
         except Exception as e:
             print(f"An unexpected error occurred during LLM processing: {e}")
             return []
+
+    def process_text_chunk(self, text_chunk: str) -> list:
+        """
+        Processes a text chunk using the LLM to identify characters, assign voices,
+        and annotate the text.
+        Returns a list of dictionaries: [{'speaker_name': '...', 'speaker_voice_id': '...', 'text': '...'}]
+        """
+        # Ensure narrator voice is set up initially
+        self._ensure_narrator_voice()
+
+        annotated_segments, character_state, cache_key = self._annotate_locally(text_chunk)
+        if annotated_segments is not None:
+            return annotated_segments
+        return self._annotate_with_llm(text_chunk, character_state, cache_key)
+
+    def process_text_chunk_stream(self, text_chunk: str):
+        """
+        Like process_text_chunk, but yields each segment as soon as it is available.
+        With stream_responses enabled the LLM answer is read in streaming mode and every
+        {'speaker_name', 'speaker_voice_id', 'text'} object is yielded once its closing brace
+        arrives, so synthesis can start before the LLM has finished the chunk.
+        If the stream breaks or carries a malformed object after some segments were yielded, the
+        chunk is annotated again without streaming and only the segments after the text already
+        yielded follow. If that fails too, a final empty segment flagged with 'llm_error' is yielded
+        so that the caller knows the chunk is incomplete.
+        """
+        self._ensure_narrator_voice()
+
+        annotated_segments, character_state, cache_key = self._annotate_locally(text_chunk)
+        if annotated_segments is None and not self.stream_responses:
+            annotated_segments = self._annotate_with_llm(text_chunk, character_state, cache_key)
+        if annotated_segments is not None:
+            yield from annotated_segments
+            return
+
+        prompt = self._format_character_state(character_state) + f"文本块：\n{text_chunk}"
+        parser = IncrementalJSONArrayParser()
+        streamed_segments = []
+        stream = self._stream_llm(prompt, system_prompt=build_system_prompt())
+        try:
+            for text in stream:
+                for item in parser.feed(text):
+                    segments = self._validate_segments([item])
+                    if segments is None:
+                        parser.errors += 1
+                    if parser.errors:
+                        break # The text of a malformed object would be missing from the middle of the chunk
+                    self._register_speakers(segments) # Later segments of this chunk reuse a new speaker's voice
+                    streamed_segments.extend(segments)
+                    yield segments[0]
+                if parser.errors:
+                    break
+        except Exception as e:
+            print(f"Error reading streamed LLM response: {e}")
+        finally:
+            stream.close()
+
+        if parser.finished and not parser.errors and streamed_segments:
+            self._accept_segments(text_chunk, streamed_segments, character_state, cache_key)
+        elif not streamed_segments:
+            print("Warning: Streamed LLM response had no usable segments. Retrying without streaming.")
+            yield from self._annotate_with_llm(text_chunk, character_state, cache_key)
+        else:
+            print("Warning: Streamed LLM response was incomplete or malformed. Annotating the rest of the chunk without streaming.")
+            annotated_segments = self._annotate_with_llm(text_chunk, character_state, cache_key)
+            if not annotated_segments or any(segment.get('llm_error') for segment in annotated_segments):
+                yield {'speaker_name': '旁白', 'speaker_voice_id': 'zh_male_jieshuoxiaoming_moon_bigtts', 'text': '', 'llm_error': True}
+                return
+            yield from self._segments_after(streamed_segments, annotated_segments)
+
+    @staticmethod
+    def _segments_after(yielded_segments: list, annotated_segments: list) -> list:
+        """
+        Returns the part of annotated_segments that follows the text of yielded_segments, comparing
+        word characters only, so differences in punctuation and spacing do not shift the cut.
+        A segment straddling the cut keeps only its text after it.
+        """
+        skip = len(re.sub(r'\W', '', "".join(segment.get('text', '') for segment in yielded_segments)))
+        remaining = []
+        for segment in annotated_segments:
+            text = segment.get('text', '')
+            word_count = len(re.sub(r'\W', '', text))
+            if skip >= word_count:
+                skip -= word_count
+                continue
+            if skip:
+                for match in re.finditer(r'\w', text):
+                    skip -= 1
+                    if skip == 0:
+                        text = text[match.end():].lstrip()
+                        break
+            remaining.append(dict(segment, text=text))
+        return remaining
+
+    def process_text_batch(self, text_chunks: list) -> list:
+        """
+        Processes several text chunks with a single LLM request.
+        Each chunk is tagged with a stable ID (P1, P2, ...) and the LLM answers with a JSON object
+        mapping each ID to that chunk's segment array. Chunks handled by the rules or the cache are
+        left out of the request, and any chunk whose result is missing or malformed is retried on
+        its own, so one bad entry never fails the whole batch.
+        Returns one list of segments per input chunk, in the same order.
+        """
+        self._ensure_narrator_voice()
+
+        results = [None] * len(text_chunks)
+        to_request = [] # (index, character_state, cache_key) of chunks that need the LLM
+        for index, text_chunk in enumerate(text_chunks):
+            annotated_segments, character_state, cache_key = self._annotate_locally(text_chunk)
+            if annotated_segments is not None:
+                results[index] = annotated_segments
+            else:
+                to_request.append((index, character_state, cache_key))
+
+        if len(to_request) == 1:
+            index, character_state, cache_key = to_request[0]
+            results[index] = self._annotate_with_llm(text_chunks[index], character_state, cache_key)
+        elif to_request:
+            # The chunks are sent with one character state, so their cache keys are built from it
+            character_state = self._character_state()
+            to_request = [(index, character_state, self._cache_key(text_chunks[index], character_state)) for index, _, _ in to_request]
+            prompt = (
+                self._format_character_state(character_state)
+                + f"本次共有 {len(to_request)} 个文本块，每个文本块以 [ID] 开头。请分别处理每个文本块，"
+                + "输出一个 JSON 对象，键为文本块ID（不含方括号），值为该文本块按上述格式得到的 JSON 数组。\n"
+                + "\n".join(f"[P{index + 1}]\n{text_chunks[index]}" for index, _, _ in to_request)
+            )
+            llm_json_str = self._call_llm(prompt, system_prompt=build_system_prompt())
+            try:
+                batch_response = json.loads(llm_json_str)
+            except json.JSONDecodeError:
+                batch_response = None
+            if not isinstance(batch_response, dict):
+                print("Warning: Batched LLM response is not a JSON object. Retrying each chunk on its own.")
+                batch_response = {}
+
+            for index, character_state, cache_key in to_request:
+                annotated_segments = self._validate_segments(batch_response.get(f"P{index + 1}"))
+                if not annotated_segments or not self._covers_text(text_chunks[index], annotated_segments):
+                    print(f"Warning: Batched result for P{index + 1} is missing or malformed. Retrying it on its own.")
+                    results[index] = self._annotate_with_llm(text_chunks[index], character_state, cache_key)
+                else:
+                    self._accept_segments(text_chunks[index], annotated_segments, character_state, cache_key)
+                    results[index] = annotated_segments
+        return results
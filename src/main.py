@@ -1,20 +1,11 @@
 import os
-import json
-import requests
+import logging
 from dotenv import load_dotenv
 
-from .character_manager import CharacterManager
-from .llm_service import LLMService
-from .volcano_engine_service import VolcanoEngineService
-from .audiobook_generator import AudiobookGenerator
-
 # Load environment variables from .env file
 load_dotenv()
-
-# Load Volcano Engine voice metadata from JSON file
-VOICE_METADATA_FILE = os.path.join(os.path.dirname(__file__), 'voice_metadata.json')
-with open(VOICE_METADATA_FILE, 'r', encoding='utf-8') as f:
-    VOLCANO_VOICE_METADATA = json.load(f)
+# LOG_LEVEL=DEBUG shows the raw LLM responses and TTS requests
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 
 # Main application entry point
 if __name__ == "__main__":
@@ -25,10 +16,14 @@ if __name__ == "__main__":
         print("\n--- Starting Audiobook Generation API ---")
         # Ensure output_audio directory exists for CharacterManager and AudiobookGenerator
         os.makedirs(os.path.join(os.getcwd(), "output_audio"), exist_ok=True)
-        from .api import app as api_app # Import Flask app here
+        from .api import app as api_app, get_job_pool # Import Flask app here
+        # Resume interrupted jobs right away, in the serving process only (not the reloader's watcher)
+        if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+            get_job_pool()
         api_app.run(debug=True, port=5000)
     else:
         print("\n--- Starting Audiobook Generation GUI ---")
+        from .gui import AudiobookApp # Services are imported by the GUI only when generation starts
         root = tk.Tk()
         app = AudiobookApp(root)
         root.mainloop()
@@ -0,0 +1,185 @@
+import math
+import time
+import threading
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from a cache hit to a long LLM answer
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: tuple = ()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f"{name}=\"{_escape_label(value)}\"" for name, value in pairs) + "}"
+
+
+class MetricsRegistry:
+    """The metrics of a process, rendered together in the Prometheus text exposition format."""
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if any(existing.name == metric.name for existing in self._metrics):
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class _BoundMetric:
+    """A metric with its label values filled in, as returned by labels()."""
+    def __init__(self, metric, label_values: tuple):
+        self._metric = metric
+        self._label_values = label_values
+
+    def __getattr__(self, name):
+        method = getattr(self._metric, name)
+        return lambda *args, **kwargs: method(*args, _label_values=self._label_values, **kwargs)
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), registry: MetricsRegistry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {} # label values -> value
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, **labels) -> _BoundMetric:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes the labels {self.labelnames}, got {tuple(labels)}")
+        return _BoundMetric(self, tuple(str(labels[name]) for name in self.labelnames))
+
+    def _check_labels(self, label_values: tuple):
+        if len(label_values) != len(self.labelnames):
+            raise ValueError(f"{self.name} needs the labels {self.labelnames}; use labels()")
+
+
+class Counter(_Metric):
+    """A total that only goes up, such as requests made or bytes received."""
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, _label_values: tuple = ()):
+        if amount < 0:
+            raise ValueError("Counters can only be increased")
+        self._check_labels(_label_values)
+        with self._lock:
+            self._values[_label_values] = self._values.get(_label_values, 0) + amount
+
+    def value(self, _label_values: tuple = ()) -> float:
+        with self._lock:
+            return self._values.get(_label_values, 0)
+
+    def samples(self) -> list:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}" for labels, value in values]
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, such as a queue depth."""
+    type_name = "gauge"
+
+    def set(self, value: float, _label_values: tuple = ()):
+        self._check_labels(_label_values)
+        with self._lock:
+            self._values[_label_values] = value
+
+    def inc(self, amount: float = 1, _label_values: tuple = ()):
+        self._check_labels(_label_values)
+        with self._lock:
+            self._values[_label_values] = self._values.get(_label_values, 0) + amount
+
+    def dec(self, amount: float = 1, _label_values: tuple = ()):
+        self.inc(-amount, _label_values=_label_values)
+
+    def value(self, _label_values: tuple = ()) -> float:
+        with self._lock:
+            return self._values.get(_label_values, 0)
+
+    def samples(self) -> list:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}" for labels, value in values]
+
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets, such as request latencies."""
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS,
+                 registry: MetricsRegistry = REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value: float, _label_values: tuple = ()):
+        self._check_labels(_label_values)
+        with self._lock:
+            state = self._values.get(_label_values)
+            if state is None:
+                state = self._values[_label_values] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["buckets"][index] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    @contextmanager
+    def time(self, _label_values: tuple = ()):
+        """Observes the duration of the with block, in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, _label_values=_label_values)
+
+    def count(self, _label_values: tuple = ()) -> int:
+        with self._lock:
+            state = self._values.get(_label_values)
+            return state["count"] if state else 0
+
+    def samples(self) -> list:
+        with self._lock:
+            values = sorted((labels, {"buckets": list(state["buckets"]), "sum": state["sum"], "count": state["count"]})
+                            for labels, state in self._values.items())
+        lines = []
+        for labels, state in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, state["buckets"]):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, (('le', _format_value(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, (('le', '+Inf'),))} {state['count']}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {state['count']}")
+        return lines
@@ -0,0 +1,120 @@
+import math
+import struct
+import threading
+import uuid
+
+from websockets.exceptions import ConnectionClosed
+from websockets.sync.server import serve
+
+from . import tts_protocol as protocol
+
+
+class MockTTSServer:
+    """
+    Local stand-in for the Volcano Engine bidirectional TTS WebSocket API, for offline testing.
+    Speaks the same binary framing and event sequence as the real service. Each session returns
+    16-bit mono PCM: a tone whose pitch depends on the speaker and whose length depends on the
+    text, sent in several TTSResponse frames. The audio is PCM whatever format is requested.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, sample_rate: int = 24000, ms_per_char: int = 60, frame_ms: int = 200):
+        self.host = host
+        self.port = port
+        self.sample_rate = sample_rate
+        self.ms_per_char = ms_per_char
+        self.frame_ms = frame_ms
+        self.connections_opened = 0
+        self.sessions_finished = 0
+        self._server = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"ws://{self.host}:{self.port}"
+
+    def synthesize(self, text: str, speaker: str) -> bytes:
+        """Returns the PCM the mock produces for a text and speaker."""
+        frequency = 200 + sum(speaker.encode("utf-8")) % 400
+        sample_count = self.sample_rate * self.ms_per_char * max(1, len(text)) // 1000
+        samples = (int(8000 * math.sin(2 * math.pi * frequency * n / self.sample_rate)) for n in range(sample_count))
+        return struct.pack(f"<{sample_count}h", *samples)
+
+    def _send(self, websocket, message_type: int, event: int, session_id: str = None, payload=None):
+        websocket.send(protocol.encode_frame(message_type, event, session_id, payload))
+
+    def _handle(self, websocket):
+        try:
+            self._serve_connection(websocket)
+        except ConnectionClosed:
+            pass # The client went away
+
+    def _serve_connection(self, websocket):
+        with self._lock:
+            self.connections_opened += 1
+        sessions = {} # session_id -> {"speaker", "text"}
+        for message in websocket:
+            try:
+                frame = protocol.decode_frame(message)
+            except (ValueError, TypeError) as e:
+                websocket.send(protocol.encode_error_frame(45000000, {"error": f"Malformed frame: {e}"}))
+                continue
+
+            if frame.event == protocol.START_CONNECTION:
+                self._send(websocket, protocol.FULL_SERVER_RESPONSE, protocol.CONNECTION_STARTED, uuid.uuid4().hex, {})
+            elif frame.event == protocol.FINISH_CONNECTION:
+                self._send(websocket, protocol.FULL_SERVER_RESPONSE, protocol.CONNECTION_FINISHED, None, {})
+                return
+            elif frame.event == protocol.START_SESSION:
+                speaker = ((frame.payload or {}).get("req_params") or {}).get("speaker")
+                if not speaker:
+                    self._send(websocket, protocol.FULL_SERVER_RESPONSE, protocol.SESSION_FAILED, frame.session_id,
+                               {"status_code": 45000001, "message": "speaker is required"})
+                    continue
+                sessions[frame.session_id] = {"speaker": speaker, "text": ""}
+                self._send(websocket, protocol.FULL_SERVER_RESPONSE, protocol.SESSION_STARTED, frame.session_id, {})
+            elif frame.event == protocol.TASK_REQUEST and frame.session_id in sessions:
+                sessions[frame.session_id]["text"] += ((frame.payload or {}).get("req_params") or {}).get("text", "")
+            elif frame.event == protocol.FINISH_SESSION and frame.session_id in sessions:
+                session = sessions.pop(frame.session_id)
+                pcm = self.synthesize(session["text"], session["speaker"])
+                frame_bytes = self.sample_rate * self.frame_ms // 1000 * 2
+                for start in range(0, len(pcm), frame_bytes):
+                    self._send(websocket, protocol.AUDIO_ONLY_RESPONSE, protocol.TTS_RESPONSE, frame.session_id, pcm[start:start + frame_bytes])
+                self._send(websocket, protocol.FULL_SERVER_RESPONSE, protocol.SESSION_FINISHED, frame.session_id,
+                           {"status_code": 20000000, "message": "OK"})
+                with self._lock:
+                    self.sessions_finished += 1
+            else:
+                websocket.send(protocol.encode_error_frame(45000002, {"error": f"Unexpected event {frame.event}"}))
+
+    def start(self):
+        """Starts serving on a background thread. With port 0 a free port is chosen."""
+        self._server = serve(self._handle, self.host, self.port, max_size=None)
+        self.port = self._server.socket.getsockname()[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-tts", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._server = None
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Run a local mock of the bidirectional TTS WebSocket API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    server = MockTTSServer(args.host, args.port).start()
+    print(f"Mock TTS server listening on {server.url} (set TTS_BACKEND=websocket and TTS_WS_ENDPOINT={server.url})")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,103 @@
+import os
+import json
+import hashlib
+import threading
+
+class ProjectManifest:
+    """
+    Checkpoint of finished work for one project, stored as `manifest.jsonl` in the
+    project's `{project_id}_chunks` directory.
+    Every paragraph annotation and every synthesized segment is appended as one JSON line
+    the moment it finishes, so an interrupted run can skip completed LLM and TTS work.
+    Entries carry a fingerprint of their inputs; an edited paragraph or a changed voice
+    no longer matches and is redone.
+    """
+    MANIFEST_FILENAME = "manifest.jsonl"
+
+    def __init__(self, project_output_dir: str):
+        self.project_output_dir = project_output_dir
+        self.manifest_file = os.path.join(project_output_dir, self.MANIFEST_FILENAME)
+        self.paragraphs = {} # { paragraph_index: {"hash": "...", "segments": [...]} }
+        self.segments = {}   # { segment_key: {"hash": "...", "file": "segment_00001_000.mp3", "parts": [...]} }
+        self._lock = threading.Lock()
+        os.makedirs(project_output_dir, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def fingerprint(*parts) -> str:
+        """Returns a stable hash of the given JSON-serializable values."""
+        return hashlib.sha256(json.dumps(parts, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def segment_key(paragraph_index: int, segment_index: int) -> str:
+        return f"{paragraph_index:05d}_{segment_index:03d}"
+
+    @classmethod
+    def run_key(cls, parts: list) -> str:
+        """
+        Key of a run of coalesced segments, given its parts in order. A single segment keeps
+        its own key; a run is named after its first and last segment.
+        """
+        first = cls.segment_key(parts[0]["paragraph_index"], parts[0]["segment_index"])
+        if len(parts) == 1:
+            return first
+        return f"{first}-{cls.segment_key(parts[-1]['paragraph_index'], parts[-1]['segment_index'])}"
+
+    def _load(self):
+        if not os.path.exists(self.manifest_file):
+            return
+        with open(self.manifest_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash can leave a truncated last line behind; everything before it is still valid
+                    print(f"Warning: Ignoring corrupt line in {self.manifest_file}")
+                    continue
+                if entry.get("type") == "paragraph":
+                    self.paragraphs[entry["index"]] = {"hash": entry["hash"], "segments": entry["segments"]}
+                elif entry.get("type") == "segment":
+                    self.segments[entry["key"]] = {"hash": entry["hash"], "file": entry["file"], "parts": entry.get("parts")}
+        print(f"Loaded checkpoint with {len(self.paragraphs)} annotated paragraphs and {len(self.segments)} synthesized segments.")
+
+    def _append(self, entry: dict):
+        with open(self.manifest_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+
+    def get_annotation(self, paragraph_index: int, paragraph: str) -> list:
+        """Returns the recorded annotation for a paragraph, or None if it must be (re)annotated."""
+        with self._lock:
+            entry = self.paragraphs.get(paragraph_index)
+        if entry and entry["hash"] == self.fingerprint(paragraph):
+            return entry["segments"]
+        return None
+
+    def record_annotation(self, paragraph_index: int, paragraph: str, segments: list):
+        entry_hash = self.fingerprint(paragraph)
+        with self._lock:
+            self.paragraphs[paragraph_index] = {"hash": entry_hash, "segments": segments}
+            self._append({"type": "paragraph", "index": paragraph_index, "hash": entry_hash, "segments": segments})
+
+    def get_segment_audio(self, segment_key: str, text: str, voice_id: str) -> str:
+        """Returns the path of a previously synthesized segment, or None if it must be (re)synthesized."""
+        with self._lock:
+            entry = self.segments.get(segment_key)
+        if not entry or entry["hash"] != self.fingerprint(text, voice_id):
+            return None
+        audio_file_path = os.path.join(self.project_output_dir, entry["file"])
+        return audio_file_path if os.path.exists(audio_file_path) else None
+
+    def record_segment_audio(self, segment_key: str, text: str, voice_id: str, audio_file_path: str, parts: list = None):
+        """
+        Records a synthesized segment. For a run of coalesced segments, parts lists where each
+        original segment lies in the text ({"paragraph_index", "segment_index", "start", "end"}).
+        """
+        entry_hash = self.fingerprint(text, voice_id)
+        audio_filename = os.path.basename(audio_file_path)
+        entry = {"type": "segment", "key": segment_key, "hash": entry_hash, "file": audio_filename}
+        if parts and len(parts) > 1:
+            entry["parts"] = parts
+        with self._lock:
+            self.segments[segment_key] = {"hash": entry_hash, "file": audio_filename, "parts": entry.get("parts")}
+            self._append(entry)
@@ -0,0 +1,101 @@
+import re
+
+from .character_manager import CharacterManager
+from .voice_catalog import get_voice_catalog
+
+QUOTE_CHARS = "“”「」『』\""
+# A complete quotation in any of the supported quote styles
+QUOTATION_PATTERN = re.compile(r'(“[^“”]*”|「[^「」]*」|『[^『』]*』)')
+# No bare 道, 叫 or 骂: they are also parts of other words ("知道") or not speech ("被骂")
+SPEECH_VERBS = "说道|问道|答道|喊道|叫道|笑道|怒道|叹道|回答|嘀咕|低声道|说|问|答|喊|吼|嚷"
+# Characters that may sit between a name and its speech verb, e.g. "哈利波特低声地说"; not across a clause
+ATTRIBUTION_GAP = r'[^“”「」『』。！？!?，,；;\n]{0,10}?'
+# A gap containing one of these may make someone else the speaker: a possessive ("哈利身边的赫敏说"),
+# perception ("哈利听到赫敏说"), causative or passive ("哈利让赫敏说", "哈利被骂"), an addressee
+# ("哈利对赫敏说") or another subject ("哈利和赫敏说", "哈利知道他说", "哈利听见有人说"). Such quotations go to the LLM.
+DOUBTFUL_GAP_PATTERN = re.compile(r'的|听|见|让|叫|被|对|向|给|和|跟|与|同|他|她|我|你|有人|别人|众人')
+# A speaker must be the subject: the name opens its clause, so "老师对哈利说" or "他看着哈利，问道"
+# do not attribute the quotation to 哈利
+CLAUSE_START = r'(?:^|(?<=[，,。！？!?；;：:…\s]))'
+
+
+class RuleBasedAnnotator:
+    """
+    Annotates easy text locally, without calling the LLM.
+    Handles two cases deterministically:
+      * text without any quotation marks, which is read entirely by the narrator;
+      * dialogue where every quotation is attributed in the adjacent narration to a name
+        the CharacterManager already knows and has a valid voice for, as the subject of the speech
+        verb ("哈利波特说：“……”" but not "哈利的朋友说：“……”").
+    Anything else is ambiguous and annotate() returns None so the caller falls back to the LLM.
+    """
+    def __init__(self, character_manager: CharacterManager, default_narrator_voice_id: str = "zh_male_jieshuoxiaoming_moon_bigtts"):
+        self.character_manager = character_manager
+        self.default_narrator_voice_id = default_narrator_voice_id
+
+    def _known_speakers(self) -> dict:
+        """Returns { name_or_alias: (canonical_name, voice_id) } for every character that has a valid voice."""
+        catalog = get_voice_catalog()
+        voices = {canonical: voice_id for canonical, voice_id in self.character_manager.get_all_voice_mappings().items()
+                  if canonical != "旁白" and voice_id in catalog}
+        speakers = {}
+        for canonical, voice_id in voices.items():
+            speakers[canonical] = (canonical, voice_id)
+        for canonical, aliases in self.character_manager.get_all_alias_mappings().items():
+            if canonical in voices:
+                for alias in aliases:
+                    speakers[alias] = (canonical, voices[canonical])
+        return speakers
+
+    @staticmethod
+    def _doubtful_gap(gap: str, speakers: dict) -> bool:
+        """Whether the text between a name and its speech verb could make someone else the speaker."""
+        return bool(DOUBTFUL_GAP_PATTERN.search(gap)) or any(name in gap for name in speakers)
+
+    def annotate(self, text: str) -> list:
+        """
+        Returns the annotated segments for text, or None if it needs the LLM.
+        Segments use the same format as LLMService.process_text_chunk.
+        """
+        narrator_voice_id = self.character_manager.get_voice_id("旁白")
+        if narrator_voice_id not in get_voice_catalog():
+            narrator_voice_id = self.default_narrator_voice_id # e.g. the "narrator_voice_id" placeholder
+        if not any(c in text for c in QUOTE_CHARS):
+            return [{"speaker_name": "旁白", "speaker_voice_id": narrator_voice_id, "text": text}]
+
+        pieces = QUOTATION_PATTERN.split(text) # Narration and quotations alternate: n, q, n, q, ..., n
+        narration_pieces = pieces[0::2]
+        if any(c in piece for piece in narration_pieces for c in QUOTE_CHARS):
+            return None # Unbalanced or nested quotation marks
+
+        speakers = self._known_speakers()
+        if not speakers:
+            return None
+        names = "|".join(re.escape(name) for name in sorted(speakers, key=len, reverse=True))
+        before_pattern = re.compile(rf'{CLAUSE_START}({names})({ATTRIBUTION_GAP})(?:{SPEECH_VERBS})[^“”「」『』。！？!?\n]{{0,4}}[：:，,]?\s*$')
+        after_pattern = re.compile(rf'^\s*[，,]?\s*({names})({ATTRIBUTION_GAP})(?:{SPEECH_VERBS})')
+
+        segments = []
+        for index, piece in enumerate(pieces):
+            if index % 2 == 0:
+                if piece.strip():
+                    if segments and segments[-1]["speaker_name"] == "旁白":
+                        segments[-1]["text"] += piece
+                    else:
+                        segments.append({"speaker_name": "旁白", "speaker_voice_id": narrator_voice_id, "text": piece})
+                continue
+
+            matches = [m for m in (before_pattern.search(pieces[index - 1]), after_pattern.search(pieces[index + 1])) if m]
+            if any(self._doubtful_gap(m.group(2), speakers) for m in matches):
+                return None
+            candidates = {speakers[m.group(1)] for m in matches}
+            if len(candidates) != 1:
+                return None # Unattributed, or attributed to two different characters
+            canonical, voice_id = candidates.pop()
+            quoted_text = piece[1:-1].strip()
+            if quoted_text:
+                segments.append({"speaker_name": canonical, "speaker_voice_id": voice_id, "text": quoted_text})
+
+        for segment in segments:
+            segment["text"] = segment["text"].strip()
+        return [segment for segment in segments if segment["text"]]
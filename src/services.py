@@ -0,0 +1,86 @@
+import os
+import threading
+from contextlib import contextmanager
+
+from .character_manager import CharacterManager
+from .character_store import SQLiteCharacterStore
+from .llm_service import LLMService
+from .volcano_engine_service import VolcanoEngineService
+from .cache import TTSCache, AnnotationCache
+from .audiobook_generator import AudiobookGenerator
+from .audio_mastering import AudioMastering
+
+OUTPUT_DIR = os.path.join(os.getcwd(), "output_audio")
+
+# TTS cache shared by all generation runs in the process so they see one index and one byte budget
+_TTS_CACHE = None
+_TTS_CACHE_LOCK = threading.Lock()
+
+
+def get_tts_cache() -> TTSCache:
+    """Returns the process-wide TTS cache, or None if TTS_CACHE_MAX_MB is 0."""
+    global _TTS_CACHE
+    with _TTS_CACHE_LOCK:
+        tts_cache_max_mb = int(os.getenv("TTS_CACHE_MAX_MB", "2048"))
+        if _TTS_CACHE is None and tts_cache_max_mb > 0:
+            tts_cache_dir = os.getenv("TTS_CACHE_DIR", os.path.join(OUTPUT_DIR, "tts_cache"))
+            _TTS_CACHE = TTSCache(tts_cache_dir, max_bytes=tts_cache_max_mb * 1024 * 1024)
+        return _TTS_CACHE
+
+
+def create_character_manager(project_id: str):
+    """Returns the character store selected by CHARACTER_STORE for a project."""
+    if os.getenv("CHARACTER_STORE", "json") == "sqlite":
+        db_path = os.getenv("CHARACTER_DB_PATH", os.path.join(OUTPUT_DIR, "characters.db"))
+        return SQLiteCharacterStore(db_path, project_id)
+    return CharacterManager(base_dir=OUTPUT_DIR)
+
+
+def create_tts_service(app_id: str, access_key: str, resource_id: str) -> VolcanoEngineService:
+    """Returns the TTS service selected by TTS_BACKEND."""
+    if os.getenv("TTS_BACKEND", "http") == "websocket":
+        from .volcano_ws_service import VolcanoWebSocketTTSService # Requires the websockets package
+        return VolcanoWebSocketTTSService(app_id, access_key, resource_id,
+                                          api_endpoint=os.getenv("TTS_WS_ENDPOINT", "wss://openspeech.bytedance.com/api/v3/tts/bidirection"),
+                                          cache=get_tts_cache(), audio_format=os.getenv("TTS_AUDIO_FORMAT", "mp3"))
+    return VolcanoEngineService(app_id, access_key, resource_id, cache=get_tts_cache(),
+                                audio_format=os.getenv("TTS_AUDIO_FORMAT", "mp3"))
+
+
+@contextmanager
+def open_generator(project_id: str, llm_endpoint: str, tts_app_id: str, tts_access_key: str, tts_resource_id: str):
+    """
+    Builds an AudiobookGenerator for a project, configured from the environment, and closes its
+    TTS service and character store when the block exits, also if building it failed halfway.
+    Used by both the API and the GUI so they configure generation the same way.
+    """
+    character_manager = None
+    volcano_service = None
+    try:
+        character_manager = create_character_manager(project_id)
+        # Set a default voice for narrator if not already set
+        if not character_manager.get_voice_id("旁白"):
+            character_manager.set_voice_id("旁白", "zh_male_jieshuoxiaoming_moon_bigtts")
+
+        annotation_cache = AnnotationCache(os.getenv("LLM_CACHE_DIR", os.path.join(OUTPUT_DIR, "annotation_cache")))
+        llm_service = LLMService(llm_endpoint, character_manager, annotation_cache=annotation_cache,
+                                 stream_responses=os.getenv("LLM_STREAM", "0") == "1")
+        volcano_service = create_tts_service(tts_app_id, tts_access_key, tts_resource_id)
+
+        yield AudiobookGenerator(
+            llm_service=llm_service,
+            volcano_service=volcano_service,
+            character_manager=character_manager,
+            output_base_dir=OUTPUT_DIR,
+            max_tts_workers=int(os.getenv("TTS_MAX_WORKERS", "0")) or None,
+            export_m4b=os.getenv("EXPORT_M4B", "0") == "1",
+            mastering=AudioMastering() if os.getenv("AUDIO_MASTERING", "0") == "1" else None,
+            llm_batch_size=int(os.getenv("LLM_BATCH_SIZE", "1")),
+            coalesce_segments=os.getenv("COALESCE_SEGMENTS", "1") == "1",
+            stream_segment_seconds=float(os.getenv("STREAM_SEGMENT_SECONDS", "10"))
+        )
+    finally:
+        if volcano_service is not None:
+            volcano_service.close()
+        if character_manager is not None:
+            character_manager.close()
@@ -0,0 +1,147 @@
+import re
+
+# A sentence ends at a run of terminal punctuation, together with any closing quotes or brackets after it
+SENTENCE_PATTERN = re.compile(r'.+?(?:[。！？!?；;…]+[”’」』）)"\']*|$)', re.S)
+# Weaker break points used when a single sentence is still too long
+CLAUSE_PATTERN = re.compile(r'.+?(?:[，,、：:]+|$)', re.S)
+CHAPTER_NUMERAL = r'第[0-9０-９零〇一二三四五六七八九十百千万两]+'
+# A heading marker is followed by whitespace, a title delimiter or the end of the line, so prose such as
+# "第三回合比赛开始了。" or "尾声响起" is not taken for a heading. A comma is not a title delimiter:
+# "第一章，他说道" is a sentence.
+HEADING_END = r'(?=$|[\s:：、.．·\-—_|（(【\[《“"])'
+# 第X章 may also run straight into a short title ("第一章大难不死的男孩"), but not into a word that makes
+# it part of a sentence or another term ("第一章的内容很精彩，他想。", "第一章说的是什么", "第五章节选"),
+# and not into punctuation or a title longer than RUN_ON_TITLE_MAX_CHARS
+RUN_ON_TITLE_MAX_CHARS = 15
+RUN_ON_TITLE = rf'(?!的|之|节|说|讲|写|是|有|在|里|中|后|前|末|完|结|开头|内容)(?=[^\s，,。！？!?；;…：:]{{1,{RUN_ON_TITLE_MAX_CHARS}}}\s*$)'
+# Lines that open a new chapter: 第X章/节/回/卷..., common front and back matter, and "Chapter N"
+CHAPTER_HEADING_PATTERN = re.compile(
+    rf'^\s*(?:{CHAPTER_NUMERAL}章(?:{HEADING_END}|{RUN_ON_TITLE})|'
+    rf'(?:{CHAPTER_NUMERAL}[节回卷集部篇]|序章|序言|楔子|引子|尾声|后记|番外|chapter\s+\d+){HEADING_END})', re.I)
+MAX_HEADING_CHARS = 50
+CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count for budgeting: one token per CJK character or full-width
+    punctuation mark, and one per four characters of anything else.
+    """
+    cjk_count = len(CJK_PATTERN.findall(text))
+    return cjk_count + (len(text) - cjk_count + 3) // 4
+
+
+def is_chapter_heading(line: str) -> bool:
+    """Whether a line opens a new chapter."""
+    return bool(CHAPTER_HEADING_PATTERN.match(line)) and len(line.strip()) <= MAX_HEADING_CHARS
+
+
+def split_sentences(text: str) -> list:
+    """Splits text into sentences on Chinese and Western terminal punctuation."""
+    return [s.strip() for s in SENTENCE_PATTERN.findall(text) if s.strip()]
+
+
+class TextChunker:
+    """
+    Splits novel text into chunks for the LLM and segments for the TTS service.
+    Every line is treated as a paragraph, so both single- and double-newline layouts work.
+    Paragraphs are packed into chunks of roughly target_tokens; oversized paragraphs are
+    broken at sentence boundaries. TTS segments are kept under max_tts_chars.
+    """
+    def __init__(self, target_tokens: int = 1000, max_tts_chars: int = 300):
+        self.target_tokens = target_tokens
+        self.max_tts_chars = max_tts_chars
+
+    def iter_chunks(self, lines):
+        """
+        Splits lines into chapters at chapter headings and packs each chapter's non-blank lines into
+        chunks. Consumes lines one at a time and yields (chapter_index, title, chunk) as soon as each
+        chunk is complete, so only the chunk being packed is held in memory.
+        The heading line stays part of the chapter text; text before the first heading forms an
+        untitled chapter (title None) of its own, and a chapter with only blank lines is skipped.
+        """
+        fits = lambda s: estimate_tokens(s) <= self.target_tokens
+        chapter_index = -1
+        title = None
+        current = ""           # Chunk being packed
+        current_cjk = 0        # CJK characters in current, so its estimate is not recounted per line
+        chapter_started = False # Whether the current chapter has any non-blank line yet
+        for line in lines:
+            if is_chapter_heading(line):
+                if current:
+                    yield chapter_index, title, current
+                    current, current_cjk = "", 0
+                # A "chapter" of blank lines is dropped and its heading replaced
+                title = line.strip()
+                chapter_started = False
+            line = line.strip()
+            if not line:
+                continue
+            if not chapter_started:
+                chapter_index += 1
+                chapter_started = True
+            units = [line] if fits(line) else self._split_to_budget(line, fits, "")
+            for unit in units:
+                unit_cjk = len(CJK_PATTERN.findall(unit))
+                if not current:
+                    current, current_cjk = unit, unit_cjk
+                    continue
+                # estimate_tokens(f"{current}\n{unit}"), from the counts of its parts
+                cjk_count = current_cjk + unit_cjk
+                length = len(current) + 1 + len(unit)
+                if cjk_count + (length - cjk_count + 3) // 4 > self.target_tokens:
+                    yield chapter_index, title, current
+                    current, current_cjk = unit, unit_cjk
+                else:
+                    current, current_cjk = f"{current}\n{unit}", cjk_count
+        if current:
+            yield chapter_index, title, current
+
+    def split_for_tts(self, text: str) -> list:
+        """Splits a segment's text into pieces no longer than max_tts_chars."""
+        if len(text) <= self.max_tts_chars:
+            return [text]
+        return self._split_to_budget(text, lambda s: len(s) <= self.max_tts_chars, "")
+
+    def _split_to_budget(self, text: str, fits, separator: str) -> list:
+        """Breaks text at sentence, then clause, then character boundaries until every piece fits."""
+        pieces = []
+        for sentence in split_sentences(text):
+            if fits(sentence):
+                pieces.append(sentence)
+                continue
+            for clause in CLAUSE_PATTERN.findall(sentence):
+                if not clause:
+                    continue
+                if fits(clause):
+                    pieces.append(clause)
+                    continue
+                # No punctuation to break on; cut into the largest pieces that still fit
+                start = 0
+                while start < len(clause):
+                    low, high = start + 1, len(clause)
+                    while low < high:
+                        middle = (low + high + 1) // 2
+                        if fits(clause[start:middle]):
+                            low = middle
+                        else:
+                            high = middle - 1
+                    pieces.append(clause[start:low])
+                    start = low
+        return self._pack(pieces, fits, separator)
+
+    @staticmethod
+    def _pack(pieces: list, fits, separator: str) -> list:
+        """Greedily joins consecutive pieces while the result still fits."""
+        chunks = []
+        current = ""
+        for piece in pieces:
+            candidate = f"{current}{separator}{piece}" if current else piece
+            if current and not fits(candidate):
+                chunks.append(current)
+                current = piece
+            else:
+                current = candidate
+        if current:
+            chunks.append(current)
+        return chunks
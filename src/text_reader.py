@@ -0,0 +1,106 @@
+import re
+import time
+import codecs
+
+# Encodings tried on a file without a byte order mark. GB18030 is a superset of GBK and GB2312
+# and decodes any byte sequence, so it comes last.
+FALLBACK_ENCODINGS = ("utf-8", "gb18030")
+BOMS = ((codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF32_LE, "utf-32"), (codecs.BOM_UTF32_BE, "utf-32"),
+        (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16"))
+SAMPLE_SIZE = 64 * 1024
+# Characters str.splitlines() breaks lines at
+LINE_BREAKS = "\r\n\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
+# Longest line held while waiting for its line break; a longer one is cut after a sentence
+MAX_LINE_CHARS = 64 * 1024
+SENTENCE_END_PATTERN = re.compile(r'[。！？!?；;…]+[”’」』）)"\']*')
+
+
+def detect_encoding(sample: bytes, complete: bool = True) -> str:
+    """
+    Guesses the encoding of a text from its first bytes: a byte order mark if there is one,
+    otherwise the first of FALLBACK_ENCODINGS that decodes the sample. complete tells whether
+    the sample is the whole text; if not, a character cut off at its end is not an error.
+    """
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return encoding
+    for encoding in FALLBACK_ENCODINGS:
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=complete)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return FALLBACK_ENCODINGS[-1]
+
+
+def _line_cut(text: str, max_chars: int) -> int:
+    """Where to cut an overlong line: after its last sentence ending within max_chars, or at max_chars if there is none."""
+    cut = 0
+    for match in SENTENCE_END_PATTERN.finditer(text, 0, max_chars):
+        cut = match.end()
+    return cut or max_chars
+
+
+def iter_text_lines(path: str, encoding: str = None, is_complete=None, block_size: int = 256 * 1024,
+                    poll_interval: float = 0.2, stall_timeout: float = 300.0, max_line_chars: int = MAX_LINE_CHARS):
+    """
+    Yields the lines of a text file one at a time, without line breaks, reading block by block
+    so memory use does not depend on the size of the file. The encoding is detected if not given.
+    Lines are split like str.splitlines(). Undecodable bytes are replaced rather than failing the book.
+    If is_complete is given, the file may still be growing (e.g. an upload in progress): at the
+    end of the data the reader waits for more until is_complete() returns True. is_complete may
+    raise to abort; a file that stops growing for stall_timeout seconds raises TimeoutError.
+    A line longer than max_line_chars (e.g. a book without line breaks) is yielded in pieces cut
+    after sentences, so the unfinished line held between blocks stays bounded too.
+    """
+    def wait_for_data(last_growth):
+        if time.monotonic() - last_growth > stall_timeout:
+            raise TimeoutError(f"No new data in {path} for {stall_timeout:.0f}s")
+        time.sleep(poll_interval)
+
+    with open(path, "rb") as f:
+        complete = is_complete is None or is_complete()
+        last_growth = time.monotonic()
+        sample = f.read(SAMPLE_SIZE)
+        # A growing file is sampled once enough of it has arrived to tell the encodings apart
+        while not complete and len(sample) < SAMPLE_SIZE:
+            complete = is_complete()
+            more = f.read(SAMPLE_SIZE - len(sample))
+            if more:
+                sample += more
+                last_growth = time.monotonic()
+            elif not complete:
+                wait_for_data(last_growth)
+        # The sample is the whole text only if the file ended before SAMPLE_SIZE bytes
+        sample_complete = complete and len(sample) < SAMPLE_SIZE
+        decoder = codecs.getincrementaldecoder(encoding or detect_encoding(sample, sample_complete))(errors="replace")
+
+        pending = decoder.decode(sample)
+        while True:
+            # Check for completion before reading, so no data written before completion is missed
+            complete = is_complete is None or is_complete()
+            block = f.read(block_size)
+            if block:
+                last_growth = time.monotonic()
+                pending += decoder.decode(block)
+            elif complete:
+                pending += decoder.decode(b"", final=True)
+                break
+            else:
+                wait_for_data(last_growth)
+                continue
+
+            lines = pending.splitlines(keepends=True)
+            # The last line may continue in the next block; a trailing \r may be the first half of \r\n
+            pending = ""
+            if lines and (lines[-1][-1] not in LINE_BREAKS or lines[-1].endswith("\r")):
+                pending = lines.pop()
+            for line in lines:
+                yield line.rstrip(LINE_BREAKS)
+            while len(pending) > max_line_chars:
+                cut = _line_cut(pending, max_line_chars)
+                yield pending[:cut]
+                pending = pending[cut:]
+
+        for line in pending.splitlines():
+            yield line
@@ -0,0 +1,139 @@
+import json
+import struct
+
+# Binary framing of the Volcano Engine bidirectional TTS WebSocket API.
+# Every frame is a 4-byte header, an optional event number, an optional session or
+# connection ID (length-prefixed), and a length-prefixed payload. All integers are big-endian.
+
+PROTOCOL_VERSION = 0b0001
+HEADER_SIZE = 0b0001 # In units of 4 bytes
+
+# Message types
+FULL_CLIENT_REQUEST = 0b0001
+AUDIO_ONLY_RESPONSE = 0b1011
+FULL_SERVER_RESPONSE = 0b1001
+ERROR_INFORMATION = 0b1111
+
+# Message type specific flags
+FLAG_WITH_EVENT = 0b0100
+
+# Serialization and compression
+SERIALIZATION_RAW = 0b0000
+SERIALIZATION_JSON = 0b0001
+COMPRESSION_NONE = 0b0000
+
+# Events
+START_CONNECTION = 1
+FINISH_CONNECTION = 2
+CONNECTION_STARTED = 50
+CONNECTION_FAILED = 51
+CONNECTION_FINISHED = 52
+START_SESSION = 100
+CANCEL_SESSION = 101
+FINISH_SESSION = 102
+SESSION_STARTED = 150
+SESSION_CANCELED = 151
+SESSION_FINISHED = 152
+SESSION_FAILED = 153
+TASK_REQUEST = 200
+TTS_SENTENCE_START = 350
+TTS_SENTENCE_END = 351
+TTS_RESPONSE = 352
+
+# Events that belong to the connection rather than a session carry no session ID
+CONNECTION_EVENTS = (START_CONNECTION, FINISH_CONNECTION, CONNECTION_STARTED, CONNECTION_FAILED, CONNECTION_FINISHED)
+
+
+class Frame:
+    """One decoded frame. payload is bytes for audio, otherwise the parsed JSON (or None if empty)."""
+    def __init__(self, message_type: int, event: int = None, session_id: str = None, payload=None, error_code: int = None):
+        self.message_type = message_type
+        self.event = event
+        self.session_id = session_id
+        self.payload = payload
+        self.error_code = error_code
+
+    def __repr__(self):
+        payload = f"<{len(self.payload)} bytes>" if isinstance(self.payload, bytes) else self.payload
+        return f"Frame(type={self.message_type}, event={self.event}, session_id={self.session_id}, error_code={self.error_code}, payload={payload})"
+
+
+def encode_frame(message_type: int, event: int, session_id: str = None, payload=None) -> bytes:
+    """
+    Encodes a frame with an event number. Dict payloads are sent as JSON, bytes as raw data.
+    session_id holds the connection ID for CONNECTION_STARTED and is ignored for other connection events.
+    """
+    serialization = SERIALIZATION_RAW if isinstance(payload, bytes) else SERIALIZATION_JSON
+    if isinstance(payload, bytes):
+        payload_bytes = payload
+    else:
+        payload_bytes = json.dumps(payload if payload is not None else {}, ensure_ascii=False).encode("utf-8")
+
+    frame = bytearray([
+        (PROTOCOL_VERSION << 4) | HEADER_SIZE,
+        (message_type << 4) | FLAG_WITH_EVENT,
+        (serialization << 4) | COMPRESSION_NONE,
+        0
+    ])
+    frame += struct.pack(">i", event)
+    if event not in CONNECTION_EVENTS or (event == CONNECTION_STARTED and session_id is not None):
+        id_bytes = (session_id or "").encode("utf-8")
+        frame += struct.pack(">I", len(id_bytes)) + id_bytes
+    frame += struct.pack(">I", len(payload_bytes)) + payload_bytes
+    return bytes(frame)
+
+
+def encode_error_frame(error_code: int, payload: dict) -> bytes:
+    """Encodes an error frame as sent by the server."""
+    payload_bytes = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    header = bytes([(PROTOCOL_VERSION << 4) | HEADER_SIZE, ERROR_INFORMATION << 4, SERIALIZATION_JSON << 4, 0])
+    return header + struct.pack(">I", error_code) + struct.pack(">I", len(payload_bytes)) + payload_bytes
+
+
+def decode_frame(data: bytes) -> Frame:
+    """Decodes one binary WebSocket message. Raises ValueError if it is malformed."""
+    if len(data) < 4:
+        raise ValueError("Frame shorter than its header")
+    header_size = (data[0] & 0x0F) * 4
+    message_type = data[1] >> 4
+    flags = data[1] & 0x0F
+    serialization = data[2] >> 4
+    position = header_size
+
+    def read_uint32():
+        nonlocal position
+        if position + 4 > len(data):
+            raise ValueError("Frame truncated")
+        value = struct.unpack_from(">I", data, position)[0]
+        position += 4
+        return value
+
+    def read_bytes(length):
+        nonlocal position
+        if position + length > len(data):
+            raise ValueError("Frame truncated")
+        value = data[position:position + length]
+        position += length
+        return value
+
+    frame = Frame(message_type)
+    if message_type == ERROR_INFORMATION:
+        frame.error_code = read_uint32()
+    elif flags & FLAG_WITH_EVENT:
+        frame.event = struct.unpack(">i", read_bytes(4))[0]
+        # Connection events have no ID, except CONNECTION_STARTED which may carry the connection ID
+        has_id = frame.event not in CONNECTION_EVENTS
+        if frame.event == CONNECTION_STARTED and position + 8 <= len(data):
+            id_length = struct.unpack_from(">I", data, position)[0]
+            payload_length_at = position + 4 + id_length
+            has_id = (payload_length_at + 4 <= len(data) and
+                      payload_length_at + 4 + struct.unpack_from(">I", data, payload_length_at)[0] == len(data))
+        if has_id:
+            frame.session_id = read_bytes(read_uint32()).decode("utf-8")
+
+    payload = bytes(read_bytes(read_uint32()))
+    if message_type == AUDIO_ONLY_RESPONSE or serialization == SERIALIZATION_RAW:
+        frame.payload = payload
+    else:
+        frame.payload = json.loads(payload) if payload else None
+    return frame
@@ -0,0 +1,151 @@
+import os
+import json
+import pickle
+import threading
+
+VOICE_METADATA_FILE = os.path.join(os.path.dirname(__file__), 'voice_metadata.json')
+# Bump when the preprocessed form changes so stale cache files are rebuilt
+CATALOG_CACHE_VERSION = 1
+
+
+class VoiceCatalog:
+    """
+    Volcano Engine voice metadata, shared by every module of the process.
+    Nothing is read until the catalog is first used. On first use the JSON is parsed and
+    indexes by gender, age, tone, emotion and scenario are built; if cache_path is given,
+    the preprocessed catalog is stored there as a pickle and reused while the JSON is unchanged.
+    """
+    INDEXED_FIELDS = ("gender", "age", "tone", "emotions", "scenario")
+
+    def __init__(self, metadata_path: str = VOICE_METADATA_FILE, cache_path: str = None):
+        self.metadata_path = metadata_path
+        self.cache_path = cache_path
+        self._voices = None
+        self._indexes = None
+        self._table = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._voices is not None:
+                return
+            source_mtime = os.path.getmtime(self.metadata_path)
+            if self.cache_path and os.path.exists(self.cache_path):
+                try:
+                    with open(self.cache_path, "rb") as f:
+                        cached = pickle.load(f)
+                    if cached.get("version") == CATALOG_CACHE_VERSION and cached.get("source_mtime") == source_mtime:
+                        self._indexes = cached["indexes"]
+                        self._table = cached["table"]
+                        self._voices = cached["voices"]
+                        return
+                except Exception as e:
+                    print(f"Ignoring unreadable voice catalog cache {self.cache_path}: {e}")
+
+            with open(self.metadata_path, "r", encoding="utf-8") as f:
+                voices = json.load(f)
+            self._indexes = self._build_indexes(voices)
+            self._table = self._build_table(voices)
+            self._voices = voices
+            if self.cache_path:
+                self._write_cache(source_mtime)
+
+    def _write_cache(self, source_mtime: float):
+        try:
+            cache_dir = os.path.dirname(self.cache_path)
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+            temp_path = f"{self.cache_path}.tmp"
+            with open(temp_path, "wb") as f:
+                pickle.dump({"version": CATALOG_CACHE_VERSION, "source_mtime": source_mtime, "voices": self._voices,
+                             "indexes": self._indexes, "table": self._table}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self.cache_path)
+        except OSError as e:
+            print(f"Could not write voice catalog cache {self.cache_path}: {e}")
+
+    @classmethod
+    def _build_indexes(cls, voices: dict) -> dict:
+        """Returns { field: { value: (voice_id, ...) } }; list fields such as emotions index every element."""
+        indexes = {field: {} for field in cls.INDEXED_FIELDS}
+        for voice_id, meta in voices.items():
+            for field in cls.INDEXED_FIELDS:
+                values = meta.get(field)
+                for value in values if isinstance(values, list) else [values]:
+                    if value:
+                        indexes[field].setdefault(value, []).append(voice_id)
+        return {field: {value: tuple(ids) for value, ids in index.items()} for field, index in indexes.items()}
+
+    @staticmethod
+    def _build_table(voices: dict) -> str:
+        """Renders the voice metadata as a compact table, one voice per line."""
+        lines = ["voice_id|名称|性别|年龄|音色特点|场景|语言|情感"]
+        for voice_id, meta in voices.items():
+            lines.append("|".join([
+                voice_id,
+                meta.get("name_cn", ""),
+                meta.get("gender", ""),
+                meta.get("age", ""),
+                meta.get("tone", ""),
+                meta.get("scenario", ""),
+                meta.get("language", ""),
+                ",".join(meta.get("emotions", []))
+            ]))
+        return "\n".join(lines)
+
+    @property
+    def voices(self) -> dict:
+        """All voices as { voice_id: metadata }."""
+        self._load()
+        return self._voices
+
+    def __contains__(self, voice_id) -> bool:
+        return voice_id in self.voices
+
+    def __len__(self) -> int:
+        return len(self.voices)
+
+    def get(self, voice_id: str) -> dict:
+        """Returns the metadata of a voice, or None if it does not exist."""
+        return self.voices.get(voice_id)
+
+    def find(self, gender: str = None, age: str = None, tone: str = None, emotion: str = None, scenario: str = None) -> list:
+        """Returns the IDs of the voices matching every given attribute, in catalog order."""
+        self._load()
+        criteria = {"gender": gender, "age": age, "tone": tone, "emotions": emotion, "scenario": scenario}
+        matches = None
+        for field, value in criteria.items():
+            if value is None:
+                continue
+            ids = self._indexes[field].get(value, ())
+            matches = set(ids) if matches is None else matches.intersection(ids)
+            if not matches:
+                return []
+        if matches is None:
+            return list(self._voices)
+        return [voice_id for voice_id in self._voices if voice_id in matches]
+
+    def values(self, field: str) -> list:
+        """Returns the distinct values of an indexed field, e.g. values("age")."""
+        self._load()
+        return sorted(self._indexes[field])
+
+    def table(self) -> str:
+        """Returns the compact one-line-per-voice table used in the LLM prompt."""
+        self._load()
+        return self._table
+
+
+_CATALOG = None
+_CATALOG_LOCK = threading.Lock()
+
+
+def get_voice_catalog() -> VoiceCatalog:
+    """
+    Returns the process-wide catalog. Set VOICE_CATALOG_CACHE to a file path to keep
+    the preprocessed catalog between runs.
+    """
+    global _CATALOG
+    with _CATALOG_LOCK:
+        if _CATALOG is None:
+            _CATALOG = VoiceCatalog(cache_path=os.getenv("VOICE_CATALOG_CACHE") or None)
+        return _CATALOG
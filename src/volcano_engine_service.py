@@ -1,16 +1,41 @@
 import os
+import time
+import logging
 import requests
 import base64
 import uuid
 import json
 from dotenv import load_dotenv
 
+from .cache import TTSCache
+from .http_client import HttpClient, get_default_client
+from .json_stream import JSONObjectStreamDecoder
+from .metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+TTS_REQUEST_SECONDS = Histogram("audiobook_tts_request_seconds", "Duration of TTS syntheses, cache hits excluded.", ("backend",))
+TTS_FIRST_AUDIO_SECONDS = Histogram("audiobook_tts_first_audio_seconds", "Time until the first audio of a TTS synthesis arrives.", ("backend",))
+TTS_REQUESTS = Counter("audiobook_tts_requests_total", "TTS syntheses by outcome (ok, error, cache_hit).", ("backend", "outcome"))
+TTS_BYTES = Counter("audiobook_tts_audio_bytes_total", "Audio bytes received from the TTS service.", ("backend",))
+
 class VolcanoEngineService:
-    def __init__(self, app_id: str, access_key: str, resource_id: str = "volc.service_type.10029", api_endpoint: str = "https://openspeech.bytedance.com/api/v3/tts/unidirectional"):
+    backend = "http" # Label of this service's TTS metrics
+    def __init__(self, app_id: str, access_key: str, resource_id: str = "volc.service_type.10029", api_endpoint: str = "https://openspeech.bytedance.com/api/v3/tts/unidirectional",
+                 cache: TTSCache = None, audio_format: str = "mp3", sample_rate: int = 24000, http_client: HttpClient = None):
         self.app_id = app_id
         self.access_key = access_key # Renamed from access_token to access_key as per new doc
         self.resource_id = resource_id
         self.api_endpoint = api_endpoint
+        # "pcm" returns raw 16-bit mono samples that can be assembled without decoding
+        self.audio_params = {
+            "format": audio_format,
+            "sample_rate": sample_rate
+        }
+        if audio_format == "mp3":
+            self.audio_params["bit_rate"] = 160 # Default bitrate for MP3
+        self.cache = cache # Optional on-disk cache of previously synthesized audio
+        self.http_client = http_client or get_default_client() # Pooled connections, retries and adaptive concurrency
         self._initialize_volcano_sdk()
 
     def _initialize_volcano_sdk(self):
@@ -20,15 +45,13 @@ class VolcanoEngineService:
         """
         print(f"Initializing Volcano Engine TTS service with AppID: {self.app_id}, ResourceID: {self.resource_id}, Endpoint: {self.api_endpoint}")
 
-    def synthesize_speech(self, text: str, voice_type: str, output_dir: str = "./audio_output") -> str:
+    def synthesize_speech_stream(self, text: str, voice_type: str):
         """
-        Synthesizes speech from text using the specified voice_type via Volcano Engine HTTP API.
-        Handles streaming response.
-        Returns the path to the generated audio file.
+        Synthesizes speech and yields the audio bytes frame by frame as they arrive.
+        The response is parsed with an incremental decoder, so JSON frames split across
+        network chunks are reassembled instead of being mistaken for audio.
+        Raises on network, HTTP or service errors.
         """
-        os.makedirs(output_dir, exist_ok=True)
-        audio_filename = os.path.join(output_dir, f"audio_{uuid.uuid4()}.mp3") # Use UUID for unique filenames
-
         headers = {
             "X-Api-App-Id": self.app_id,
             "X-Api-Access-Key": self.access_key,
@@ -44,71 +67,105 @@ class VolcanoEngineService:
             "req_params": {
                 "text": text,
                 "speaker": voice_type, # Renamed from voice_type to speaker
-                "audio_params": {
-                    "format": "mp3", # Request MP3 format
-                    "sample_rate": 24000, # Default sample rate
-                    "bit_rate": 160 # Default bitrate for MP3
-                },
+                "audio_params": dict(self.audio_params),
                 "namespace": "BidirectionalTTS" # As per new doc example
             }
         }
 
-        try:
-            print(f"\n--- Sending Streaming TTS Request ---")
-            print(f"URL: {self.api_endpoint}")
-            print(f"Headers: {headers}")
-            print(f"Payload: {json.dumps(payload, indent=2, ensure_ascii=False)}")
-            print(f"---------------------------")
-            
-            # Use stream=True for streaming response
-            with requests.post(self.api_endpoint, headers=headers, json=payload, stream=True) as response:
-                response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
-
-                full_audio_data = b""
-                for chunk in response.iter_content(chunk_size=8192):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Sending streaming TTS request to %s\nHeaders: %s\nPayload: %s", self.api_endpoint,
+                         dict(headers, **{"X-Api-Access-Key": "***"}), json.dumps(payload, indent=2, ensure_ascii=False))
+
+        with self.http_client.stream("POST", self.api_endpoint, headers=headers, json=payload) as response:
+            if response.status_code >= 400:
+                print(f"Raw API response on error: {response.text[:500]}")
+            response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
+
+            if response.headers.get("Content-Type", "").startswith("audio/"):
+                # Raw audio instead of JSON frames
+                for chunk in response.iter_content(chunk_size=65536):
                     if chunk:
-                        # Attempt to decode chunk as JSON first
-                        try:
-                            json_data = json.loads(chunk.decode('utf-8'))
-                            # If it's a JSON object with 'data' field, it's base64 audio
-                            if json_data.get("code") == 0 and json_data.get("data"):
-                                full_audio_data += base64.b64decode(json_data["data"])
-                            elif json_data.get("code") == 20000000: # End of stream success code
-                                print("Received end of stream success code.")
-                                break # Exit loop if stream ends successfully
-                            else:
-                                print(f"Received non-audio JSON chunk: {json_data}")
-                        except json.JSONDecodeError:
-                            # If not JSON, assume it's raw audio data (though doc implies base64 in JSON)
-                            # This part might need refinement based on actual API behavior
-                            print("Warning: Received non-JSON chunk. Assuming it's raw audio data.")
-                            full_audio_data += chunk
-                        except Exception as e:
-                            print(f"Error processing chunk: {e}")
-                            # Decide whether to continue or break
-
-                if full_audio_data:
-                    with open(audio_filename, "wb") as f:
-                        f.write(full_audio_data)
-                    print(f"Volcano Engine synthesis successful: Text='{text[:30]}...', Voice='{voice_type}', Saved to='{audio_filename}'")
-                    return audio_filename
-                else:
-                    print(f"Volcano Engine synthesis failed: No audio data received for text: {text[:50]}...")
-                    return None
+                        yield chunk
+                return
+
+            decoder = JSONObjectStreamDecoder()
+            for chunk in response.iter_content(chunk_size=65536):
+                for frame in decoder.feed(chunk):
+                    code = frame.get("code")
+                    if code == 0:
+                        if frame.get("data"):
+                            yield base64.b64decode(frame["data"])
+                    elif code == 20000000: # End of stream success code
+                        logger.debug("Received end of stream success code.")
+                        return
+                    else:
+                        raise RuntimeError(f"TTS service error {code}: {frame.get('message')}")
+            if decoder.errors or decoder.pending:
+                raise RuntimeError(f"TTS stream ended with {decoder.errors} malformed frame(s) and {decoder.pending} undecoded byte(s)")
+
+    def synthesize_speech(self, text: str, voice_type: str, output_dir: str = "./audio_output", output_filename: str = None) -> str:
+        """
+        Synthesizes speech from text using the specified voice_type via Volcano Engine HTTP API.
+        Handles streaming response: audio is written to disk frame by frame, so memory use does
+        not grow with the length of the segment.
+        If output_filename is given the audio is written to that name inside output_dir,
+        otherwise a unique name is generated.
+        Returns the path to the generated audio file.
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        audio_filename = os.path.join(output_dir, output_filename or f"audio_{uuid.uuid4()}.{self.audio_params['format']}") # Use UUID for unique filenames
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(text, voice_type, self.audio_params)
+            if self.cache.get(cache_key, audio_filename):
+                TTS_REQUESTS.labels(backend=self.backend, outcome="cache_hit").inc()
+                print(f"TTS cache hit: Text='{text[:30]}...', Voice='{voice_type}', Saved to='{audio_filename}'")
+                return audio_filename
+
+        # Written under a temporary name and renamed once complete, so a failed request never leaves a truncated file
+        partial_filename = f"{audio_filename}.part"
+        bytes_written = 0
+        outcome = "error"
+        start = time.perf_counter()
+        try:
+            with open(partial_filename, "wb") as f:
+                for audio_chunk in self.synthesize_speech_stream(text, voice_type):
+                    if not bytes_written:
+                        TTS_FIRST_AUDIO_SECONDS.labels(backend=self.backend).observe(time.perf_counter() - start)
+                    f.write(audio_chunk)
+                    bytes_written += len(audio_chunk)
+
+            if bytes_written:
+                outcome = "ok"
+                os.replace(partial_filename, audio_filename)
+                if cache_key is not None:
+                    self.cache.put(cache_key, audio_filename)
+                print(f"Volcano Engine synthesis successful: Text='{text[:30]}...', Voice='{voice_type}', Saved to='{audio_filename}'")
+                return audio_filename
+            else:
+                print(f"Volcano Engine synthesis failed: No audio data received for text: {text[:50]}...")
+                return None
 
         except requests.exceptions.RequestException as e:
             print(f"Network or HTTP error during Volcano Engine synthesis: {e}")
-            if 'response' in locals() and hasattr(response, 'text'):
-                print(f"Raw API response on error: {response.text}")
-            return None
-        except json.JSONDecodeError as e:
-            print(f"Error decoding Volcano Engine response JSON: {e}")
-            raw_response_content = response.text if 'response' in locals() else "(No raw response available)"
-            print(f"Raw response: {raw_response_content[:500]}...")
             return None
         except Exception as e:
             print(f"An unexpected error occurred during Volcano Engine synthesis: {e}")
             return None
+        finally:
+            TTS_REQUEST_SECONDS.labels(backend=self.backend).observe(time.perf_counter() - start)
+            TTS_REQUESTS.labels(backend=self.backend, outcome=outcome).inc()
+            TTS_BYTES.labels(backend=self.backend).inc(bytes_written)
+            if os.path.exists(partial_filename):
+                os.remove(partial_filename)
+
+    def concurrency_limiter(self):
+        """Returns the adaptive limiter of the TTS host, which callers follow to decide how many requests to submit."""
+        return self.http_client.limiter(self.api_endpoint)
+
+    def close(self):
+        """Releases connections held by the service. The HTTP backend uses the shared client, so there is nothing to release."""
 
 # Example Usage (for testing VolcanoEngineService in isolation)
 if __name__ == "__main__":
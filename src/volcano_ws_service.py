@@ -0,0 +1,184 @@
+import uuid
+import threading
+
+from websockets.exceptions import WebSocketException
+from websockets.sync.client import connect
+
+from . import tts_protocol as protocol
+from .cache import TTSCache
+from .volcano_engine_service import VolcanoEngineService
+
+
+class TTSConnectionError(Exception):
+    """The WebSocket connection failed or the server rejected the connection or a session."""
+
+
+class _TTSConnection:
+    """
+    One started bidirectional TTS connection. Used by one thread at a time.
+    Takes the object returned by websockets' connect(), which has to be used as a context manager;
+    the context is entered here and only exited by close(), since a pooled connection outlives
+    the call that opened it.
+    """
+    def __init__(self, client, connection_id: str = None):
+        self._client = client
+        self.websocket = client.__enter__()
+        self.connection_id = connection_id
+        self.broken = False
+
+    def send(self, event: int, session_id: str = None, payload: dict = None):
+        self.websocket.send(protocol.encode_frame(protocol.FULL_CLIENT_REQUEST, event, session_id, payload))
+
+    def receive(self, timeout: float) -> protocol.Frame:
+        message = self.websocket.recv(timeout=timeout)
+        if isinstance(message, str):
+            raise TTSConnectionError(f"Unexpected text message from TTS server: {message[:200]}")
+        frame = protocol.decode_frame(message)
+        if frame.message_type == protocol.ERROR_INFORMATION:
+            raise TTSConnectionError(f"TTS server error {frame.error_code}: {frame.payload}")
+        return frame
+
+    def close(self):
+        try:
+            if not self.broken:
+                self.send(protocol.FINISH_CONNECTION)
+                self.receive(timeout=1.0) # ConnectionFinished
+        except Exception:
+            pass
+        finally:
+            self._client.__exit__(None, None, None)
+
+
+class VolcanoWebSocketTTSService(VolcanoEngineService):
+    """
+    Volcano Engine TTS over the bidirectional WebSocket API.
+    Connections are kept open and pooled per speaker; every segment runs as one session
+    (StartSession, TaskRequest, FinishSession) on a pooled connection, so the WebSocket and
+    TLS handshakes are paid once per connection instead of once per segment.
+    Caching, output files and the synthesize_speech interface are the same as the HTTP backend.
+    """
+    backend = "websocket"
+
+    def __init__(self, app_id: str, access_key: str, resource_id: str = "volc.service_type.10029",
+                 api_endpoint: str = "wss://openspeech.bytedance.com/api/v3/tts/bidirection",
+                 cache: TTSCache = None, audio_format: str = "mp3", sample_rate: int = 24000,
+                 max_idle_per_speaker: int = 2, open_timeout: float = 10.0, receive_timeout: float = 60.0):
+        super().__init__(app_id, access_key, resource_id, api_endpoint, cache=cache, audio_format=audio_format, sample_rate=sample_rate)
+        self.max_idle_per_speaker = max_idle_per_speaker
+        self.open_timeout = open_timeout
+        self.receive_timeout = receive_timeout
+        self._idle_connections = {} # speaker -> [_TTSConnection, ...]
+        self._pool_lock = threading.Lock()
+
+    def _open_connection(self) -> _TTSConnection:
+        headers = {
+            "X-Api-App-Key": self.app_id,
+            "X-Api-Access-Key": self.access_key,
+            "X-Api-Resource-Id": self.resource_id,
+            "X-Api-Connect-Id": str(uuid.uuid4())
+        }
+        connection = _TTSConnection(connect(self.api_endpoint, additional_headers=headers, open_timeout=self.open_timeout, max_size=None))
+        try:
+            connection.send(protocol.START_CONNECTION)
+            frame = connection.receive(self.receive_timeout)
+            if frame.event != protocol.CONNECTION_STARTED:
+                raise TTSConnectionError(f"TTS connection not started: {frame}")
+        except Exception:
+            connection.broken = True
+            connection.close()
+            raise
+        connection.connection_id = frame.session_id
+        print(f"Opened TTS WebSocket connection {connection.connection_id or ''} to {self.api_endpoint}")
+        return connection
+
+    def _acquire_connection(self, speaker: str) -> _TTSConnection:
+        with self._pool_lock:
+            idle = self._idle_connections.get(speaker)
+            if idle:
+                return idle.pop()
+        return self._open_connection()
+
+    def _release_connection(self, speaker: str, connection: _TTSConnection):
+        if not connection.broken:
+            with self._pool_lock:
+                idle = self._idle_connections.setdefault(speaker, [])
+                if len(idle) < self.max_idle_per_speaker:
+                    idle.append(connection)
+                    return
+        connection.close()
+
+    def _run_session(self, connection: _TTSConnection, text: str, voice_type: str):
+        """Runs one synthesis session on the connection and yields the audio as it arrives."""
+        session_id = uuid.uuid4().hex
+        req_params = {"speaker": voice_type, "audio_params": dict(self.audio_params)}
+        connection.send(protocol.START_SESSION, session_id, {
+            "user": {"uid": str(uuid.uuid4())},
+            "event": protocol.START_SESSION,
+            "namespace": "BidirectionalTTS",
+            "req_params": req_params
+        })
+        frame = connection.receive(self.receive_timeout)
+        if frame.event != protocol.SESSION_STARTED:
+            raise TTSConnectionError(f"TTS session not started: {frame}")
+
+        connection.send(protocol.TASK_REQUEST, session_id, {
+            "event": protocol.TASK_REQUEST,
+            "namespace": "BidirectionalTTS",
+            "req_params": dict(req_params, text=text)
+        })
+        connection.send(protocol.FINISH_SESSION, session_id, {})
+
+        while True:
+            frame = connection.receive(self.receive_timeout)
+            if frame.event == protocol.TTS_RESPONSE and isinstance(frame.payload, bytes):
+                if frame.payload:
+                    yield frame.payload
+            elif frame.event == protocol.SESSION_FINISHED:
+                status_code = (frame.payload or {}).get("status_code", 20000000)
+                if status_code != 20000000:
+                    raise RuntimeError(f"TTS session failed with status {status_code}: {frame.payload}")
+                return
+            elif frame.event in (protocol.SESSION_FAILED, protocol.SESSION_CANCELED, protocol.CONNECTION_FAILED):
+                raise TTSConnectionError(f"TTS session ended with event {frame.event}: {frame.payload}")
+
+    def synthesize_speech_stream(self, text: str, voice_type: str):
+        """
+        Synthesizes speech on a pooled WebSocket connection for voice_type and yields the audio
+        as it arrives. A pooled connection that turns out to be closed is replaced once.
+        """
+        for attempt in range(2):
+            # The retry always opens a fresh connection, other idle ones may be stale too
+            connection = self._acquire_connection(voice_type) if attempt == 0 else self._open_connection()
+            received_audio = False
+            completed = False
+            try:
+                for audio_chunk in self._run_session(connection, text, voice_type):
+                    received_audio = True
+                    yield audio_chunk
+                completed = True
+                return
+            except (TTSConnectionError, WebSocketException, OSError) as e:
+                connection.broken = True
+                # Only a connection that failed before any audio arrived (e.g. closed while idle) is retried transparently
+                if received_audio or attempt == 1:
+                    raise
+                print(f"TTS WebSocket connection failed ({e}); retrying on a new connection.")
+            except Exception:
+                connection.broken = True
+                raise
+            finally:
+                if not completed and not connection.broken:
+                    connection.broken = True # Abandoned mid-session, the connection state is unknown
+                self._release_connection(voice_type, connection)
+
+    def concurrency_limiter(self):
+        """Sessions do not go through the HTTP client, so there is no adaptive limit to follow."""
+        return None
+
+    def close(self):
+        """Closes all pooled connections."""
+        with self._pool_lock:
+            connections = [c for idle in self._idle_connections.values() for c in idle]
+            self._idle_connections.clear()
+        for connection in connections:
+            connection.close()
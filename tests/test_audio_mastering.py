@@ -0,0 +1,104 @@
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from src.audio_assembler import StreamingAudioAssembler
+from src.audio_mastering import AudioMastering
+
+SAMPLE_RATE = 24000
+
+
+def tone(ms: int, amplitude: float) -> np.ndarray:
+    t = np.arange(SAMPLE_RATE * ms // 1000) / SAMPLE_RATE
+    return np.rint(amplitude * np.sin(2 * np.pi * 440 * t)).astype(np.int16)
+
+
+def silence(ms: int) -> np.ndarray:
+    return np.zeros(SAMPLE_RATE * ms // 1000, dtype=np.int16)
+
+
+def rms(samples: np.ndarray) -> float:
+    values = samples.astype(np.float64)
+    return float(np.sqrt(np.mean(values * values)))
+
+
+class AudioMasteringTest(unittest.TestCase):
+    def setUp(self):
+        self.mastering = AudioMastering(sample_rate=SAMPLE_RATE)
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        return np.frombuffer(self.mastering.process(samples.tobytes()), dtype=np.int16)
+
+    def test_trims_silence_keeping_padding(self):
+        out = self.process(np.concatenate([silence(500), tone(1000, 3000), silence(700)]))
+        padding = SAMPLE_RATE * 30 // 1000
+        self.assertEqual(len(out), SAMPLE_RATE + 2 * padding)
+        self.assertTrue(np.all(out[:padding // 2] == 0))
+        self.assertTrue(np.all(out[-(padding // 2):] == 0))
+
+    def test_quiet_noise_counts_as_silence(self):
+        noise = np.random.default_rng(0).integers(-20, 20, SAMPLE_RATE // 2).astype(np.int16) # About -66 dBFS
+        out = self.process(np.concatenate([noise, tone(1000, 3000), noise]))
+        self.assertLess(len(out), SAMPLE_RATE * 1.1)
+
+    def test_normalizes_to_target_rms(self):
+        for amplitude in (300, 3000, 20000):
+            with self.subTest(amplitude=amplitude):
+                out = self.process(tone(1000, amplitude))
+                self.assertAlmostEqual(rms(out), self.mastering.target_rms, delta=self.mastering.target_rms * 0.01)
+
+    def test_peak_limited(self):
+        # A spike on a quiet tone: reaching the target RMS would clip the spike, so the gain stops at the peak ceiling
+        samples = tone(1000, 500)
+        samples[SAMPLE_RATE // 2] = 30000
+        out = self.process(samples)
+        self.assertLessEqual(np.max(np.abs(out.astype(np.int32))), self.mastering.max_peak + 1)
+        self.assertLess(rms(out), self.mastering.target_rms)
+
+    def test_silent_segment_dropped(self):
+        self.assertEqual(self.mastering.process(silence(500).tobytes()), b"")
+        self.assertEqual(self.mastering.process(b""), b"")
+
+    def test_pause_between(self):
+        pause_ms = lambda *args: len(self.mastering.pause_between(*args)) * 1000 // (SAMPLE_RATE * 2)
+        self.assertEqual(pause_ms(None, None, "a", 0), 0)
+        self.assertEqual(pause_ms("a", 0, "a", 0), 0)
+        self.assertEqual(pause_ms("a", 0, "b", 0), 250)
+        self.assertEqual(pause_ms("a", 0, "a", 1), 600)
+        self.assertEqual(pause_ms("a", 0, "b", 1), 600)
+
+
+class PausePlacementTest(unittest.TestCase):
+    def setUp(self):
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir, ignore_errors=True)
+        self.assembler = StreamingAudioAssembler(f"{output_dir}/book.mp3", f"{output_dir}/chapters", sample_rate=SAMPLE_RATE,
+                                                 mastering=AudioMastering(sample_rate=SAMPLE_RATE, edge_padding_ms=0))
+        self.addCleanup(self.assembler.abort)
+        self.assembler.start_chapter("第一章")
+
+    def append(self, voice_id: str, paragraph_starts: list) -> int:
+        """Appends one second of a run covering the given paragraphs; returns the pause placed before it, in ms."""
+        before = self.assembler.duration_ms
+        self.assembler.append_pcm(tone(1000, 3000).tobytes(), voice_id, paragraph_starts[0][0], paragraph_starts)
+        return self.assembler.duration_ms - before - 1000
+
+    def test_pause_follows_last_paragraph_of_run(self):
+        self.assertEqual(self.append("a", [((0, 0), 0.0), ((0, 1), 0.5)]), 0)
+        # Continues line 1, where the previous run ended: a change of speaker, not of paragraph
+        self.assertEqual(self.append("b", [((0, 1), 0.0)]), 250)
+        self.assertEqual(self.append("b", [((0, 2), 0.0)]), 600)
+        self.assertEqual(self.append("b", [((1, 0), 0.0), ((1, 1), 0.4)]), 600)
+        self.assertEqual(self.append("b", [((1, 1), 0.0)]), 0)
+
+    def test_paragraph_markers_after_pause(self):
+        self.append("a", [((0, 0), 0.0)])
+        self.append("a", [((0, 1), 0.0), ((0, 2), 0.5)])
+        markers = [(marker["index"], marker["start_ms"]) for marker in self.assembler._current_chapter["paragraphs"]]
+        self.assertEqual(markers, [((0, 0), 0), ((0, 1), 1600), ((0, 2), 2100)])
+
+
+if __name__ == "__main__":
+    unittest.main()
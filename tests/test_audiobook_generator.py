@@ -0,0 +1,299 @@
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from src.audiobook_generator import AudiobookGenerator
+from src.character_manager import CharacterManager
+from src.http_client import AdaptiveConcurrencyLimiter
+from src.llm_service import LLMService
+from src.project_manifest import ProjectManifest
+from src.text_chunker import TextChunker
+from src.voice_catalog import get_voice_catalog
+
+TEXT = "第一章 开始\n哈利波特说：“你好。”\n他走了。\n赫敏问：“去哪里？”\n没有人回答。"
+
+
+def words(text: str) -> str:
+    return re.sub(r'\W', '', text)
+
+
+class FakeTTSService:
+    """Writes one frame of PCM per character and records what it was asked to read."""
+    audio_params = {"format": "pcm", "sample_rate": 24000}
+    cache = None
+    frame = b"\x00\x10" * 240
+
+    def __init__(self):
+        self.requests = []
+        self.http_client = mock.Mock(stats=lambda: {})
+
+    def synthesize_speech(self, text, voice_type, output_dir, output_filename):
+        self.requests.append((voice_type, text))
+        path = os.path.join(output_dir, output_filename)
+        with open(path, "wb") as f:
+            f.write(self.frame * len(text))
+        return path
+
+    def concurrency_limiter(self):
+        return None
+
+
+class LimitedTTSService(FakeTTSService):
+    """Takes a slot of an adaptive limiter for every request, like the HTTP client, and records the peak concurrency."""
+    def __init__(self, initial_limit):
+        super().__init__()
+        self.limiter = AdaptiveConcurrencyLimiter(initial_limit)
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def synthesize_speech(self, text, voice_type, output_dir, output_filename):
+        self.limiter.acquire()
+        try:
+            with self._lock:
+                self.peak = max(self.peak, self.limiter.in_flight)
+            time.sleep(0.02)
+            return super().synthesize_speech(text, voice_type, output_dir, output_filename)
+        finally:
+            self.limiter.release()
+
+    def concurrency_limiter(self):
+        return self.limiter
+
+
+class FixedLLMService(LLMService):
+    """Answers every chunk with the given segments."""
+    def __init__(self, character_manager, segments):
+        super().__init__("http://llm.invalid", character_manager, use_rule_annotator=False)
+        self.segments = segments
+
+    def _call_llm(self, prompt, system_prompt=None):
+        return json.dumps(self.segments, ensure_ascii=False)
+
+
+class BrokenStreamLLMService(LLMService):
+    """Streams the first segments of the answer, then fails; the non-streamed answer is complete."""
+    def __init__(self, character_manager, segments, streamed_count):
+        super().__init__("http://llm.invalid", character_manager, use_rule_annotator=False, stream_responses=True)
+        self.segments = segments
+        self.streamed_count = streamed_count
+        self.calls = 0
+
+    def _stream_llm(self, prompt, system_prompt=None):
+        text = json.dumps(self.segments, ensure_ascii=False)
+        cut = text.index("}", len(json.dumps(self.segments[:self.streamed_count], ensure_ascii=False)) - 2) + 1
+        yield text[:cut]
+        yield text[cut:cut + 5]
+        raise ConnectionError("stream broken")
+
+    def _call_llm(self, prompt, system_prompt=None):
+        self.calls += 1
+        return json.dumps(self.segments, ensure_ascii=False)
+
+
+class StreamRecoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir, ignore_errors=True)
+        encode = mock.patch("src.audio_assembler.encode_pcm_file", lambda pcm_path, output_path, *args, **kwargs: open(output_path, "wb").close())
+        encode.start()
+        self.addCleanup(encode.stop)
+        self.manager = CharacterManager(self.output_dir, flush_interval=0)
+        self.addCleanup(self.manager.close)
+        narrator, harry, hermione = sorted(get_voice_catalog().voices)[:3]
+        self.segments = [
+            {"speaker_name": "旁白", "speaker_voice_id": narrator, "text": "第一章 开始 哈利波特说："},
+            {"speaker_name": "哈利波特", "speaker_voice_id": harry, "text": "你好。"},
+            {"speaker_name": "旁白", "speaker_voice_id": narrator, "text": "他走了。赫敏问："},
+            {"speaker_name": "赫敏", "speaker_voice_id": hermione, "text": "去哪里？"},
+            {"speaker_name": "旁白", "speaker_voice_id": narrator, "text": "没有人回答。"},
+        ]
+        self.text_path = os.path.join(self.output_dir, "book.txt")
+        with open(self.text_path, "w", encoding="utf-8") as f:
+            f.write(TEXT)
+
+    def test_broken_stream_still_synthesizes_whole_chunk(self):
+        llm_service = BrokenStreamLLMService(self.manager, self.segments, streamed_count=2)
+        tts = FakeTTSService()
+        generator = AudiobookGenerator(llm_service, tts, self.manager, output_base_dir=self.output_dir)
+        self.assertIsNotNone(generator.generate_audiobook(self.text_path, "book"))
+        self.assertEqual(llm_service.calls, 1)
+        self.assertEqual(words("".join(text for _, text in tts.requests)), words(TEXT))
+        self.assertEqual(generator.incomplete_paragraphs, [])
+
+    def test_failed_recovery_reports_incomplete(self):
+        llm_service = BrokenStreamLLMService(self.manager, self.segments, streamed_count=2)
+        llm_service._call_llm = lambda prompt, system_prompt=None: llm_service._fallback_response("LLM API调用失败")
+        tts = FakeTTSService()
+        generator = AudiobookGenerator(llm_service, tts, self.manager, output_base_dir=self.output_dir)
+        self.assertIsNotNone(generator.generate_audiobook(self.text_path, "book"))
+        self.assertEqual(generator.incomplete_paragraphs, [0])
+        self.assertNotIn("LLM API调用失败", "".join(text for _, text in tts.requests))
+
+    def test_segments_after_cuts_straddling_segment(self):
+        yielded = [{"text": "第一章 开始 哈利"}]
+        remaining = LLMService._segments_after(yielded, self.segments)
+        self.assertEqual([segment["text"] for segment in remaining], ["波特说：", "你好。", "他走了。赫敏问：", "去哪里？", "没有人回答。"])
+
+
+class TTSConcurrencyTest(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir, ignore_errors=True)
+        encode = mock.patch("src.audio_assembler.encode_pcm_file", lambda pcm_path, output_path, *args, **kwargs: open(output_path, "wb").close())
+        encode.start()
+        self.addCleanup(encode.stop)
+        self.manager = CharacterManager(self.output_dir, flush_interval=0)
+        self.addCleanup(self.manager.close)
+        narrator, harry = sorted(get_voice_catalog().voices)[:2]
+        self.manager.set_voice_id("旁白", narrator)
+        self.manager.set_voice_id("哈利波特", harry)
+        # Every line alternates voices, so each becomes two TTS requests; the rule annotator needs no LLM
+        self.text_path = os.path.join(self.output_dir, "book.txt")
+        with open(self.text_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(f"哈利波特说：“第{n}句。”" for n in range(40)))
+
+    def generate(self, tts, **kwargs):
+        llm_service = LLMService("http://llm.invalid", self.manager)
+        generator = AudiobookGenerator(llm_service, tts, self.manager, output_base_dir=self.output_dir, **kwargs)
+        self.assertIsNotNone(generator.generate_audiobook(self.text_path, "book"))
+        self.assertEqual(len(tts.requests), 80)
+
+    def test_submission_follows_limiter(self):
+        tts = LimitedTTSService(initial_limit=2)
+        self.generate(tts)
+        # The host was kept saturated, so the limit grew and submission followed it past the old fixed pool of 4
+        self.assertGreater(tts.limiter.limit, 5)
+        self.assertGreater(tts.peak, 4)
+        self.assertLessEqual(tts.peak, int(tts.limiter.limit))
+
+    def test_max_tts_workers_caps_submission(self):
+        tts = LimitedTTSService(initial_limit=8)
+        self.generate(tts, max_tts_workers=2)
+        self.assertEqual(tts.peak, 2)
+        self.assertEqual(tts.limiter.limit, 8) # Never saturated
+
+
+def paragraph(i, chapter_index, segments):
+    """Queue items of one annotated paragraph: (voice, text, line) segments, then its end marker."""
+    items = [(i, chapter_index, j, {"speaker_name": voice, "speaker_voice_id": voice, "text": text, "line": line})
+             for j, (voice, text, line) in enumerate(segments)]
+    return items + [(i, chapter_index, None, None)]
+
+
+class CoalesceTest(unittest.TestCase):
+    SEGMENTS = (paragraph(0, 0, [("a", "第一章 开始", 0), ("a", "他走了。", 1), ("b", "你好。", 2), ("b", "再见。", 2)]) +
+                paragraph(1, 0, [("b", "去哪里？", 0), ("a", "没有人回答。" * 3, 1), ("a", "他又走了。", 1), ("a", "天黑了。", 2)]) +
+                paragraph(2, 1, [("a", "第二章", 0), ("a", "早上。", 1)]))
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir, ignore_errors=True)
+        self.manager = CharacterManager(self.output_dir, flush_interval=0)
+        self.addCleanup(self.manager.close)
+
+    def coalesce(self, segments=SEGMENTS, max_tts_chars=20, coalesce_segments=True):
+        generator = AudiobookGenerator(LLMService("http://llm.invalid", self.manager), FakeTTSService(), self.manager,
+                                       output_base_dir=self.output_dir, text_chunker=TextChunker(max_tts_chars=max_tts_chars),
+                                       coalesce_segments=coalesce_segments)
+        return list(generator._coalesce(iter(segments)))
+
+    def test_runs_stay_within_paragraph_and_length(self):
+        runs = self.coalesce()
+        for run in runs:
+            self.assertEqual(len({part["paragraph_index"] for part in run["parts"]}), 1)
+            if len(run["parts"]) > 1:
+                self.assertLessEqual(len(run["text"]), 20)
+        # The split points give back every segment's text
+        texts = [run["text"][part["start"]:part["end"]] for run in runs for part in run["parts"]]
+        self.assertEqual(texts, [segment["text"] for _, _, _, segment in self.SEGMENTS if segment])
+        self.assertEqual([run["text"] for run in runs],
+                         ["第一章 开始\n他走了。", "你好。再见。", "去哪里？", "没有人回答。没有人回答。没有人回答。", "他又走了。\n天黑了。", "第二章\n早上。"])
+        self.assertEqual([run["chapter_index"] for run in runs], [0, 0, 0, 0, 0, 1])
+
+    def test_same_voice_across_paragraphs_not_merged(self):
+        runs = self.coalesce(paragraph(0, 0, [("a", "他走了。", 0)]) + paragraph(1, 1, [("a", "第二章", 0)]))
+        self.assertEqual([run["text"] for run in runs], ["他走了。", "第二章"])
+
+    def test_run_keys_deterministic(self):
+        keys = [ProjectManifest.run_key(run["parts"]) for run in self.coalesce()]
+        self.assertEqual(keys, [ProjectManifest.run_key(run["parts"]) for run in self.coalesce()])
+        self.assertEqual(keys, ["00000_000-00000_001", "00000_002-00000_003", "00001_000", "00001_001", "00001_002-00001_003", "00002_000-00002_001"])
+
+    def test_disabled_keeps_segments(self):
+        runs = self.coalesce(coalesce_segments=False)
+        self.assertEqual([ProjectManifest.run_key(run["parts"]) for run in runs],
+                         [ProjectManifest.segment_key(i, j) for i, _, j, segment in self.SEGMENTS if segment])
+
+    def test_paragraph_starts(self):
+        run = self.coalesce()[0]
+        self.assertEqual(AudiobookGenerator._paragraph_starts(run), [((0, 0), 0.0), ((0, 1), 7 / 11)])
+
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir, ignore_errors=True)
+        encode = mock.patch("src.audio_assembler.encode_pcm_file", lambda pcm_path, output_path, *args, **kwargs: open(output_path, "wb").close())
+        encode.start()
+        self.addCleanup(encode.stop)
+        self.manager = CharacterManager(self.output_dir, flush_interval=0)
+        self.addCleanup(self.manager.close)
+        narrator, harry, hermione = sorted(get_voice_catalog().voices)[:3]
+        # Adjacent narration segments, which coalescing merges
+        self.segments = [
+            {"speaker_name": "旁白", "speaker_voice_id": narrator, "text": "第一章 开始"},
+            {"speaker_name": "旁白", "speaker_voice_id": narrator, "text": "哈利波特说："},
+            {"speaker_name": "哈利波特", "speaker_voice_id": harry, "text": "你好。"},
+            {"speaker_name": "旁白", "speaker_voice_id": narrator, "text": "他走了。"},
+            {"speaker_name": "旁白", "speaker_voice_id": narrator, "text": "赫敏问："},
+            {"speaker_name": "赫敏", "speaker_voice_id": hermione, "text": "去哪里？"},
+            {"speaker_name": "旁白", "speaker_voice_id": narrator, "text": "没有人回答。"},
+        ]
+        self.text_path = os.path.join(self.output_dir, "book.txt")
+        with open(self.text_path, "w", encoding="utf-8") as f:
+            f.write(TEXT)
+
+    def generate(self, coalesce_segments):
+        """Generates the book and returns the TTS requests and the checkpointed audio reused, as (text, bytes of audio)."""
+        tts = FakeTTSService()
+        reused = []
+        get_segment_audio = ProjectManifest.get_segment_audio
+
+        def spy(manifest, segment_key, text, voice_id):
+            path = get_segment_audio(manifest, segment_key, text, voice_id)
+            if path:
+                reused.append((text, os.path.getsize(path)))
+            return path
+
+        generator = AudiobookGenerator(FixedLLMService(self.manager, self.segments), tts, self.manager,
+                                       output_base_dir=self.output_dir, coalesce_segments=coalesce_segments)
+        with mock.patch.object(ProjectManifest, "get_segment_audio", spy):
+            self.assertIsNotNone(generator.generate_audiobook(self.text_path, "book"))
+        return tts.requests, reused
+
+    def test_toggling_coalescing_reuses_only_matching_audio(self):
+        for first, second in ((True, False), (False, True)):
+            with self.subTest(first=first, second=second):
+                shutil.rmtree(os.path.join(self.output_dir, "book_chunks"), ignore_errors=True)
+                requests, _ = self.generate(first)
+                requests_again, reused = self.generate(first)
+                self.assertEqual((requests_again, len(reused)), ([], len(requests)))
+                requests_toggled, reused = self.generate(second)
+                # Runs that changed are synthesized again; only audio of the same text and voice is reused
+                self.assertTrue(requests_toggled)
+                self.assertTrue(reused)
+                for text, size in reused:
+                    self.assertEqual(size, len(FakeTTSService.frame) * len(text))
+                # Together they cover the text once
+                self.assertEqual(sorted(words("".join(text for _, text in requests_toggled) + "".join(text for text, _ in reused))),
+                                 sorted(words(TEXT)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from src.character_store import SQLiteCharacterStore
+
+
+class SQLiteCharacterStoreTest(unittest.TestCase):
+    def setUp(self):
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir, ignore_errors=True)
+        self.store = SQLiteCharacterStore(os.path.join(base_dir, "characters.db"), "book")
+
+    def test_close_closes_connections_of_other_threads(self):
+        connections = []
+
+        def worker():
+            self.store.set_voice_id("哈利波特", "voice_a")
+            connections.append(self.store._connection())
+
+        for _ in range(3):
+            thread = threading.Thread(target=worker)
+            thread.start()
+            thread.join()
+        connections.append(self.store._connection())
+        self.assertEqual(len(set(map(id, connections))), 4)
+        self.store.close()
+        for connection in connections:
+            with self.assertRaises(sqlite3.ProgrammingError): # Cannot operate on a closed database
+                connection.execute("SELECT 1")
+
+    def test_usable_after_close(self):
+        self.store.add_alias("哈利波特", "哈利")
+        self.store.close()
+        self.assertEqual(self.store.get_canonical_name("哈利"), "哈利波特")
+        self.store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
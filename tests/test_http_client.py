@@ -0,0 +1,142 @@
+import io
+import time
+import unittest
+from email.utils import formatdate
+from unittest import mock
+
+import requests
+
+from src.http_client import AdaptiveConcurrencyLimiter, HttpClient
+
+URL = "https://tts.example.com/api"
+
+
+def response(status_code: int, headers: dict = None) -> requests.Response:
+    result = requests.Response()
+    result.status_code = status_code
+    result.headers.update(headers or {})
+    result.raw = io.BytesIO(b"{}")
+    return result
+
+
+class AdaptiveConcurrencyLimiterTest(unittest.TestCase):
+    def test_grows_only_while_saturated(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=2)
+        limiter.acquire()
+        limiter.release()
+        self.assertEqual(limiter.limit, 2) # One request of two slots: not saturated
+        limiter.acquire()
+        limiter.acquire()
+        limiter.release()
+        self.assertEqual(limiter.limit, 2.5)
+        limiter.release()
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_throttle_halves_once_per_cooldown(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=8, cooldown=60)
+        for _ in range(3):
+            limiter.acquire()
+        for _ in range(3):
+            limiter.release(throttled=True)
+        self.assertEqual(limiter.limit, 4)
+
+    def test_bounds(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=2, min_limit=1, max_limit=2, cooldown=0)
+        for _ in range(2):
+            limiter.acquire()
+        limiter.release()
+        limiter.release()
+        self.assertEqual(limiter.limit, 2)
+        for _ in range(3):
+            limiter.acquire()
+            limiter.release(throttled=True)
+        self.assertEqual(limiter.limit, 1)
+
+    def test_failure_leaves_limit(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=1)
+        limiter.acquire()
+        limiter.release(failed=True)
+        self.assertEqual(limiter.limit, 1)
+
+
+class HttpClientRetryTest(unittest.TestCase):
+    def setUp(self):
+        self.client = HttpClient(max_retries=2, backoff_base=0.5, backoff_max=30)
+        sleep = mock.patch("src.http_client.time.sleep")
+        self.sleep = sleep.start()
+        self.addCleanup(sleep.stop)
+
+    def send(self, *outcomes):
+        """Sends one request whose attempts return or raise the given outcomes in turn."""
+        self.client.session.request = mock.Mock(side_effect=list(outcomes))
+        return self.client.post(URL)
+
+    def assert_released(self):
+        self.assertEqual(self.client.limiter(URL).in_flight, 0)
+
+    def test_retry_after_seconds(self):
+        self.assertEqual(self.client._backoff_delay(0, response(429, {"Retry-After": "3"})), 3)
+        self.assertEqual(self.client._backoff_delay(0, response(429, {"Retry-After": "3600"})), 30)
+        self.assertEqual(self.client._backoff_delay(0, response(429, {"Retry-After": "-5"})), 0)
+
+    def test_retry_after_http_date(self):
+        delay = self.client._backoff_delay(0, response(503, {"Retry-After": formatdate(time.time() + 10, usegmt=True)}))
+        self.assertAlmostEqual(delay, 10, delta=1.5)
+        self.assertEqual(self.client._backoff_delay(0, response(503, {"Retry-After": formatdate(time.time() - 10, usegmt=True)})), 0)
+
+    def test_invalid_retry_after_uses_backoff(self):
+        for attempt in range(6):
+            delay = self.client._backoff_delay(attempt, response(503, {"Retry-After": "soon"}))
+            self.assertLessEqual(delay, min(30, 0.5 * 2 ** attempt))
+            self.assertGreaterEqual(delay, 0)
+
+    def test_retries_throttled_status(self):
+        result = self.send(response(429, {"Retry-After": "2"}), response(200))
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(self.sleep.call_args_list, [mock.call(2)])
+        self.assertEqual(self.client.limiter(URL).limit, 2) # Halved by the 429
+        self.assert_released()
+
+    def test_returns_last_error_response(self):
+        result = self.send(response(500), response(502), response(503))
+        self.assertEqual(result.status_code, 503)
+        self.assertEqual(self.sleep.call_count, 2)
+        self.assert_released()
+
+    def test_connection_errors_retried_then_raised(self):
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self.send(*[requests.exceptions.ConnectionError("refused")] * 3)
+        self.assertEqual(self.client.session.request.call_count, 3)
+        self.assertEqual(self.client.limiter(URL).limit, 4) # Not a sign of throttling
+        self.assert_released()
+
+    def test_timeout_retried_and_throttles(self):
+        result = self.send(requests.exceptions.ConnectTimeout("slow"), response(200))
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(self.client.limiter(URL).limit, 2)
+        self.assert_released()
+
+    def test_read_timeout_not_retried_when_disabled(self):
+        self.client.retry_read_timeouts = False
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            self.send(requests.exceptions.ReadTimeout("slow"), response(200))
+        self.assertEqual(self.client.session.request.call_count, 1)
+        self.assertEqual(self.client.limiter(URL).limit, 4)
+        self.assert_released()
+
+    def test_other_exceptions_release_slot(self):
+        for error in (ValueError("bad request"), KeyboardInterrupt()):
+            with self.subTest(error=type(error).__name__):
+                with self.assertRaises(type(error)):
+                    self.send(error)
+                self.assert_released()
+
+    def test_stream_holds_slot_until_exit(self):
+        self.client.session.request = mock.Mock(return_value=response(200))
+        with self.client.stream("POST", URL):
+            self.assertEqual(self.client.limiter(URL).in_flight, 1)
+        self.assert_released()
+
+
+if __name__ == "__main__":
+    unittest.main()
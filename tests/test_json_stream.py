@@ -0,0 +1,85 @@
+import base64
+import json
+import os
+import unittest
+
+from src.json_stream import IncrementalJSONArrayParser, JSONObjectStreamDecoder
+
+
+def tts_stream(audio_chunks: list) -> bytes:
+    """Builds a unidirectional TTS response: one newline-delimited JSON frame per audio chunk, then the end frame."""
+    frames = [{"code": 0, "message": "含有\"引号\"、反斜杠\\和{括号}的消息", "data": base64.b64encode(chunk).decode("ascii")}
+              for chunk in audio_chunks]
+    frames.append({"code": 20000000, "message": "OK", "data": None})
+    return b"".join(json.dumps(frame, ensure_ascii=False).encode("utf-8") + b"\n" for frame in frames)
+
+
+class JSONObjectStreamDecoderTest(unittest.TestCase):
+    def setUp(self):
+        self.audio_chunks = [os.urandom(97), os.urandom(1), os.urandom(64)]
+        self.stream = tts_stream(self.audio_chunks)
+
+    def _decode(self, pieces) -> tuple:
+        decoder = JSONObjectStreamDecoder()
+        frames = []
+        for piece in pieces:
+            frames.extend(decoder.feed(piece))
+        audio = b"".join(base64.b64decode(frame["data"]) for frame in frames if frame["code"] == 0)
+        return frames, audio, decoder
+
+    def test_split_at_every_offset(self):
+        # Covers splits inside escapes, multibyte characters, base64 data and between frames
+        for offset in range(len(self.stream) + 1):
+            with self.subTest(offset=offset):
+                frames, audio, decoder = self._decode([self.stream[:offset], self.stream[offset:]])
+                self.assertEqual(audio, b"".join(self.audio_chunks))
+                self.assertEqual(len(frames), len(self.audio_chunks) + 1)
+                self.assertEqual(frames[-1]["code"], 20000000)
+                self.assertEqual((decoder.pending, decoder.errors), (0, 0))
+
+    def test_byte_by_byte(self):
+        frames, audio, decoder = self._decode(self.stream[n:n + 1] for n in range(len(self.stream)))
+        self.assertEqual(audio, b"".join(self.audio_chunks))
+        self.assertEqual((decoder.pending, decoder.errors), (0, 0))
+
+    def test_truncated_stream_is_pending(self):
+        _, _, decoder = self._decode([self.stream[:-10]])
+        self.assertGreater(decoder.pending, 0)
+        self.assertEqual(decoder.errors, 0)
+
+
+class IncrementalJSONArrayParserTest(unittest.TestCase):
+    SEGMENTS = [
+        {"speaker_name": "旁白", "speaker_voice_id": "voice_a", "text": "他说：\"走吧\"，然后关上了门\\窗。"},
+        {"speaker_name": "哈利波特", "speaker_voice_id": "voice_b", "text": "括号{}和[方括号]不影响解析。"},
+        {"speaker_name": "赫敏", "speaker_voice_id": "voice_c", "text": "换行\n和你好"},
+    ]
+
+    def setUp(self):
+        self.text = "```json\n" + json.dumps(self.SEGMENTS, ensure_ascii=False, indent=2) + "\n```"
+
+    def test_split_at_every_offset(self):
+        for offset in range(len(self.text) + 1):
+            with self.subTest(offset=offset):
+                parser = IncrementalJSONArrayParser()
+                objects = parser.feed(self.text[:offset]) + parser.feed(self.text[offset:])
+                self.assertEqual(objects, self.SEGMENTS)
+                self.assertTrue(parser.finished)
+                self.assertEqual(parser.errors, 0)
+
+    def test_objects_returned_as_they_complete(self):
+        parser = IncrementalJSONArrayParser()
+        first_end = self.text.index("}") + 1
+        self.assertEqual(parser.feed(self.text[:first_end]), self.SEGMENTS[:1])
+        self.assertFalse(parser.finished)
+
+    def test_malformed_object_counted(self):
+        parser = IncrementalJSONArrayParser()
+        objects = parser.feed('[{"speaker_name": "旁白", "text": 1,}, {"speaker_name": "旁白"}]')
+        self.assertEqual(objects, [{"speaker_name": "旁白"}])
+        self.assertEqual(parser.errors, 1)
+        self.assertTrue(parser.finished)
+
+
+if __name__ == "__main__":
+    unittest.main()
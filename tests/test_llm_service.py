@@ -0,0 +1,60 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from src.cache import AnnotationCache
+from src.character_manager import CharacterManager
+from src.llm_service import LLMService
+from src.voice_catalog import get_voice_catalog
+
+CHUNK = "哈利波特说：“你好。”"
+
+
+class RecordingLLMService(LLMService):
+    """Answers every chunk with the given segments and records the prompts it was sent."""
+    def __init__(self, character_manager, annotation_cache, segments):
+        super().__init__("http://llm.invalid", character_manager, annotation_cache=annotation_cache, use_rule_annotator=False)
+        self.segments = segments
+        self.prompts = []
+
+    def _call_llm(self, prompt, system_prompt=None):
+        self.prompts.append(prompt)
+        return json.dumps(self.segments, ensure_ascii=False)
+
+
+class AnnotationCacheKeyTest(unittest.TestCase):
+    def setUp(self):
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir, ignore_errors=True)
+        self.manager = CharacterManager(base_dir, flush_interval=0)
+        self.addCleanup(self.manager.close)
+        self.voices = sorted(get_voice_catalog().voices)[:3]
+        self.manager.set_voice_id("旁白", self.voices[0])
+        segments = [{"speaker_name": "旁白", "speaker_voice_id": self.voices[0], "text": "哈利波特说："},
+                    {"speaker_name": "哈利波特", "speaker_voice_id": self.voices[1], "text": "你好。"}]
+        self.service = RecordingLLMService(self.manager, AnnotationCache(os.path.join(base_dir, "cache")), segments)
+
+    def test_key_follows_state_in_prompt(self):
+        self.service.process_text_chunk(CHUNK)
+        self.assertEqual(len(self.service.prompts), 1)
+        # The state registered by the answer is stored too, so the same question is not asked again
+        self.service.process_text_chunk(CHUNK)
+        self.assertEqual(len(self.service.prompts), 1)
+        # A character the chunk does not mention still changes the prompt, so the cached answer is not reused
+        self.manager.set_voice_id("赫敏", self.voices[2])
+        self.service.process_text_chunk(CHUNK)
+        self.assertEqual(len(self.service.prompts), 2)
+        self.assertIn("赫敏", self.service.prompts[-1])
+
+    def test_alias_order_does_not_change_key(self):
+        self.manager.add_alias("哈利波特", "哈利")
+        self.manager.add_alias("哈利波特", "波特")
+        state = self.service._character_state()
+        self.manager.character_aliases["哈利波特"].reverse()
+        self.assertEqual(self.service._character_state(), state)
+
+
+if __name__ == "__main__":
+    unittest.main()
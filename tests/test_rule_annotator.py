@@ -0,0 +1,69 @@
+import shutil
+import tempfile
+import unittest
+
+from src.character_manager import CharacterManager
+from src.rule_annotator import RuleBasedAnnotator
+from src.voice_catalog import get_voice_catalog
+
+NARRATOR = "旁白"
+# text -> speaker of its quotation, or None if the LLM has to decide
+CASES = [
+    ("哈利波特说：“你好。”", "哈利波特"),
+    ("哈利低声地说：“你好。”", "哈利波特"),
+    ("“走吧。”赫敏说道。", "赫敏"),
+    ("“小心！”哈利叫道。", "哈利波特"),
+    ("哈利听到赫敏说：“走吧。”", None),
+    ("哈利身边的赫敏说：“走吧。”", None),
+    ("哈利听见有人说：“走吧。”", None),
+    ("哈利让赫敏说：“走吧。”", None),
+    ("哈利和赫敏说：“走吧。”", None),
+    ("哈利知道他说：“走吧。”", None),
+    ("“小心！”哈利身后的人喊道。", None),
+    ("哈利知道：“他来了。”", None),
+    ("哈利被骂：“笨蛋！”", None),
+    ("哈利的朋友说：“你好。”", None),
+    ("老师对哈利说：“你好。”", None),
+    ("他看着哈利，问道：“你好吗？”", None),
+    ("邓布利多说：“你好。”", None), # Not a known character
+    ("哈利说：“你好。”赫敏说：“再见。”", None), # The narration between the quotations names two speakers
+]
+
+
+class RuleBasedAnnotatorTest(unittest.TestCase):
+    def setUp(self):
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir, ignore_errors=True)
+        self.voices = sorted(get_voice_catalog().voices)[:3]
+        self.manager = CharacterManager(base_dir, flush_interval=0)
+        self.addCleanup(self.manager.close)
+        self.manager.set_voice_id(NARRATOR, self.voices[0])
+        self.manager.set_voice_id("哈利波特", self.voices[1])
+        self.manager.add_alias("哈利波特", "哈利")
+        self.manager.set_voice_id("赫敏", self.voices[2])
+        self.annotator = RuleBasedAnnotator(self.manager)
+
+    def test_attribution(self):
+        for text, speaker in CASES:
+            with self.subTest(text=text):
+                segments = self.annotator.annotate(text)
+                if speaker is None:
+                    self.assertIsNone(segments)
+                else:
+                    self.assertIsNotNone(segments)
+                    quoted = [segment for segment in segments if segment["speaker_name"] != NARRATOR]
+                    self.assertEqual([segment["speaker_name"] for segment in quoted], [speaker])
+
+    def test_narration_only(self):
+        segments = self.annotator.annotate("第一章 开始\n他走了。")
+        self.assertEqual(segments, [{"speaker_name": NARRATOR, "speaker_voice_id": self.voices[0], "text": "第一章 开始\n他走了。"}])
+
+    def test_invalid_voices_not_used(self):
+        self.manager.set_voice_id(NARRATOR, "narrator_voice_id")
+        self.manager.set_voice_id("赫敏", "not_a_voice")
+        self.assertEqual(self.annotator.annotate("他走了。")[0]["speaker_voice_id"], self.annotator.default_narrator_voice_id)
+        self.assertIsNone(self.annotator.annotate("“走吧。”赫敏说道。"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import unittest
+
+from src.text_chunker import TextChunker, estimate_tokens, is_chapter_heading
+
+
+def reference_chunks(chunker: TextChunker, text: str) -> list:
+    """
+    The list-based chunking iter_chunks replaced: split the whole text into chapters, then pack each
+    chapter's lines. Checkpoints are keyed by chunk, so iter_chunks has to reproduce it exactly.
+    """
+    chapters = []
+    title = None
+    lines = []
+    for line in text.splitlines():
+        if is_chapter_heading(line):
+            if any(l.strip() for l in lines):
+                chapters.append((title, lines))
+            title = line.strip()
+            lines = []
+        lines.append(line)
+    if any(l.strip() for l in lines):
+        chapters.append((title, lines))
+
+    fits = lambda s: estimate_tokens(s) <= chunker.target_tokens
+    result = []
+    for chapter_index, (title, lines) in enumerate(chapters):
+        units = []
+        for line in lines:
+            line = line.strip()
+            if line:
+                units.extend([line] if fits(line) else chunker._split_to_budget(line, fits, ""))
+        result.extend((chapter_index, title, chunk) for chunk in chunker._pack(units, fits, "\n"))
+    return result
+
+
+BOOK = "\n".join([
+    "前言写在这里。",
+    "",
+    "第一章 开始",
+    "",
+    "哈利波特说：“你好。”",
+    "他走了很久很久，终于到了。" * 40, # Longer than a chunk, split at sentences
+    "没有标点的一行" * 60,              # Longer than a chunk, without sentence breaks
+    "   ",
+    "第二章",                          # Only blank lines follow; the heading line is the whole chapter
+    "",
+    "",
+    "第三章 结束",
+    "赫敏问：“去哪里？”",
+    "The quick brown fox jumps over the lazy dog. " * 30,
+    "",
+    "尾声",
+    "没有人回答。",
+])
+
+# line -> whether it opens a new chapter
+HEADINGS = [
+    ("第一章", True),
+    ("第一章 开始", True),
+    ("  第十二章　风起云涌", True),
+    ("第一章：开始", True),
+    ("第一章《开始》", True),
+    ("第１２章 - 归来", True),
+    ("第一章大难不死的男孩", True),
+    ("第3节 方法", True),
+    ("第三回 宝玉初会", True),
+    ("第一卷（上）", True),
+    ("序章", True),
+    ("尾声", True),
+    ("Chapter 12", True),
+    ("CHAPTER 3: The End", True),
+    ("第三回合比赛开始了。", False),
+    ("尾声响起", False),
+    ("第一章的内容很精彩，他想。", False),
+    ("第一章，他说道", False),
+    ("第五章节选", False),
+    ("第一章说的是什么", False),
+    ("第一章里他说了很多话", False),
+    ("第一章他走了。", False),
+    ("第一章大难不死的男孩和他的朋友们一起去了很远的地方", False), # Too long to be a run-on title
+    ("第五节课开始了", False),
+    ("Chapters 1 to 3", False),
+    ("第一章 " + "很长" * 30, False),
+]
+
+class ChapterHeadingTest(unittest.TestCase):
+    def test_headings(self):
+        for line, expected in HEADINGS:
+            with self.subTest(line=line):
+                self.assertEqual(is_chapter_heading(line), expected)
+
+
+class IterChunksTest(unittest.TestCase):
+    def test_same_chunks_as_list_chunking(self):
+        for target_tokens in (20, 50, 120, 1000):
+            with self.subTest(target_tokens=target_tokens):
+                chunker = TextChunker(target_tokens=target_tokens)
+                chunks = list(chunker.iter_chunks(BOOK.splitlines()))
+                self.assertEqual(chunks, reference_chunks(chunker, BOOK))
+                self.assertTrue(all(estimate_tokens(chunk) <= target_tokens for _, _, chunk in chunks))
+
+    def test_chapters(self):
+        chunks = list(TextChunker().iter_chunks(BOOK.splitlines()))
+        self.assertEqual([(index, title) for index, title, _ in chunks],
+                         [(0, None), (1, "第一章 开始"), (2, "第二章"), (3, "第三章 结束"), (4, "尾声")])
+        self.assertTrue(chunks[1][2].startswith("第一章 开始\n哈利波特说："))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import os
+import tempfile
+import unittest
+
+from src.text_reader import SAMPLE_SIZE, detect_encoding, iter_text_lines
+
+
+class IterTextLinesTest(unittest.TestCase):
+    def _write(self, data: bytes) -> str:
+        fd, path = tempfile.mkstemp(suffix=".txt")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_utf8_sample_cut_mid_character(self):
+        # A file larger than the sample, with the sample ending inside a multibyte character
+        for offset in range(3):
+            text = "a" * offset + "哈利波特说：“你好。”\n" * (SAMPLE_SIZE // 20)
+            data = text.encode("utf-8")
+            self.assertGreater(len(data), SAMPLE_SIZE)
+            path = self._write(data)
+            with self.subTest(offset=offset):
+                lines = list(iter_text_lines(path))
+                self.assertEqual(lines[:2], text.splitlines()[:2]) # A misdetected encoding garbles the start
+                self.assertEqual(lines, text.splitlines())
+
+    def test_gbk_detected(self):
+        text = "第一章 开始\n他说：“你好。”\n" * 5000
+        path = self._write(text.encode("gbk"))
+        self.assertEqual(list(iter_text_lines(path)), text.splitlines())
+
+    def test_long_line_cut_after_sentences(self):
+        sentence = "他走了很久很久，终于到了。"
+        text = "第一章 开始\n" + sentence * 2000 + "\n" + "没有标点的一行" * 500 + "\n尾声"
+        path = self._write(text.encode("utf-8"))
+        lines = list(iter_text_lines(path, block_size=1024, max_line_chars=1000))
+        self.assertEqual("".join(lines), text.replace("\n", ""))
+        self.assertTrue(all(len(line) <= 1000 for line in lines))
+        self.assertEqual((lines[0], lines[-1]), ("第一章 开始", "尾声"))
+        for line in lines:
+            if line.startswith("他"):
+                self.assertTrue(line.endswith("。"))
+
+    def test_truncated_sample_is_not_an_error(self):
+        data = "你好".encode("utf-8")
+        self.assertEqual(detect_encoding(data[:-1], complete=False), "utf-8")
+
+
+if __name__ == "__main__":
+    unittest.main()
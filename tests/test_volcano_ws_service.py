@@ -0,0 +1,62 @@
+import shutil
+import tempfile
+import unittest
+
+from src import tts_protocol as protocol
+from src.mock_tts_server import MockTTSServer
+from src.volcano_ws_service import TTSConnectionError, VolcanoWebSocketTTSService
+
+
+class VolcanoWebSocketTTSServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.server = MockTTSServer(ms_per_char=5).start()
+        self.addCleanup(self.server.stop)
+        self.service = VolcanoWebSocketTTSService("app", "key", api_endpoint=self.server.url, audio_format="pcm", receive_timeout=5.0)
+        self.addCleanup(self.service.close)
+
+    def _synthesize(self, text: str, speaker: str) -> bytes:
+        return b"".join(self.service.synthesize_speech_stream(text, speaker))
+
+    def test_audio_matches_server(self):
+        self.assertEqual(self._synthesize("你好。", "voice_a"), self.server.synthesize("你好。", "voice_a"))
+
+    def test_connection_reused_per_speaker(self):
+        for text in ("第一句。", "第二句。", "第三句。"):
+            self._synthesize(text, "voice_a")
+        self.assertEqual(self.server.connections_opened, 1)
+        self._synthesize("另一个声音。", "voice_b")
+        self._synthesize("再来一次。", "voice_a")
+        self.assertEqual(self.server.connections_opened, 2)
+
+    def test_stale_pooled_connection_replaced(self):
+        self._synthesize("第一句。", "voice_a")
+        stale = self.service._idle_connections["voice_a"][0]
+        stale.websocket.close() # As if the server had dropped the idle connection
+        self.assertEqual(self._synthesize("第二句。", "voice_a"), self.server.synthesize("第二句。", "voice_a"))
+        self.assertEqual(self.server.connections_opened, 2)
+        self.assertNotIn(stale, self.service._idle_connections["voice_a"])
+
+    def test_session_failed(self):
+        # The mock rejects a session without a speaker with SessionFailed
+        with self.assertRaises(TTSConnectionError):
+            self._synthesize("你好。", "")
+        self.assertEqual(self.server.sessions_finished, 0)
+        self.assertFalse(self.service._idle_connections.get(""))
+
+    def test_error_frame(self):
+        connection = self.service._open_connection()
+        self.addCleanup(connection.close)
+        connection.send(protocol.TASK_REQUEST, "unknown_session", {})
+        with self.assertRaises(TTSConnectionError):
+            connection.receive(timeout=5.0)
+
+    def test_synthesize_speech_writes_file(self):
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir, ignore_errors=True)
+        path = self.service.synthesize_speech("你好。", "voice_a", output_dir=output_dir, output_filename="segment.pcm")
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), self.server.synthesize("你好。", "voice_a"))
+
+
+if __name__ == "__main__":
+    unittest.main()